@@ -0,0 +1,147 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+
+def hash_file(path, digest=None):
+    """Hash the content of a file, or of every file below a directory."""
+    digest = digest or hashlib.sha256()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(os.path.relpath(file_path, path).encode())
+                hash_file(file_path, digest)
+        return digest
+
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest
+
+
+def build_cache_key(input_paths, config_values: dict) -> str:
+    """
+    Compute the cache key of a build from its input files and config values.
+
+    The key changes whenever the content of an input file or one of the config
+    values changes, but not when a file is only touched or moved.
+    """
+    digest = hashlib.sha256()
+    for path in input_paths:
+        digest.update(hash_file(path).digest())
+    digest.update(json.dumps(config_values, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def get_cached_build(cache_path, key):
+    """Return the directory of a cached build or None if it is not cached."""
+    build_path = os.path.join(cache_path, key)
+    if not os.path.isdir(build_path):
+        return None
+    # The modification time of the entry tracks its last use for eviction
+    os.utime(build_path)
+    return build_path
+
+
+def store_build(cache_path, key, build, metadata=None):
+    """
+    Run build(directory) and store the files it writes as a cache entry.
+
+    The files are written to a temporary directory that is renamed to the
+    entry when the build succeeded, so a failed or killed build never leaves a
+    partial entry behind.
+    """
+    os.makedirs(cache_path, exist_ok=True)
+    temporary_path = tempfile.mkdtemp(prefix=".build-", dir=cache_path)
+    try:
+        build(temporary_path)
+        with open(os.path.join(temporary_path, "build.json"), "w") as f:
+            json.dump({"created": time.time(), **(metadata or {})}, f, default=str)
+        if os.path.isdir(os.path.join(cache_path, key)):
+            # Another run stored the same build in the meantime
+            shutil.rmtree(temporary_path)
+        else:
+            os.replace(temporary_path, os.path.join(cache_path, key))
+    except BaseException:
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        raise
+    return os.path.join(cache_path, key)
+
+
+def list_builds(cache_path) -> list:
+    """List the cache entries, most recently used first."""
+    if not os.path.isdir(cache_path):
+        return []
+
+    builds = []
+    for key in os.listdir(cache_path):
+        build_path = os.path.join(cache_path, key)
+        if key.startswith(".") or not os.path.isdir(build_path):
+            continue
+        metadata_path = os.path.join(build_path, "build.json")
+        metadata = {}
+        if os.path.isfile(metadata_path):
+            with open(metadata_path) as f:
+                metadata = json.load(f)
+        size = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(build_path)
+            for name in files
+        )
+        builds.append(
+            {
+                "key": key,
+                "path": build_path,
+                "last_used": os.path.getmtime(build_path),
+                "size": size,
+                **metadata,
+            }
+        )
+    return sorted(builds, key=lambda build: build["last_used"], reverse=True)
+
+
+def evict_builds(cache_path, max_entries):
+    """Remove the least recently used entries beyond max_entries."""
+    for build in list_builds(cache_path)[max_entries:]:
+        logging.log(logging.INFO, f"Evicting cached build {build['key']}")
+        shutil.rmtree(build["path"], ignore_errors=True)
+
+
+def clear_builds(cache_path):
+    """Remove all entries and leftovers of interrupted builds."""
+    if os.path.isdir(cache_path):
+        for name in os.listdir(cache_path):
+            shutil.rmtree(os.path.join(cache_path, name), ignore_errors=True)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Inspect or clear the build cache.")
+    parser.add_argument("command", choices=["list", "clear"])
+    parser.add_argument("cache_path", help="Directory of the build cache")
+    args = parser.parse_args(args)
+
+    if args.command == "clear":
+        clear_builds(args.cache_path)
+        return
+
+    for build in list_builds(args.cache_path):
+        last_used = time.strftime("%Y-%m-%d %H:%M", time.localtime(build["last_used"]))
+        details = ", ".join(
+            f"{name}={value}"
+            for name, value in build.items()
+            if name not in ["key", "path", "last_used", "size", "created"]
+        )
+        print(
+            f"{build['key'][:12]}  {last_used}  {build['size'] / 1e6:8.1f} MB  {details}"
+        )
+
+
+if __name__ == "__main__":
+    main()
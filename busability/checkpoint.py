@@ -0,0 +1,102 @@
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+
+
+def shard_ranges(count, shard_size) -> list:
+    """Split count tasks into numbered shards of shard_size tasks as (start, stop)."""
+    return [
+        (start, min(start + shard_size, count)) for start in range(0, count, shard_size)
+    ]
+
+
+def shard_directory(checkpoint_path, index):
+    return os.path.join(checkpoint_path, f"shard-{index:06d}")
+
+
+def is_shard_done(checkpoint_path, index):
+    return os.path.isdir(shard_directory(checkpoint_path, index))
+
+
+def write_shard(checkpoint_path, index, write):
+    """
+    Run write(directory) and commit the files it writes as a finished shard.
+
+    The files are written to a temporary directory that is renamed to the
+    shard when write succeeded, so a killed run never leaves a partial shard
+    behind and a restarted run can skip every shard directory it finds.
+    """
+    os.makedirs(checkpoint_path, exist_ok=True)
+    temporary_path = tempfile.mkdtemp(prefix=".shard-", dir=checkpoint_path)
+    try:
+        write(temporary_path)
+        os.replace(temporary_path, shard_directory(checkpoint_path, index))
+    except BaseException:
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        raise
+
+
+def attempts_file(checkpoint_path, index):
+    return os.path.join(checkpoint_path, f"attempts-{index:06d}")
+
+
+def get_shard_attempts(checkpoint_path, index) -> int:
+    """Get the number of failed attempts recorded for a shard."""
+    try:
+        with open(attempts_file(checkpoint_path, index)) as f:
+            return int(f.read())
+    except FileNotFoundError:
+        return 0
+
+
+def record_shard_attempt(checkpoint_path, index):
+    """Count a failed attempt of a shard, so a rerun can bound its retries."""
+    os.makedirs(checkpoint_path, exist_ok=True)
+    attempts = get_shard_attempts(checkpoint_path, index) + 1
+    with open(attempts_file(checkpoint_path, index), "w") as f:
+        f.write(str(attempts))
+
+
+def get_pending_shards(checkpoint_path, shards) -> list:
+    """Get the (index, (start, stop)) of the shards that are not done yet."""
+    pending = [
+        (index, shard)
+        for index, shard in enumerate(shards)
+        if not is_shard_done(checkpoint_path, index)
+    ]
+    if len(pending) < len(shards):
+        logging.log(
+            logging.INFO,
+            f"Resuming from {checkpoint_path}: "
+            f"{len(shards) - len(pending)} of {len(shards)} shards are done",
+        )
+    return pending
+
+
+def imap_shards(pool, function, shard_tasks, chunksize=1):
+    """
+    Run function over the tasks of many shards with one pool.imap and yield
+    (shard index, results) for every shard, where results is an iterator over
+    the results of its tasks as they arrive, so they can be written while the
+    workers go on and no shard is ever held in memory.
+
+    shard_tasks is a list of (shard index, list of tasks).
+    """
+    results = pool.imap(
+        function,
+        (task for _, tasks in shard_tasks for task in tasks),
+        chunksize=chunksize,
+    )
+    for index, tasks in shard_tasks:
+        shard_results = itertools.islice(results, len(tasks))
+        yield index, shard_results
+        # Skip the results the caller did not consume to stay at the next shard
+        for _ in shard_results:
+            pass
+
+
+def remove_checkpoint(checkpoint_path):
+    """Remove the shards of a run after they were merged into its output."""
+    shutil.rmtree(checkpoint_path, ignore_errors=True)
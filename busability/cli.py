@@ -0,0 +1,48 @@
+import argparse
+import importlib
+
+# Every stage is imported only when it runs, so a stage does not pay for the
+# imports of the others and nothing is loaded before the config is parsed
+STAGES = {
+    "build-graphs": "busability.create_graphs",
+    "reachability": "busability.get_reachable_nodes_isochrones",
+    "profile": "busability.get_reachable_nodes_profile",
+    "poi-ratio": "busability.get_poi_ratio",
+}
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="busability", description="Run a stage of the busability analysis."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    for stage, module in STAGES.items():
+        stage_parser = commands.add_parser(stage, help=f"Run {module}")
+        stage_parser.add_argument(
+            "--config",
+            required=True,
+            help="Config file of the stage. Its relative paths are resolved "
+            "from the working directory",
+        )
+
+    cache_parser = commands.add_parser("cache", help="Inspect or clear the build cache")
+    cache_parser.add_argument("cache_command", choices=["list", "clear"])
+    cache_parser.add_argument("cache_path", help="Directory of the build cache")
+    return parser
+
+
+def main(args=None):
+    args = get_parser().parse_args(args)
+
+    if args.command == "cache":
+        from busability.build_cache import main as cache_main
+
+        cache_main([args.cache_command, args.cache_path])
+        return
+
+    stage = importlib.import_module(STAGES[args.command])
+    stage.main(args.config)
+
+
+if __name__ == "__main__":
+    main()
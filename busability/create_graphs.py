@@ -1,42 +1,116 @@
+import os
+import shutil
 from datetime import datetime, timedelta
 
-import geopandas as gpd
-
 import logging
 
+import geopandas as gpd
+
+from busability.build_cache import (
+    build_cache_key,
+    evict_builds,
+    get_cached_build,
+    store_build,
+)
+from busability.network_preprocessing.graph_store import FORMAT_VERSION
 from busability.network_preprocessing.network_creator import (
-    get_graphs,
+    create_network_from_gtfs,
+    find_gtfs_feed,
+    load_graph_from_file,
     save_graph_to_file,
 )
+from busability.network_preprocessing.walk_legs import (
+    create_walk_leg_index,
+    save_walk_leg_index,
+)
 from busability.utils import get_config_value
 
-config_path = "../config/lima/config_create_graphs.yml"
+CONFIG_PATH = "../config/lima/config_create_graphs.yml"
 
-matching_column = get_config_value("matching_column", config_path)
 
-minute_threshold = get_config_value("minute_threshold",config_path)
+def main(config_path=CONFIG_PATH):
+    minute_threshold = get_config_value("minute_threshold", config_path)
 
-output_path = get_config_value("output_path", config_path)
+    output_path = get_config_value("output_path", config_path)
 
-city = get_config_value("city_name", config_path)
+    city = get_config_value("city_name", config_path)
 
-iso_polygons_gdf = gpd.read_file(get_config_value("iso_polygons_gdf_path", config_path))
+    iso_polygons_gdf_path = get_config_value("iso_polygons_gdf_path", config_path)
 
-iso_polygons_gdf = iso_polygons_gdf.to_crs(get_config_value("crs", config_path))
+    matching_column = get_config_value("matching_column", config_path)
 
-start_time_string = get_config_value("date", config_path)
+    start_time_string = get_config_value("date", config_path)
 
-start_time_object = datetime.strptime(start_time_string, "%H:%M:%S").time()
+    start_time_object = datetime.strptime(start_time_string, "%H:%M:%S").time()
 
-logging.log(logging.INFO, "Creating graphs for " + city)
+    logging.log(logging.INFO, "Creating graphs for " + city)
 
-end_time_object = datetime.combine(datetime.today(), start_time_object) + timedelta(
-    minutes=minute_threshold
-)
+    end_time_object = datetime.combine(datetime.today(), start_time_object) + timedelta(
+        minutes=minute_threshold
+    )
+
+    # A full-day graph holds every departure of the service day and is sliced to
+    # the analysed window by get_reachable_nodes_isochrones.py, so one build serves
+    # all windows
+    if get_config_value("full_day", config_path):
+        start_time_object, end_time_object = None, None
+        build_config = {"city": city, "full_day": True}
+    else:
+        build_config = {
+            "city": city,
+            "date": start_time_string,
+            "minute_threshold": minute_threshold,
+        }
+
+    cache_path = get_config_value("cache_path", config_path)
+
+    cache_key = build_cache_key(
+        [find_gtfs_feed(city), iso_polygons_gdf_path],
+        {
+            **build_config,
+            "matching_column": matching_column,
+            "graph_format": FORMAT_VERSION,
+        },
+    )
+
+    build_path = get_cached_build(cache_path, cache_key)
+
+    if build_path is None:
+        bus_graph = create_network_from_gtfs(city, start_time_object, end_time_object)
+        # The walk egress of every stop is precomputed next to the graph, so the
+        # analysis scripts memory-map it instead of rebuilding it from the isochrones
+        walk_legs = create_walk_leg_index(
+            gpd.read_file(iso_polygons_gdf_path), matching_column
+        )
+
+        def write_build(directory):
+            save_graph_to_file(bus_graph, os.path.join(directory, "bus_graph"))
+            save_walk_leg_index(walk_legs, os.path.join(directory, "walk_legs"))
+
+        build_path = store_build(
+            cache_path, cache_key, write_build, metadata=build_config
+        )
+        evict_builds(cache_path, get_config_value("cache_max_entries", config_path))
+    else:
+        logging.log(logging.INFO, "Using cached graphs from " + build_path)
+
+    shutil.copytree(
+        os.path.join(build_path, "bus_graph"),
+        output_path + city + "_bus_graph",
+        dirs_exist_ok=True,
+    )
+    shutil.copytree(
+        os.path.join(build_path, "walk_legs"),
+        output_path + city + "_walk_legs",
+        dirs_exist_ok=True,
+    )
+
+    if get_config_value("export_gml", config_path):
+        save_graph_to_file(
+            load_graph_from_file(output_path + city + "_bus_graph"),
+            output_path + city + "_bus_graph.gml",
+        )
 
-bus_graph, walk_graph = get_graphs(
-    city, start_time_object, end_time_object, iso_polygons_gdf, matching_column
-)
 
-save_graph_to_file(bus_graph, output_path + city + "_bus_graph.gml")
-save_graph_to_file(walk_graph, output_path + city + "_walk_graph.gml")
+if __name__ == "__main__":
+    main()
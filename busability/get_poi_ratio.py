@@ -1,35 +1,57 @@
 import pandas as pd
 import geopandas as gpd
 from tqdm import tqdm
+import gc
 import logging
-from multiprocessing import Pool
+import os
+from multiprocessing import Pool, cpu_count
 
-from busability.get_reachable_nodes_isochrones import matching_column
+from busability.build_cache import build_cache_key
+from busability.checkpoint import (
+    get_pending_shards,
+    get_shard_attempts,
+    imap_shards,
+    record_shard_attempt,
+    remove_checkpoint,
+    shard_directory,
+    shard_ranges,
+    write_shard,
+)
 from busability.network_preprocessing.network_creator import (
     get_drive_isochrone,
+    get_outermost_isochrones,
     get_poi_inside_isochrone,
 )
 from busability.network_processing.network_analyzer import (
     get_intersected_isochrones,
     get_multimodal_isos,
 )
+from busability.output_writer import GeoDataFrameWriter, get_output_file
 from busability.utils import get_config_value
+from busability.worker_runtime import worker_chunksize
 
-config_path = "../config/lima/config_get_poi_ratio.yml"
+CONFIG_PATH = "../config/lima/config_get_poi_ratio.yml"
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 logger = logging.getLogger()
 
-matching_column = get_config_value("matching_column", config_path)
+# The input frames of a process, set by load_inputs
+worker_state = {}
+
 
 def process_row(row):
     index = row.name
+    hexagons_centroids_gdf = worker_state["hexagons_centroids_gdf"]
+    drive_iso_gdf = worker_state["drive_iso_gdf"]
+    pois_gdf = worker_state["pois_gdf"]
+    iso_polygons_gdf = worker_state["iso_polygons_gdf"]
+    calc_isochrones_gdf = worker_state["calc_isochrones_gdf"]
+    walk_isochrones_from_hex = worker_state["walk_isochrones_from_hex"]
+    matching_column = worker_state["matching_column"]
     try:
-        start_node = hexagons_centroids_gdf.loc[
-            index, matching_column
-        ]
+        start_node = hexagons_centroids_gdf.loc[index, matching_column]
 
         start_centroid = hexagons_centroids_gdf.loc[index, "geometry"]
 
@@ -45,9 +67,13 @@ def process_row(row):
 
         pois_count_drive = get_poi_inside_isochrone(pois_gdf, drive_iso_for_start_node)
 
-        walk_iso_from_start_centroid = walk_isochrones_from_hex[
-            walk_isochrones_from_hex[matching_column] == start_node
-        ]
+        walk_iso_from_start_centroid, pruned = get_outermost_isochrones(
+            walk_isochrones_from_hex[
+                walk_isochrones_from_hex[matching_column] == start_node
+            ],
+            matching_column,
+        )
+        logger.debug(f"Dropped {pruned} nested walk isochrones of row {index}")
 
         walk_isos_for_start_node = get_intersected_isochrones(
             iso_polygons_gdf, start_centroid
@@ -83,77 +109,257 @@ def process_row(row):
         return index, None, None, None, None
 
 
-try:
-    logger.info("Loading input files...")
-    drive_iso_gdf = gpd.read_file(get_config_value("drive_iso_gdf_path", config_path))
-    pois_gdf = gpd.read_file(get_config_value("pois_gdf_path", config_path))
-    iso_polygons_gdf = gpd.read_file(get_config_value("iso_polygons_gdf_path", config_path))
-    hexagon_gdf = gpd.read_file(get_config_value("hexagon_gdf_path", config_path))
-    hexagons_centroids_gdf = gpd.read_file(
-        get_config_value("hexagon_centroid_gdf_path", config_path)
+def load_inputs(config_path):
+    """Load the input frames of the POI ratio into worker_state."""
+    try:
+        logger.info("Loading input files...")
+        drive_iso_gdf = gpd.read_file(
+            get_config_value("drive_iso_gdf_path", config_path)
+        )
+        pois_gdf = gpd.read_file(get_config_value("pois_gdf_path", config_path))
+        iso_polygons_gdf = gpd.read_file(
+            get_config_value("iso_polygons_gdf_path", config_path)
+        )
+        hexagon_gdf = gpd.read_file(get_config_value("hexagon_gdf_path", config_path))
+        hexagons_centroids_gdf = gpd.read_file(
+            get_config_value("hexagon_centroid_gdf_path", config_path)
+        )
+        calc_isochrones_gdf = gpd.read_file(
+            get_config_value("computed_iso_polygons_gdf_path", config_path)
+        )
+        walk_isochrones_from_hex = gpd.read_file(
+            get_config_value("walk_isochrones_from_hex_gdf_path", config_path)
+        )
+    except Exception as e:
+        logger.critical(f"Failed to read input files: {e}")
+        raise RuntimeError(f"Failed to read input files: {e}")
+
+    try:
+        logger.info("Converting CRS...")
+        crs = get_config_value("crs", config_path)
+        drive_iso_gdf = drive_iso_gdf.to_crs(crs)
+        pois_gdf = pois_gdf.to_crs(crs)
+        iso_polygons_gdf = iso_polygons_gdf.to_crs(crs)
+        hexagon_gdf = hexagon_gdf.to_crs(crs)
+        hexagons_centroids_gdf = hexagons_centroids_gdf.to_crs(crs)
+        calc_isochrones_gdf = calc_isochrones_gdf.to_crs(crs)
+        walk_isochrones_from_hex = walk_isochrones_from_hex.to_crs(crs)
+    except Exception as e:
+        logger.critical(f"Failed to convert CRS: {e}")
+        raise RuntimeError(f"Failed to convert CRS: {e}")
+
+    worker_state.update(
+        {
+            "drive_iso_gdf": drive_iso_gdf,
+            "pois_gdf": pois_gdf,
+            "iso_polygons_gdf": iso_polygons_gdf,
+            "hexagon_gdf": hexagon_gdf,
+            "hexagons_centroids_gdf": hexagons_centroids_gdf,
+            "calc_isochrones_gdf": calc_isochrones_gdf,
+            "walk_isochrones_from_hex": walk_isochrones_from_hex,
+            "matching_column": get_config_value("matching_column", config_path),
+        }
+    )
+
+
+def init_worker(config_path):
+    """
+    Load the inputs in a worker process that did not inherit them by fork.
+
+    Only the fork start method shares the frames of the main process. Under
+    spawn or forkserver, every worker reads all input files again and holds
+    its own copy of the frames.
+    """
+    if not worker_state:
+        load_inputs(config_path)
+
+
+INPUT_PATHS = [
+    "drive_iso_gdf_path",
+    "pois_gdf_path",
+    "iso_polygons_gdf_path",
+    "hexagon_gdf_path",
+    "hexagon_centroid_gdf_path",
+    "computed_iso_polygons_gdf_path",
+    "walk_isochrones_from_hex_gdf_path",
+]
+
+POI_RATIO_COLUMNS = ["poi_ratio", "pois_count_bus", "pois_count_drive"]
+
+# Runs that may leave a shard with failed rows pending before the rows are
+# written as NaN, so a row that always fails cannot block the output forever
+MAX_SHARD_ATTEMPTS = 3
+
+
+def get_checkpoint_path(config_path):
+    """
+    Get the checkpoint directory of a run, keyed by its inputs and settings so
+    a restarted run only resumes from the shards of an identical run.
+    """
+    key = build_cache_key(
+        [get_config_value(name, config_path) for name in INPUT_PATHS],
+        {
+            name: get_config_value(name, config_path)
+            for name in ["crs", "matching_column", "shard_size"]
+        },
     )
-    calc_isochrones_gdf = gpd.read_file(
-        get_config_value("computed_iso_polygons_gdf_path", config_path)
+    return os.path.join(
+        get_config_value("checkpoint_path", config_path),
+        f"{get_config_value('city_name', config_path)}_poi_ratio_{key}",
     )
-    walk_isochrones_from_hex = gpd.read_file(
-        get_config_value("walk_isochrones_from_hex_gdf_path", config_path)
+
+
+def write_poi_ratio_shard(
+    directory, results, hexagons_centroids_gdf, keep_failed_rows=False
+):
+    """
+    Write the POI ratios and bus isochrones of the hexagons of a shard while
+    their results arrive from the workers.
+
+    Raises a RuntimeError if a row failed, so the shard is not committed and a
+    restarted run processes it again. With keep_failed_rows, the failed rows
+    are written as NaN instead and the shard is committed.
+    """
+    poi_ratios = {}
+    failed_rows = []
+    with GeoDataFrameWriter(os.path.join(directory, "bus_combined.gpkg")) as writer:
+        for index, poi_ratio, pois_count_bus, pois_count_drive, bus_gdf in results:
+            if poi_ratio is None:
+                failed_rows.append(index)
+                poi_ratios[index] = (None, None, None)
+                continue
+            poi_ratios[index] = (poi_ratio, pois_count_bus, pois_count_drive)
+            if bus_gdf is not None:
+                bus_gdf["uuid"] = hexagons_centroids_gdf.loc[index, "uuid"]
+                writer.write(bus_gdf)
+    if failed_rows:
+        if not keep_failed_rows:
+            raise RuntimeError(f"Failed to process rows {failed_rows}")
+        logger.error(f"Writing the failed rows {failed_rows} as NaN")
+    pd.DataFrame.from_dict(
+        poi_ratios, orient="index", columns=POI_RATIO_COLUMNS
+    ).to_csv(os.path.join(directory, "poi_ratio.csv"))
+
+
+def merge_poi_ratio_shards(
+    checkpoint_path, shard_count, hexagons_centroids_gdf, bus_isos_file
+):
+    """
+    Add the POI ratios of all shards to the hexagons and copy their bus
+    isochrones to bus_isos_file shard by shard.
+    """
+    with GeoDataFrameWriter(bus_isos_file) as writer:
+        for index in range(shard_count):
+            directory = shard_directory(checkpoint_path, index)
+            poi_ratios = pd.read_csv(
+                os.path.join(directory, "poi_ratio.csv"), index_col=0
+            )
+            hexagons_centroids_gdf.loc[poi_ratios.index, POI_RATIO_COLUMNS] = (
+                poi_ratios[POI_RATIO_COLUMNS].to_numpy()
+            )
+            if os.path.isfile(os.path.join(directory, "bus_combined.gpkg")):
+                writer.write(
+                    gpd.read_file(os.path.join(directory, "bus_combined.gpkg"))
+                )
+
+
+def main(config_path=CONFIG_PATH):
+    load_inputs(config_path)
+    hexagons_centroids_gdf = worker_state["hexagons_centroids_gdf"]
+
+    # The hexagons are processed in numbered shards and every finished shard is
+    # committed to the checkpoint directory, so a killed run loses at most the
+    # shards in progress and a restart skips the shards that are done
+    checkpoint_path = get_checkpoint_path(config_path)
+    shards = shard_ranges(
+        len(hexagons_centroids_gdf), get_config_value("shard_size", config_path)
     )
-except Exception as e:
-    logger.critical(f"Failed to read input files: {e}")
-    raise RuntimeError(f"Failed to read input files: {e}")
-
-try:
-    logger.info("Converting CRS...")
-    crs = get_config_value("crs", config_path)
-    drive_iso_gdf = drive_iso_gdf.to_crs(crs)
-    pois_gdf = pois_gdf.to_crs(crs)
-    iso_polygons_gdf = iso_polygons_gdf.to_crs(crs)
-    hexagon_gdf = hexagon_gdf.to_crs(crs)
-    hexagons_centroids_gdf = hexagons_centroids_gdf.to_crs(crs)
-    calc_isochrones_gdf = calc_isochrones_gdf.to_crs(crs)
-    walk_isochrones_from_start_nodes = walk_isochrones_from_hex.to_crs(crs)
-except Exception as e:
-    logger.critical(f"Failed to convert CRS: {e}")
-    raise RuntimeError(f"Failed to convert CRS: {e}")
-
-try:
-    logger.info("Processing data with multiprocessing...")
-    with Pool() as pool:
-        results = list(
-            tqdm(
-                pool.imap(
-                    process_row, [row for _, row in hexagons_centroids_gdf.iterrows()]
-                ),
-                total=len(hexagons_centroids_gdf),
+    shard_tasks = [
+        (index, [row for _, row in hexagons_centroids_gdf.iloc[start:stop].iterrows()])
+        for index, (start, stop) in get_pending_shards(checkpoint_path, shards)
+    ]
+
+    try:
+        logger.info("Processing data with multiprocessing...")
+        failed_shards = []
+        # The frames are inherited by the forked workers. Moving them out of the
+        # garbage collector keeps its passes from writing to, and so copying, their
+        # pages in every worker
+        gc.freeze()
+        try:
+            with Pool(initializer=init_worker, initargs=(config_path,)) as pool:
+                for index, results in tqdm(
+                    imap_shards(
+                        pool,
+                        process_row,
+                        shard_tasks,
+                        chunksize=worker_chunksize(
+                            min(
+                                get_config_value("shard_size", config_path),
+                                len(hexagons_centroids_gdf),
+                            ),
+                            cpu_count(),
+                        ),
+                    ),
+                    total=len(shard_tasks),
+                ):
+                    keep_failed_rows = (
+                        get_shard_attempts(checkpoint_path, index) + 1
+                        >= MAX_SHARD_ATTEMPTS
+                    )
+                    try:
+                        write_shard(
+                            checkpoint_path,
+                            index,
+                            lambda directory: write_poi_ratio_shard(
+                                directory,
+                                results,
+                                hexagons_centroids_gdf,
+                                keep_failed_rows=keep_failed_rows,
+                            ),
+                        )
+                    except RuntimeError as e:
+                        # The other shards go on and are kept for the rerun
+                        logger.error(f"Shard {index} is left pending: {e}")
+                        record_shard_attempt(checkpoint_path, index)
+                        failed_shards.append(index)
+        finally:
+            # Hand the frames back to the garbage collector for the merge
+            gc.unfreeze()
+        if failed_shards:
+            raise RuntimeError(
+                f"Shards {failed_shards} are pending, rerun to process them again. "
+                f"Rows that still fail after {MAX_SHARD_ATTEMPTS} runs are "
+                "written as NaN"
             )
+
+    except Exception as e:
+        logger.critical(f"Failed during processing: {e}")
+        raise RuntimeError(f"Failed during processing: {e}")
+
+    try:
+        output_path = get_config_value("output_path", config_path)
+        city_name = get_config_value("city_name", config_path)
+        output_format = get_config_value("output_format", config_path)
+        poi_ratio_file = get_output_file(
+            f"{output_path}{city_name}_poi_ratio_for_reachable_nodes", output_format
         )
-    gdf_list = []
-    for index, poi_ratio, pois_count_bus, pois_count_drive, bus_gdf in results:
-        if bus_gdf is not None:
-            bus_gdf["uuid"] = hexagons_centroids_gdf.loc[index, "uuid"]
-        gdf_list.append(bus_gdf)
-        hexagons_centroids_gdf.loc[index, "poi_ratio"] = poi_ratio
-        hexagons_centroids_gdf.loc[index, "pois_count_bus"] = pois_count_bus
-        hexagons_centroids_gdf.loc[index, "pois_count_drive"] = pois_count_drive
-
-except Exception as e:
-    logger.critical(f"Failed during processing: {e}")
-    raise RuntimeError(f"Failed during processing: {e}")
-
-try:
-    output_path = get_config_value("output_path", config_path)
-    city_name = get_config_value("city_name", config_path)
-    logger.info(
-        f"Saving output to {output_path}{city_name}_poi_ratio_for_reachable_nodes.geojson"
-    )
-    hexagons_centroids_gdf.to_file(
-        f"{output_path}{city_name}_poi_ratio_for_reachable_nodes.geojson",
-        driver="GeoJSON",
-    )
-    bus_isos_gdf = pd.concat(gdf_list, ignore_index=True)
-    bus_isos_gdf.to_file(f"{output_path}_bus_combined.geojson", driver="GeoJSON")
-except Exception as e:
-    logger.critical(f"Failed to save output file: {e}")
-    raise RuntimeError(f"Failed to save output file: {e}")
+        logger.info(f"Saving output to {poi_ratio_file}")
+        merge_poi_ratio_shards(
+            checkpoint_path,
+            len(shards),
+            hexagons_centroids_gdf,
+            get_output_file(f"{output_path}_bus_combined", output_format),
+        )
+        with GeoDataFrameWriter(poi_ratio_file) as writer:
+            writer.write(hexagons_centroids_gdf)
+    except Exception as e:
+        logger.critical(f"Failed to save output file: {e}")
+        raise RuntimeError(f"Failed to save output file: {e}")
+
+    remove_checkpoint(checkpoint_path)
+    logger.info("Processing complete.")
+
 
-logger.info("Processing complete.")
+if __name__ == "__main__":
+    main()
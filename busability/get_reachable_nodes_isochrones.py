@@ -1,89 +1,427 @@
+import itertools
 import logging
+import os
 from datetime import datetime, timedelta
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 from multiprocessing import Pool, cpu_count
 
+from busability.build_cache import build_cache_key
+from busability.checkpoint import (
+    get_pending_shards,
+    imap_shards,
+    remove_checkpoint,
+    shard_directory,
+    shard_ranges,
+    write_shard,
+)
+from busability.network_preprocessing.network_creator import (
+    get_start_node_polygon,
+)
 from busability.network_preprocessing.network_creator import (
-    get_union_reachable_polygons,
+    load_graph_from_file,
+    slice_timetable_graph,
+)
+from busability.network_preprocessing.walk_legs import (
+    WalkLegIndex,
+    load_walk_leg_index,
+)
+from busability.network_processing.connections import Connections
+from busability.network_processing.network_analyzer import (
+    ReachabilityCache,
+    get_bus_connections,
+    get_bus_network,
+    get_multimodal_poi_directness_batch,
+    get_multimodal_poi_directness_bitset,
+    precompute_lane_durations,
+)
+from busability.network_processing.bitset import load_bitsets, save_bitsets
+from busability.network_processing.polygon_union import (
+    PolygonUnionCache,
+    get_row_blocks,
+)
+from busability.output_writer import GeoDataFrameWriter, get_output_file
+from busability.utils import AnalysisConfig, get_config_value
+from busability.worker_runtime import (
+    SharedArrays,
+    geometries_from_arrays,
+    geometry_arrays,
+    worker_chunksize,
 )
-from busability.network_preprocessing.network_creator import load_graph_from_file
-from busability.network_processing.network_analyzer import get_multimodal_poi_directness
-from busability.utils import get_config_value
 
-config_path = "../config/lima/config_get_reachable_nodes_isochrones.yml"
+CONFIG_PATH = "../config/lima/config_get_reachable_nodes_isochrones.yml"
 
-iso_polygons_gdf = gpd.read_file(get_config_value("iso_polygons_gdf_path", config_path))
 
-crs = get_config_value("crs", config_path)
+def load_settings(config_path):
+    """Read the settings of the analysis from the config file."""
+    analysis_config = AnalysisConfig.from_file(config_path)
+    minute_threshold = get_config_value("minute_threshold", config_path)
+    start_time_object = datetime.combine(
+        datetime.today(),
+        datetime.strptime(get_config_value("date", config_path), "%H:%M:%S").time(),
+    )
+    max_transfers = get_config_value("max_transfers", config_path)
 
-iso_polygons_gdf = iso_polygons_gdf.to_crs(crs=crs)
+    # In normal mode the start nodes are routed in batches with one scan of the
+    # connections per batch, see get_multimodal_poi_directness_batch
+    batch_size = get_config_value("batch_size", config_path)
+    if analysis_config.mode != "normal" or max_transfers is not None:
+        batch_size = None
 
-mode = get_config_value("mode", config_path)
-start_time_string = get_config_value("date", config_path)
-minute_threshold = get_config_value("minute_threshold", config_path)
-matching_column = get_config_value("matching_column", config_path)
-output_path = get_config_value("output_path", config_path)
-city_name = get_config_value("city_name", config_path)
+    return {
+        "iso_polygons_gdf_path": get_config_value("iso_polygons_gdf_path", config_path),
+        "crs": get_config_value("crs", config_path),
+        "analysis_config": analysis_config,
+        "mode": analysis_config.mode,
+        "minute_threshold": minute_threshold,
+        "matching_column": get_config_value("matching_column", config_path),
+        "output_path": get_config_value("output_path", config_path),
+        "city_name": get_config_value("city_name", config_path),
+        "start_time_object": start_time_object,
+        "end_time_object": start_time_object + timedelta(minutes=minute_threshold),
+        "engine": get_config_value("engine", config_path),
+        "max_transfers": max_transfers,
+        "batch_size": batch_size,
+        "checkpoint_path": get_config_value("checkpoint_path", config_path),
+        "shard_size": get_config_value("shard_size", config_path),
+        "output_format": get_config_value("output_format", config_path),
+        "union_block_size": get_config_value("union_block_size", config_path),
+        "union_cache_mb": get_config_value("union_cache_mb", config_path),
+    }
 
-iso_polygons_gdf["matching"] = (
-    iso_polygons_gdf[matching_column].astype(str)
-    + "_"
-    + (iso_polygons_gdf["value"] / 60).astype(str)
-)
 
-start_time_object = datetime.combine(
-    datetime.today(), datetime.strptime(start_time_string, "%H:%M:%S").time()
-)
-end_time_object = start_time_object + timedelta(minutes=minute_threshold)
+WALK_LEG_ARRAYS = ["stops", "columns", "indptr", "indices", "minutes"]
+CONNECTION_ARRAYS = [
+    "connections",
+    "transfer_offsets",
+    "transfer_targets",
+    "transfer_seconds",
+]
+
+# The settings and inputs of a process, set by main and init_worker
+worker_state = {}
+
+
+def load_bus_network(settings):
+    """Load the bus graph, slice it to the analysed window and prepare the engine."""
+    bus_graph = slice_timetable_graph(
+        load_graph_from_file(
+            f"{settings['output_path']}{settings['city_name']}_bus_graph"
+        ),
+        settings["start_time_object"],
+        settings["end_time_object"],
+    )
+    if settings["mode"] != "normal":
+        precompute_lane_durations(bus_graph, settings["analysis_config"])
+    return get_bus_network(
+        bus_graph,
+        engine=settings["engine"],
+        max_transfers=settings["max_transfers"],
+    )
+
+
+def publish_inputs(settings):
+    """
+    Load the inputs once in the main process and publish their arrays to the
+    workers: the walk legs, the walk leg column, stop, block, band and geometry
+    of every isochrone and, when routing in batches, the connections of the bus
+    graph.
+    """
+    iso_polygons_gdf = gpd.read_file(settings["iso_polygons_gdf_path"])
+    iso_polygons_gdf = iso_polygons_gdf.to_crs(crs=settings["crs"])
+    iso_polygons_gdf["matching"] = (
+        iso_polygons_gdf[settings["matching_column"]].astype(str)
+        + "_"
+        + (iso_polygons_gdf["value"] / 60).astype(str)
+    )
+    walk_legs = load_walk_leg_index(
+        f"{settings['output_path']}{settings['city_name']}_walk_legs"
+    )
+
+    iso_stops = pd.factorize(iso_polygons_gdf[settings["matching_column"]])[0]
 
-bus_graph = load_graph_from_file(f"{output_path}{city_name}_bus_graph.gml")
-walk_graph = load_graph_from_file(f"{output_path}{city_name}_walk_graph.gml")
-bus_graph = load_graph_from_file(f"{output_path}{city_name}_bus_graph.gml")
+    arrays = {
+        **{f"walk_leg_{name}": getattr(walk_legs, name) for name in WALK_LEG_ARRAYS},
+        # Column of the walk legs of every isochrone, to select the reachable
+        # rows by bitset
+        "iso_row_nodes": walk_legs.column_positions(iso_polygons_gdf["matching"]),
+        **geometry_arrays(iso_polygons_gdf.geometry, prefix="iso"),
+        # Stop and block of stops of every isochrone, the levels of the cached
+        # partial unions
+        "iso_stops": iso_stops,
+        "iso_blocks": get_row_blocks(
+            iso_polygons_gdf.geometry, iso_stops, settings["union_block_size"]
+        ),
+        # Band of every isochrone, to drop the nested bands before the union
+        "iso_values": iso_polygons_gdf["value"].to_numpy(),
+    }
+    if settings["batch_size"]:
+        connections = get_bus_connections(load_bus_network(settings))
+        arrays["connection_stops"] = np.array(connections.stops, dtype=str)
+        arrays.update({name: getattr(connections, name) for name in CONNECTION_ARRAYS})
 
-logging.log(logging.INFO, "Loaded graphs from file")
+    logging.log(logging.INFO, "Loaded graphs from file")
+    return SharedArrays(arrays), walk_legs
 
-# Get start and target nodes
-target_nodes = [node for node in bus_graph.nodes]
-start_nodes = [item for item in walk_graph.nodes if item not in target_nodes]
+
+def init_worker(config_path, shared_arrays):
+    """Attach a worker process to the arrays published by the main process."""
+    worker_state.update(load_settings(config_path))
+    arrays = shared_arrays.attach()
+    worker_state["walk_legs"] = WalkLegIndex(
+        *[arrays[f"walk_leg_{name}"] for name in WALK_LEG_ARRAYS]
+    )
+    worker_state["iso_row_nodes"] = arrays["iso_row_nodes"]
+    worker_state["union_cache"] = PolygonUnionCache(
+        lambda rows: geometries_from_arrays(
+            arrays["iso_wkb"], arrays["iso_offsets"], rows
+        ),
+        arrays["iso_stops"],
+        arrays["iso_blocks"],
+        max_bytes=worker_state["union_cache_mb"] * 2**20,
+        row_values=arrays["iso_values"],
+    )
+    if worker_state["batch_size"]:
+        worker_state["bus_connections"] = Connections(
+            arrays["connection_stops"].tolist(),
+            *[arrays[name] for name in CONNECTION_ARRAYS],
+        )
+    else:
+        # A networkx graph cannot be shared, but its timetables are memory
+        # maps of the binary graph files
+        worker_state["bus_network"] = load_bus_network(worker_state)
+        # The bus network is not modified anymore, so the bus searches of all
+        # start nodes of the worker can share their results
+        worker_state["reachability_cache"] = ReachabilityCache()
+
+
+def get_union_polygon(start_node, reachable_bitset):
+    """
+    Get the union of the isochrones reachable from a start node and the number
+    of nested isochrones that were dropped before the union.
+    """
+    rows = np.flatnonzero(reachable_bitset.row_mask(worker_state["iso_row_nodes"]))
+    if not len(rows):
+        return None, 0
+    union_cache = worker_state["union_cache"]
+    pruned = union_cache.pruned
+    union = union_cache.union(rows)
+    return (
+        get_start_node_polygon(
+            union,
+            matching_column=worker_state["matching_column"],
+            crs=worker_state["crs"],
+            start_node=start_node,
+        ),
+        union_cache.pruned - pruned,
+    )
 
 
 def process_start_node(start_node):
     """Function to process a single start node."""
-    all_reachable_nodes = get_multimodal_poi_directness(
-        walk_graph,
-        bus_graph,
-        walk_graph,
+    reachable_bitset = get_multimodal_poi_directness_bitset(
+        worker_state["walk_legs"],
+        worker_state["bus_network"],
         start_node,
-        target_nodes,
-        start_time=start_time_object,
-        weight_threshold=minute_threshold,
-        mode=mode,
+        start_time=worker_state["start_time_object"],
+        weight_threshold=worker_state["minute_threshold"],
+        mode=worker_state["mode"],
+        config=worker_state["analysis_config"],
+        cache=worker_state["reachability_cache"],
     )
-    union_gdf = get_union_reachable_polygons(
-        iso_polygons_gdf,
-        matching_column=matching_column,
-        polygon_names=all_reachable_nodes,
-        crs=crs,
-        start_node=start_node,
+    return *get_union_polygon(start_node, reachable_bitset), reachable_bitset
+
+
+def process_batch(batch):
+    """Function to process a batch of start nodes in normal mode."""
+    reachable_bitsets = get_multimodal_poi_directness_batch(
+        worker_state["walk_legs"],
+        worker_state["bus_connections"],
+        batch,
+        start_time=worker_state["start_time_object"],
+        weight_threshold=worker_state["minute_threshold"],
+        batch_size=len(batch),
     )
-    return union_gdf
+    return [
+        (*get_union_polygon(start_node, reachable_bitset), reachable_bitset)
+        for start_node, reachable_bitset in zip(batch, reachable_bitsets)
+    ]
 
 
-if __name__ == "__main__":
-    # Use multiprocessing to process start nodes in parallel
-    with Pool(processes=cpu_count() - 1) as pool:  # Use all but one CPU core
-        result_gdf_list = list(
-            tqdm(
-                pool.imap(process_start_node, start_nodes),
-                total=len(start_nodes),
-                desc="Calculating reachable nodes",
-            )
+def get_checkpoint_path(settings):
+    """
+    Get the checkpoint directory of a run, keyed by its inputs and settings so
+    a restarted run only resumes from the shards of an identical run.
+    """
+    output_path, city_name = settings["output_path"], settings["city_name"]
+    key = build_cache_key(
+        [
+            settings["iso_polygons_gdf_path"],
+            f"{output_path}{city_name}_bus_graph",
+            f"{output_path}{city_name}_walk_legs",
+        ],
+        {
+            **{
+                name: settings[name]
+                for name in [
+                    "crs",
+                    "analysis_config",
+                    "minute_threshold",
+                    "matching_column",
+                    "engine",
+                    "max_transfers",
+                    "batch_size",
+                    "shard_size",
+                ]
+            },
+            "date": settings["start_time_object"].strftime("%H:%M:%S"),
+        },
+    )
+    return os.path.join(settings["checkpoint_path"], f"{city_name}_reachability_{key}")
+
+
+def write_reachability_shard(directory, results, start_node_count, column_count):
+    """
+    Write the union polygons and reachable nodes of the start nodes of a shard
+    while their results arrive from the workers and get the number of nested
+    isochrones dropped before their unions.
+    """
+    pruned = 0
+
+    def reachable_bitsets():
+        nonlocal pruned
+        for union_gdf, union_pruned, reachable_bitset in results:
+            writer.write(union_gdf)
+            pruned += union_pruned
+            yield reachable_bitset
+
+    with GeoDataFrameWriter(os.path.join(directory, "union_polygon.gpkg")) as writer:
+        save_bitsets(
+            os.path.join(directory, "reachable_nodes.npy"),
+            reachable_bitsets(),
+            column_count,
+            count=start_node_count,
+        )
+    return pruned
+
+
+def merge_reachability_shards(checkpoint_path, shard_count, settings, column_count):
+    """Assemble the outputs of a run from its shards, in the order of the start nodes."""
+    output_path, city_name = settings["output_path"], settings["city_name"]
+    directories = [
+        shard_directory(checkpoint_path, index) for index in range(shard_count)
+    ]
+
+    # The reachable isochrones of every start node, one row of bits per start
+    # node in the order of start_nodes and one bit per walk leg column
+    shard_bitsets = [
+        load_bitsets(os.path.join(directory, "reachable_nodes.npy"), column_count)
+        for directory in directories
+    ]
+    save_bitsets(
+        f"{output_path}{city_name}_reachable_nodes.npy",
+        itertools.chain.from_iterable(shard_bitsets),
+        column_count,
+        count=sum(len(bitsets) for bitsets in shard_bitsets),
+    )
+
+    # The union polygons are copied shard by shard, so only one shard is in
+    # memory at a time
+    with GeoDataFrameWriter(
+        get_output_file(
+            f"{output_path}{city_name}_union_polygon", settings["output_format"]
         )
+    ) as writer:
+        for directory in directories:
+            if os.path.isfile(os.path.join(directory, "union_polygon.gpkg")):
+                writer.write(
+                    gpd.read_file(os.path.join(directory, "union_polygon.gpkg"))
+                )
+
+
+def main(config_path=CONFIG_PATH):
+    settings = load_settings(config_path)
+    batch_size = settings["batch_size"]
+    shared_arrays, walk_legs = publish_inputs(settings)
+    start_nodes = walk_legs.nodes
+    column_count = len(walk_legs.columns)
+    processes = cpu_count() - 1  # Use all but one CPU core
+
+    # The start nodes are processed in numbered shards and every finished shard
+    # is committed to the checkpoint directory, so a killed run loses at most
+    # the shards in progress and a restart skips the shards that are done
+    checkpoint_path = get_checkpoint_path(settings)
+    shards = shard_ranges(len(start_nodes), settings["shard_size"])
+    pending_shards = get_pending_shards(checkpoint_path, shards)
+    if batch_size:
+        shard_tasks = [
+            (
+                index,
+                [
+                    start_nodes[batch_start : min(batch_start + batch_size, stop)]
+                    for batch_start in range(start, stop, batch_size)
+                ],
+            )
+            for index, (start, stop) in pending_shards
+        ]
+    else:
+        shard_tasks = [
+            (index, start_nodes[start:stop]) for index, (start, stop) in pending_shards
+        ]
 
-    final_gdf = gpd.GeoDataFrame(pd.concat(result_gdf_list, ignore_index=True))
+    pruned_counts = []
 
-    final_gdf.to_file(
-        f"{output_path}{city_name}_union_polygon.geojson", driver="GeoJSON"
+    # Use multiprocessing to process start nodes in parallel
+    with (
+        shared_arrays,
+        Pool(
+            processes=processes,
+            initializer=init_worker,
+            initargs=(config_path, shared_arrays),
+        ) as pool,
+    ):
+        if batch_size:
+            shard_results = imap_shards(pool, process_batch, shard_tasks)
+        else:
+            # The start nodes are grouped by stop, so chunks keep the
+            # isochrones of a stop in one worker to share its cached bus
+            # searches
+            shard_results = imap_shards(
+                pool,
+                process_start_node,
+                shard_tasks,
+                chunksize=worker_chunksize(
+                    min(settings["shard_size"], len(start_nodes)), processes
+                ),
+            )
+        for index, results in tqdm(
+            shard_results,
+            total=len(shard_tasks),
+            desc="Calculating reachable nodes in shards",
+        ):
+            if batch_size:
+                results = (result for batch in results for result in batch)
+            start, stop = shards[index]
+            # The results are written as they arrive, while the workers go on
+            write_shard(
+                checkpoint_path,
+                index,
+                lambda directory: pruned_counts.append(
+                    write_reachability_shard(
+                        directory, results, stop - start, column_count
+                    )
+                ),
+            )
+    logging.log(
+        logging.INFO,
+        f"Dropped {sum(pruned_counts)} nested isochrones before their union",
     )
+
+    merge_reachability_shards(checkpoint_path, len(shards), settings, column_count)
+    remove_checkpoint(checkpoint_path)
+
+
+if __name__ == "__main__":
+    main()
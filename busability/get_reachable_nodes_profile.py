@@ -0,0 +1,162 @@
+import logging
+from datetime import datetime, timedelta
+from functools import lru_cache
+from multiprocessing import Pool, cpu_count
+
+import geopandas as gpd
+import numpy as np
+from tqdm import tqdm
+
+from busability.network_preprocessing.network_creator import (
+    load_graph_from_file,
+    slice_timetable_graph,
+)
+from busability.network_preprocessing.walk_legs import load_walk_leg_index
+from busability.network_processing.network_analyzer import (
+    get_bus_network,
+    get_bus_station_from_isochrone,
+    get_multimodal_poi_directness_profile,
+    get_stop_profile,
+)
+from busability.utils import get_config_value
+
+CONFIG_PATH = "../config/lima/config_get_reachable_nodes_profile.yml"
+
+# The settings and bus network of a worker process, set by init_worker
+worker_state = {}
+
+
+def get_departure_times(config_path):
+    """Get the departure times of the analysed period."""
+    first_departure = datetime.combine(
+        datetime.today(),
+        datetime.strptime(
+            get_config_value("first_departure", config_path), "%H:%M:%S"
+        ).time(),
+    )
+    last_departure = datetime.combine(
+        datetime.today(),
+        datetime.strptime(
+            get_config_value("last_departure", config_path), "%H:%M:%S"
+        ).time(),
+    )
+    return [
+        first_departure + timedelta(minutes=minute)
+        for minute in range(
+            0,
+            int((last_departure - first_departure).total_seconds() // 60) + 1,
+            get_config_value("departure_interval", config_path),
+        )
+    ]
+
+
+def init_worker(config_path):
+    """Load the bus network and walk legs of a worker process."""
+    output_path = get_config_value("output_path", config_path)
+    city_name = get_config_value("city_name", config_path)
+    departure_times = get_departure_times(config_path)
+    minute_threshold = get_config_value("minute_threshold", config_path)
+
+    bus_graph = slice_timetable_graph(
+        load_graph_from_file(f"{output_path}{city_name}_bus_graph"),
+        departure_times[0],
+        departure_times[-1] + timedelta(minutes=minute_threshold),
+    )
+    worker_state["departure_times"] = departure_times
+    worker_state["minute_threshold"] = minute_threshold
+    worker_state["bus_network"] = get_bus_network(bus_graph, engine="csa")
+    worker_state["walk_legs"] = load_walk_leg_index(
+        f"{output_path}{city_name}_walk_legs"
+    )
+
+    logging.log(logging.INFO, "Loaded graphs from file")
+
+
+@lru_cache(maxsize=1024)
+def get_profile(bus_node):
+    """Get the arrival profile of a bus stop, shared by all of its isochrones."""
+    return get_stop_profile(
+        worker_state["bus_network"],
+        bus_node,
+        worker_state["departure_times"],
+        worker_state["minute_threshold"],
+    )
+
+
+def process_hexagon(hexagon):
+    """Get the number of reachable nodes from a hexagon for every departure time."""
+    index, start_nodes = hexagon
+    departure_times = worker_state["departure_times"]
+    reachable_nodes = {departure_time: set() for departure_time in departure_times}
+    for start_node in start_nodes:
+        bus_node, _ = get_bus_station_from_isochrone(start_node)
+        profile_nodes = get_multimodal_poi_directness_profile(
+            worker_state["bus_network"],
+            worker_state["walk_legs"],
+            start_node,
+            departure_times,
+            weight_threshold=worker_state["minute_threshold"],
+            profile=get_profile(bus_node),
+        )
+        for departure_time, nodes in profile_nodes.items():
+            reachable_nodes[departure_time].update(nodes)
+    return index, [len(nodes) for nodes in reachable_nodes.values()]
+
+
+def main(config_path=CONFIG_PATH):
+    iso_polygons_gdf = gpd.read_file(
+        get_config_value("iso_polygons_gdf_path", config_path)
+    )
+    hexagon_gdf = gpd.read_file(get_config_value("hexagon_gdf_path", config_path))
+
+    crs = get_config_value("crs", config_path)
+
+    iso_polygons_gdf = iso_polygons_gdf.to_crs(crs=crs)
+    hexagon_gdf = hexagon_gdf.to_crs(crs=crs)
+
+    matching_column = get_config_value("matching_column", config_path)
+    output_path = get_config_value("output_path", config_path)
+    city_name = get_config_value("city_name", config_path)
+
+    iso_polygons_gdf["matching"] = (
+        iso_polygons_gdf[matching_column].astype(str)
+        + "_"
+        + (iso_polygons_gdf["value"] / 60).astype(str)
+    )
+
+    # Start nodes of the walk isochrones that intersect each hexagon
+    hexagon_start_nodes = (
+        gpd.sjoin(
+            iso_polygons_gdf[["matching", "geometry"]],
+            hexagon_gdf,
+            how="inner",
+            predicate="intersects",
+        )
+        .groupby("index_right")["matching"]
+        .apply(list)
+    )
+
+    with Pool(
+        processes=cpu_count() - 1, initializer=init_worker, initargs=(config_path,)
+    ) as pool:
+        results = list(
+            tqdm(
+                pool.imap(process_hexagon, hexagon_start_nodes.items()),
+                total=len(hexagon_start_nodes),
+                desc="Calculating reachable nodes per departure time",
+            )
+        )
+
+    # Time-averaged accessibility over all departure times of each hexagon
+    for index, counts in results:
+        hexagon_gdf.loc[index, "mean_reachable_nodes"] = np.mean(counts)
+        hexagon_gdf.loc[index, "min_reachable_nodes"] = np.min(counts)
+        hexagon_gdf.loc[index, "max_reachable_nodes"] = np.max(counts)
+
+    hexagon_gdf.to_file(
+        f"{output_path}{city_name}_profile_accessibility.geojson", driver="GeoJSON"
+    )
+
+
+if __name__ == "__main__":
+    main()
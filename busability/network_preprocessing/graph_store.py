@@ -0,0 +1,164 @@
+import json
+import math
+import os
+
+import networkx as nx
+import numpy as np
+
+from busability.network_preprocessing.timetable import EdgeTimetable
+
+FORMAT_VERSION = 1
+
+NODE_ATTRIBUTES = ["lat", "lon"]
+EDGE_ATTRIBUTES = ["weight", "len_two_lanes", "len_more_than_two_lanes"]
+
+
+def write_graph_arrays(graph, directory):
+    """
+    Write a bus graph as a directory of NumPy arrays.
+
+    Nodes, edges and the edge timetables are stored as flat tables in .npy
+    files, so that they can be loaded without parsing and memory-mapped. The
+    timetables of all edges are concatenated, edge i owns the entries between
+    timetable_offsets[i] and timetable_offsets[i + 1].
+
+    Only the attributes that create_gtfs_graph sets are stored: the node name,
+    lat and lon and the edge weight, is_transfer, lane lengths and timetable.
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    nodes = list(graph.nodes)
+    node_index = {node: index for index, node in enumerate(nodes)}
+    edges = list(graph.edges(data=True))
+
+    arrays = {
+        "nodes": np.array([str(node) for node in nodes]),
+        "node_name": np.array(
+            [str(data.get("name", "")) for _, data in graph.nodes(data=True)]
+        ),
+        "edge_source": np.array(
+            [node_index[source] for source, _, _ in edges], dtype=np.int32
+        ),
+        "edge_target": np.array(
+            [node_index[target] for _, target, _ in edges], dtype=np.int32
+        ),
+        "edge_is_transfer": np.array(
+            [bool(data.get("is_transfer", False)) for _, _, data in edges]
+        ),
+    }
+    for attribute in NODE_ATTRIBUTES:
+        arrays[f"node_{attribute}"] = np.array(
+            [data.get(attribute, np.nan) for _, data in graph.nodes(data=True)],
+            dtype=np.float64,
+        )
+    for attribute in EDGE_ATTRIBUTES:
+        arrays[f"edge_{attribute}"] = np.array(
+            [data.get(attribute, np.nan) for _, _, data in edges], dtype=np.float64
+        )
+
+    timetables = [data.get("timetable") for _, _, data in edges]
+    lengths = [len(timetable) if timetable else 0 for timetable in timetables]
+    timetables = [timetable for timetable in timetables if timetable]
+    arrays["timetable_offsets"] = np.concatenate([[0], np.cumsum(lengths)]).astype(
+        np.int64
+    )
+    for field, dtype in [
+        ("departures", np.int32),
+        ("arrivals", np.int32),
+        ("trip_ids", None),
+    ]:
+        values = [getattr(timetable, field) for timetable in timetables]
+        arrays[f"timetable_{field}"] = (
+            np.concatenate(values) if values else np.array([], dtype=dtype)
+        )
+
+    for name, values in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), values, allow_pickle=False)
+
+    with open(os.path.join(directory, "graph.json"), "w") as f:
+        json.dump({"version": FORMAT_VERSION, "directed": graph.is_directed()}, f)
+
+
+def read_graph_arrays(directory, mmap_mode="r") -> dict:
+    """Read the arrays written by write_graph_arrays, memory-mapped by default."""
+    with open(os.path.join(directory, "graph.json")) as f:
+        meta = json.load(f)
+    if meta["version"] != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported graph format version {meta['version']} in '{directory}'."
+        )
+
+    arrays = {
+        os.path.splitext(name)[0]: np.load(
+            os.path.join(directory, name), mmap_mode=mmap_mode, allow_pickle=False
+        )
+        for name in os.listdir(directory)
+        if name.endswith(".npy")
+    }
+    arrays["directed"] = meta["directed"]
+    return arrays
+
+
+def graph_from_arrays(arrays):
+    """
+    Create a networkx graph from the arrays returned by read_graph_arrays.
+
+    The edge timetables are views on the timetable arrays, so a memory-mapped
+    graph does not copy them.
+    """
+    graph = nx.DiGraph() if arrays["directed"] else nx.Graph()
+
+    nodes = arrays["nodes"].tolist()
+    node_attributes = {
+        attribute: arrays[f"node_{attribute}"].tolist() for attribute in NODE_ATTRIBUTES
+    }
+    graph.add_nodes_from(
+        (
+            node,
+            {
+                "name": name,
+                **{
+                    attribute: values[index]
+                    for attribute, values in node_attributes.items()
+                    if not math.isnan(values[index])
+                },
+            },
+        )
+        for index, (node, name) in enumerate(zip(nodes, arrays["node_name"].tolist()))
+    )
+
+    edge_attributes = {
+        attribute: arrays[f"edge_{attribute}"].tolist() for attribute in EDGE_ATTRIBUTES
+    }
+    offsets = arrays["timetable_offsets"].tolist()
+    # Plain ndarray views slice much faster than np.memmap and share its memory
+    departures = arrays["timetable_departures"].view(np.ndarray)
+    arrivals = arrays["timetable_arrivals"].view(np.ndarray)
+    trip_ids = arrays["timetable_trip_ids"].view(np.ndarray)
+
+    def edge_data(index, is_transfer):
+        data = {
+            attribute: values[index]
+            for attribute, values in edge_attributes.items()
+            if not math.isnan(values[index])
+        }
+        if is_transfer:
+            data["is_transfer"] = True
+        start, end = offsets[index], offsets[index + 1]
+        if end > start:
+            data["timetable"] = EdgeTimetable.from_sorted(
+                departures[start:end], arrivals[start:end], trip_ids[start:end]
+            )
+        return data
+
+    graph.add_edges_from(
+        (nodes[source], nodes[target], edge_data(index, is_transfer))
+        for index, (source, target, is_transfer) in enumerate(
+            zip(
+                arrays["edge_source"].tolist(),
+                arrays["edge_target"].tolist(),
+                arrays["edge_is_transfer"].tolist(),
+            )
+        )
+    )
+    return graph
@@ -1,13 +1,24 @@
 import logging
 import os
-from datetime import datetime
+import zipfile
+from contextlib import contextmanager
 from typing import List
 
 import geopandas as gpd
 import networkx as nx
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
+from busability.network_preprocessing.graph_store import (
+    graph_from_arrays,
+    read_graph_arrays,
+    write_graph_arrays,
+)
+from busability.network_preprocessing.timetable import EdgeTimetable
+from busability.network_preprocessing.walk_legs import create_walk_leg_index
+from busability.network_processing.polygon_union import get_outermost_rows
+
 
 def calculate_distance(point1, point2):
     return point1.distance(point2) / 100
@@ -35,48 +46,84 @@ def gdf_to_nodes_and_weighted_edges(gdf, matching_name):
     return nodes, edges
 
 
-def create_walk_edges(bus_graph, isochrones_gdf, matching_name):
-    """Create nodes and edges from a GeoDataFrame for each isochrone"""
+def get_union_reachable_polygons(
+    gdf,
+    matching_column: str,
+    polygon_names: List[str],
+    start_node: str,
+    crs: int = 32718,
+):
+    """Get the union of the polygons that are reachable from the nodes in the graph"""
 
-    logging.log(logging.INFO, "Creating walk graph...")
-    walk_graph = bus_graph.copy()
+    if not polygon_names or all("_" not in item for item in polygon_names):
+        return None
+    return get_union_reachable_polygons_from_mask(
+        gdf,
+        matching_column,
+        gdf["matching"].isin(polygon_names).to_numpy(),
+        start_node,
+        crs=crs,
+    )
 
-    walk_graph.clear_edges()
 
-    for idx, row in isochrones_gdf.iterrows():
-        name = row.get(matching_name)
-        value = row.get("value") / 60
+def get_union_reachable_polygons_from_mask(
+    gdf,
+    matching_column: str,
+    row_mask,
+    start_node: str,
+    crs: int = 32718,
+):
+    """
+    Get the union of the polygons in the rows selected by a bool mask, e.g.
+    the row mask of a NodeBitset.
+    """
+    if not row_mask.any():
+        return None
+    reachable_gdf, pruned = get_outermost_isochrones(gdf[row_mask], matching_column)
+    logging.log(
+        logging.DEBUG,
+        f"Dropped {pruned} nested isochrones of {start_node} before union",
+    )
+    return get_union_of_polygons(
+        reachable_gdf.geometry, matching_column, start_node, crs=crs
+    )
 
-        new_node_name = f"{name}_{value}"
 
-        node_attributes = {"name": new_node_name}
+def get_outermost_isochrones(gdf, stop_column: str):
+    """
+    Keep only the outermost band of the isochrones of every stop and get the
+    number of dropped isochrones. The bands of a stop are nested, so this does
+    not change their union.
+    """
+    if "value" not in gdf.columns:
+        return gdf, 0
+    rows, pruned = get_outermost_rows(
+        np.arange(len(gdf)), pd.factorize(gdf[stop_column])[0], gdf["value"].to_numpy()
+    )
+    return gdf.iloc[rows], pruned
 
-        # Add the new node to the graph if it doesn't exist
-        if not walk_graph.has_node(new_node_name):
-            walk_graph.add_node(new_node_name, **node_attributes)
 
-        # Add the edge between the existing node and the new node
-        walk_graph.add_edge(name, new_node_name, weight=int(value))
-        walk_graph.add_edge(new_node_name, name, weight=int(value))
+def get_union_of_polygons(
+    geometries,
+    matching_column: str,
+    start_node: str,
+    crs: int = 32718,
+):
+    """Get the union of polygons as a GeoDataFrame row of the start node."""
+    # union the polygons
+    union = gpd.GeoSeries(geometries).unary_union
 
-    return walk_graph
+    return get_start_node_polygon(union, matching_column, start_node, crs=crs)
 
 
-def get_union_reachable_polygons(
-    gdf,
+def get_start_node_polygon(
+    polygon,
     matching_column: str,
-    polygon_names: List[str],
     start_node: str,
     crs: int = 32718,
 ):
-    """Get the union of the polygons that are reachable from the nodes in the graph"""
-
-    if not polygon_names or all("_" not in item for item in polygon_names):
-        return None
-    # union the polygons
-    union = gdf[gdf["matching"].isin(polygon_names)].unary_union
-
-    union_gdf = gpd.GeoDataFrame(geometry=[union])
+    """Get a polygon as a GeoDataFrame row of the start node."""
+    union_gdf = gpd.GeoDataFrame(geometry=[polygon])
 
     union_gdf = union_gdf.set_crs(epsg=crs)
 
@@ -115,65 +162,229 @@ def get_poi_inside_isochrone(pois_gdf, isochrone_gdf):
     return len(joined_gdf)
 
 
-def create_network_from_gtfs(city, start_time, end_time, base_path=None):
+def find_gtfs_feed(city, base_path=None):
+    """
+    Find the GTFS feed of a city.
+
+    The feed is either the directory data/<city>/gtfs or the archive
+    data/<city>/gtfs.zip. A directory takes precedence over an archive.
+    """
+    if base_path is None:
+        path = os.path.join("../data", city.lower(), "gtfs")
+    else:
+        path = os.path.join(base_path, "data", city.lower(), "gtfs")
+
+    if os.path.isdir(path):
+        return path
+    if os.path.isfile(path + ".zip"):
+        return path + ".zip"
+    raise FileNotFoundError(f"The GTFS directory for '{city}' does not exist.")
+
+
+@contextmanager
+def open_gtfs_file(feed, name):
+    """
+    Open a file of a GTFS feed directory or .zip archive for reading.
+
+    Files in an archive are streamed without extracting them, also if the
+    archive contains them in a subdirectory. Yields None if the feed does not
+    contain the file.
+    """
+    if not zipfile.is_zipfile(feed):
+        path = os.path.join(feed, name)
+        yield path if os.path.exists(path) else None
+        return
+
+    with zipfile.ZipFile(feed) as archive:
+        members = [
+            member for member in archive.namelist() if os.path.basename(member) == name
+        ]
+        if not members:
+            yield None
+            return
+        with archive.open(min(members, key=len)) as file:
+            yield file
+
+
+def create_network_from_gtfs(city, start_time=None, end_time=None, base_path=None):
     """
     Load GTFS data for the specified city.
 
     Args:
     - city (str): The city for which to load GTFS data.
+    - start_time, end_time (optional): The time window of the graph. Without them the
+      graph holds the timetable of the full service day, see slice_timetable_graph.
     - base_path (str, optional): The base path to the data directory. If None, defaults to the directory of this script.
 
     Returns:
     - A graph created from the GTFS data.
     """
+    feed = find_gtfs_feed(city, base_path)
+
+    return create_network_from_gtfs_feed(feed, start_time, end_time)
+
+
+def create_network_from_gtfs_feed(feed, start_time=None, end_time=None):
+    """Create the bus graph from a GTFS feed directory or .zip archive."""
+    with open_gtfs_file(feed, "stops.txt") as file:
+        if file is None:
+            raise FileNotFoundError(f"No stops.txt file found in '{feed}'.")
+        stops = pd.read_csv(file, dtype={"stop_id": str})
+
+    with open_gtfs_file(feed, "stop_times.txt") as file:
+        if file is None:
+            raise FileNotFoundError(f"No stop_times.txt file found in '{feed}'.")
+        stop_times = read_stop_times(file, start_time, end_time)
+
+    with open_gtfs_file(feed, "transfers.txt") as file:
+        if file is not None:
+            transfers = pd.read_csv(
+                file, dtype={"from_stop_id": str, "to_stop_id": str}
+            )
+        else:
+            transfers = pd.DataFrame()
+            logging.log(
+                logging.INFO,
+                "No transfers.txt file found. No transfer edges will be added to the graph.",
+            )
+
+    with open_gtfs_file(feed, "lanes.txt") as file:
+        if file is not None:
+            lanes = pd.read_csv(file, dtype={"start_id": str, "end_id": str})
+        else:
+            lanes = pd.DataFrame()
+            logging.log(
+                logging.INFO,
+                "No lanes.txt file found. No lane attributes will be added to the graph.",
+            )
 
-    if base_path is None:
-        path = os.path.join("../data", city.lower(), "gtfs")
-    else:
-        path = os.path.join(base_path, "data", city.lower(), "gtfs")
+    logging.log(logging.INFO, "Loaded GTFS files. Creating graph...")
 
-    if not os.path.exists(path):
-        raise FileNotFoundError(f"The GTFS directory for '{city}' does not exist.")
+    return create_gtfs_graph(stops, stop_times, transfers, lanes, start_time, end_time)
 
-    stops = pd.read_csv(os.path.join(path, "stops.txt"))
-    stop_times = pd.read_csv(os.path.join(path, "stop_times.txt"))
 
-    if os.path.exists(os.path.join(path, "transfers.txt")):
-        transfers = pd.read_csv(os.path.join(path, "transfers.txt"))
-    else:
-        transfers = pd.DataFrame()
-        logging.log(
-            logging.INFO,
-            "No transfers.txt file found. No transfer edges will be added to the graph.",
-        )
+def gtfs_time_to_seconds(times):
+    """
+    Convert a column of GTFS "HH:MM:SS" times to seconds since service-day midnight.
 
-    if os.path.exists(os.path.join(path, "lanes.txt")):
-        lanes = pd.read_csv(os.path.join(path, "lanes.txt"))
-    else:
-        lanes = pd.DataFrame()
-        logging.log(
-            logging.INFO,
-            "No lanes.txt file found. No lane attributes will be added to the graph.",
-        )
+    GTFS allows hours past 23 for trips that run after midnight, so "25:10:00"
+    becomes 90600. Hours may have one or two digits. Values that cannot be
+    parsed become <NA>.
+    """
+    # An empty column cannot be viewed as a character matrix
+    if times.empty or pd.api.types.is_numeric_dtype(times):
+        return times.astype("Int32")
+
+    # Right-align every value in a fixed-width character matrix, so that hours,
+    # minutes and seconds are at the same columns for the whole array.
+    chars = np.char.strip(times.fillna("").to_numpy(dtype="U9"))
+    chars = np.char.rjust(chars, 9).view(np.uint32).reshape(-1, 9)
+    digits = chars.astype(np.int64) - ord("0")
+    is_digit = (digits >= 0) & (digits <= 9)
+
+    valid = (
+        (chars[:, 0] == ord(" "))
+        & (is_digit[:, 1] | (chars[:, 1] == ord(" ")))
+        & is_digit[:, [2, 4, 5, 7, 8]].all(axis=1)
+        & (chars[:, 3] == ord(":"))
+        & (chars[:, 6] == ord(":"))
+    )
+    digits[~is_digit] = 0
 
-    logging.log(logging.INFO, "Loaded GTFS files. Creating graph...")
+    hours = digits[:, 1] * 10 + digits[:, 2]
+    minutes = digits[:, 4] * 10 + digits[:, 5]
+    seconds = digits[:, 7] * 10 + digits[:, 8]
+    valid &= (minutes < 60) & (seconds < 60)
 
-    return create_gtfs_graph(stops, stop_times, transfers, lanes, start_time, end_time)
+    return pd.Series(
+        hours * 3600 + minutes * 60 + seconds, index=times.index, dtype="Int32"
+    ).where(valid)
 
 
-def create_gtfs_graph(stops, stop_times, transfers, lanes, start_time, end_time):
-    # Convert arrival and departure times in stop_times to datetime.time objects
-    def convert_to_time(value):
-        try:
-            return pd.to_datetime(value, format="%H:%M:%S").time()
-        except ValueError:
-            return None
+def time_to_seconds(value) -> int:
+    """Convert a time, datetime or "HH:MM:SS" string to seconds since midnight."""
+    if isinstance(value, str):
+        seconds = gtfs_time_to_seconds(pd.Series([value])).iloc[0]
+        if pd.isna(seconds):
+            raise ValueError(f"Invalid time '{value}', expected HH:MM:SS.")
+        return int(seconds)
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+FULL_DAY_END = int(np.iinfo(np.int32).max)
 
-    start_time = pd.to_datetime(start_time, format="%H:%M:%S").time()
-    end_time = pd.to_datetime(end_time, format="%H:%M:%S").time()
 
-    stop_times["arrival_time"] = stop_times["arrival_time"].apply(convert_to_time)
-    stop_times["departure_time"] = stop_times["departure_time"].apply(convert_to_time)
+def get_time_window(start_time=None, end_time=None):
+    """
+    Return the time window as seconds since midnight of the service day.
+
+    An end time that lies before the start time refers to the following day. A
+    missing start or end time leaves that side of the window open, so the
+    default window covers the full service day including trips past midnight.
+    """
+    start_seconds = 0 if start_time is None else time_to_seconds(start_time)
+    if end_time is None:
+        return start_seconds, FULL_DAY_END
+    end_seconds = time_to_seconds(end_time)
+    if end_seconds < start_seconds:
+        end_seconds += 24 * 3600
+    return start_seconds, end_seconds
+
+
+STOP_TIMES_DTYPES = {
+    "trip_id": str,
+    "arrival_time": str,
+    "departure_time": str,
+    "stop_id": str,
+    "stop_sequence": "int32",
+}
+
+
+def read_stop_times(path, start_time, end_time, chunksize=500_000):
+    """
+    Read the stop times of a GTFS feed in chunks, keeping only the time window.
+
+    Only the columns needed for the graph are read, with compact dtypes, and
+    the times are converted to seconds since midnight per chunk. Each chunk is
+    filtered to the stops inside the window, the same filter create_gtfs_graph
+    applies, as an edge only joins two stops inside the window. That way peak
+    memory depends on the size of the window and not on the size of the feed.
+    """
+    start_time, end_time = get_time_window(start_time, end_time)
+
+    chunks = []
+    with pd.read_csv(
+        path,
+        usecols=list(STOP_TIMES_DTYPES),
+        dtype=STOP_TIMES_DTYPES,
+        chunksize=chunksize,
+    ) as reader:
+        for chunk in reader:
+            if chunk.empty:
+                continue
+            chunk["arrival_time"] = gtfs_time_to_seconds(chunk["arrival_time"])
+            chunk["departure_time"] = gtfs_time_to_seconds(chunk["departure_time"])
+
+            in_window = (
+                (chunk["arrival_time"] >= start_time)
+                & (chunk["arrival_time"] <= end_time)
+                & (chunk["departure_time"] >= start_time)
+                & (chunk["departure_time"] <= end_time)
+            ).fillna(False)
+            chunks.append(chunk[in_window.to_numpy(dtype=bool)])
+
+    if not chunks:
+        return pd.DataFrame(columns=list(STOP_TIMES_DTYPES))
+    return pd.concat(chunks, ignore_index=True)
+
+
+def create_gtfs_graph(stops, stop_times, transfers, lanes, start_time, end_time):
+    start_time, end_time = get_time_window(start_time, end_time)
+
+    stop_times = stop_times.assign(
+        arrival_time=gtfs_time_to_seconds(stop_times["arrival_time"]),
+        departure_time=gtfs_time_to_seconds(stop_times["departure_time"]),
+    )
 
     logging.log(logging.INFO, "Converted times.")
 
@@ -187,81 +398,14 @@ def create_gtfs_graph(stops, stop_times, transfers, lanes, start_time, end_time)
 
     G = nx.DiGraph()
 
-    for _, stop in tqdm(stops.iterrows(), total=stops.shape[0], desc="Adding nodes"):
-        G.add_node(
-            str(stop["stop_id"]),
-            name=stop["stop_name"],
-            lat=stop["stop_lat"],
-            lon=stop["stop_lon"],
+    G.add_nodes_from(
+        (str(stop_id), {"name": name, "lat": lat, "lon": lon})
+        for stop_id, name, lat, lon in zip(
+            stops["stop_id"], stops["stop_name"], stops["stop_lat"], stops["stop_lon"]
         )
+    )
 
-    for _, stop_time in tqdm(
-        stop_times.iterrows(), total=stop_times.shape[0], desc="Adding edges"
-    ):
-        if stop_time["departure_time"] is None or stop_time["arrival_time"] is None:
-            continue
-
-        if start_time <= stop_time["departure_time"] <= end_time:
-            # Find the next stop in the trip sequence
-            next_stop_time = stop_times[
-                (stop_times["trip_id"] == stop_time["trip_id"])
-                & (stop_times["stop_sequence"] == stop_time["stop_sequence"] + 1)
-            ]
-
-            if not next_stop_time.empty:
-                next_stop_time = next_stop_time.iloc[0]
-
-                if (
-                    next_stop_time["departure_time"] is None
-                    or next_stop_time["arrival_time"] is None
-                ):
-                    continue
-
-                # Calculate travel time in minutes
-                departure_time_full = datetime.combine(
-                    datetime.today(), stop_time["departure_time"]
-                )
-                arrival_time_full = datetime.combine(
-                    datetime.today(), next_stop_time["arrival_time"]
-                )
-                travel_time = arrival_time_full - departure_time_full
-                travel_time_minutes = travel_time.total_seconds() / 60
-
-                # Create an edge with a list of times and trip_id if it doesn't exist yet
-                if G.has_edge(
-                    str(stop_time["stop_id"]), str(next_stop_time["stop_id"])
-                ):
-                    G[str(stop_time["stop_id"])][str(next_stop_time["stop_id"])][
-                        "times"
-                    ].append(
-                        {
-                            "departure_time": departure_time_full.strftime(
-                                "%Y-%m-%d %H:%M:%S"
-                            ),
-                            "arrival_time": arrival_time_full.strftime(
-                                "%Y-%m-%d %H:%M:%S"
-                            ),
-                            "travel_time_minutes": travel_time_minutes,
-                            "trip_id": stop_time["trip_id"],
-                        }
-                    )
-                else:
-                    G.add_edge(
-                        str(stop_time["stop_id"]),
-                        str(next_stop_time["stop_id"]),
-                        times=[
-                            {
-                                "departure_time": departure_time_full.strftime(
-                                    "%Y-%m-%d %H:%M:%S"
-                                ),
-                                "arrival_time": arrival_time_full.strftime(
-                                    "%Y-%m-%d %H:%M:%S"
-                                ),
-                                "travel_time_minutes": travel_time_minutes,
-                                "trip_id": stop_time["trip_id"],
-                            }
-                        ],
-                    )
+    add_trip_edges(G, stop_times)
 
     for _, transfer in tqdm(
         transfers.iterrows(), total=transfers.shape[0], desc="Adding transfer edges"
@@ -280,12 +424,8 @@ def create_gtfs_graph(stops, stop_times, transfers, lanes, start_time, end_time)
     for _, lane in tqdm(
         lanes.iterrows(), total=lanes.shape[0], desc="Adding lane attributes"
     ):
-        try:
-            from_stop_id = str(int(lane["start_id"]))
-            to_stop_id = str(int(lane["end_id"]))
-        except ValueError:
-            from_stop_id = str(lane["start_id"])
-            to_stop_id = str(lane["end_id"])
+        from_stop_id = str(lane["start_id"])
+        to_stop_id = str(lane["end_id"])
 
         if not G.has_edge(from_stop_id, to_stop_id):
             continue
@@ -309,8 +449,129 @@ def create_gtfs_graph(stops, stop_times, transfers, lanes, start_time, end_time)
     return G
 
 
+def add_trip_edges(G, stop_times):
+    """
+    Add a time-dependent edge between every pair of consecutive stops of a trip.
+
+    Arrival and departure times are expected in seconds since midnight as
+    returned by gtfs_time_to_seconds.
+
+    The stop times are sorted by (trip_id, stop_sequence) once and each stop is
+    paired with the next one of its trip through a grouped shift, so the cost
+    grows with n log n instead of n^2. GTFS does not require the rows to be in
+    stop_sequence order, so the feed order is not relied upon. Edges are added
+    in the order in which their first departure appears in the feed and store
+    their departures as an EdgeTimetable.
+
+    A trip_id may be reused for several runs in one feed. Such a trip repeats
+    its stop_sequence values, and the k-th time a stop_sequence appears,
+    ordered by departure, is taken to belong to the k-th run, so stops of
+    different runs are never paired with each other.
+    """
+    # Number the rows by their position in the feed to restore its order later
+    stop_times = stop_times.dropna(
+        subset=["arrival_time", "departure_time"]
+    ).reset_index(drop=True)
+    stop_times = stop_times[["trip_id", "stop_id", "stop_sequence"]].assign(
+        arrival=pd.to_timedelta(stop_times["arrival_time"].astype("int64"), unit="s"),
+        departure=pd.to_timedelta(
+            stop_times["departure_time"].astype("int64"), unit="s"
+        ),
+    )
+
+    ordered = stop_times.sort_values(
+        ["trip_id", "stop_sequence", "departure"], kind="stable"
+    )
+    run = ordered.groupby(["trip_id", "stop_sequence"], sort=False).cumcount()
+    ordered = ordered.assign(run=run).sort_values(
+        ["trip_id", "run", "stop_sequence"], kind="stable"
+    )
+    next_stop = ordered.groupby(["trip_id", "run"], sort=False)[
+        ["stop_id", "stop_sequence", "arrival"]
+    ].shift(-1)
+
+    pairs = ordered.assign(
+        next_stop_id=next_stop["stop_id"],
+        next_arrival=next_stop["arrival"],
+    )[next_stop["stop_sequence"] == ordered["stop_sequence"] + 1].sort_index()
+
+    from_stops = pairs["stop_id"].astype(str)
+    to_stops = pairs["next_stop_id"].astype(pairs["stop_id"].dtype).astype(str)
+    departures = (pairs["departure"].dt.total_seconds()).to_numpy(dtype=np.int32)
+    arrivals = (pairs["next_arrival"].dt.total_seconds()).to_numpy(dtype=np.int32)
+    trip_ids = pairs["trip_id"].to_numpy()
+
+    # Group the entries by edge, keeping the order of the first departure
+    edge_codes, edges = pd.factorize(pd.MultiIndex.from_arrays([from_stops, to_stops]))
+    order = np.argsort(edge_codes, kind="stable")
+    bounds = np.cumsum(np.bincount(edge_codes, minlength=len(edges)))[:-1]
+
+    for (from_stop, to_stop), index in tqdm(
+        zip(edges, np.split(order, bounds)), total=len(edges), desc="Adding edges"
+    ):
+        G.add_edge(
+            from_stop,
+            to_stop,
+            timetable=EdgeTimetable(
+                departures[index], arrivals[index], trip_ids[index]
+            ),
+        )
+
+
+def slice_timetable_graph(graph, start_time, end_time):
+    """
+    Derive the bus graph of a time window from a graph of a longer period.
+
+    Every edge keeps the departures at or after start_time that arrive by
+    end_time, found by binary search in its sorted timetable. Like in a graph
+    built for the window, edges without such departures are dropped unless they
+    are transfer edges. The timetables share the arrays of the full graph where
+    possible, so a memory-mapped full-day graph can be sliced for many windows
+    without reading the GTFS feed again.
+
+    A graph built for the window also drops trips that arrive at their first
+    stop before the window or leave their last stop after it. Routing only uses
+    the departure and arrival of each edge, so this makes no difference there.
+    """
+    start_seconds, end_seconds = get_time_window(start_time, end_time)
+
+    window = graph.__class__()
+    window.graph.update(graph.graph)
+    window.add_nodes_from(graph.nodes(data=True))
+
+    for source, target, data in graph.edges(data=True):
+        if "timetable" not in data:
+            window.add_edge(source, target, **data)
+            continue
+        timetable = data["timetable"].window(start_seconds, end_seconds)
+        if len(timetable):
+            window.add_edge(source, target, **{**data, "timetable": timetable})
+        elif data.get("is_transfer"):
+            window.add_edge(
+                source,
+                target,
+                **{key: value for key, value in data.items() if key != "timetable"},
+            )
+    return window
+
+
 def save_graph_to_file(graph, filename):
+    """
+    Save a graph to disk.
+
+    Files ending in .gml are written as GML for use in other tools. Any other
+    path is written as a directory of NumPy arrays, which loads much faster
+    and can be memory-mapped, see graph_store.write_graph_arrays.
+    """
     logging.log(logging.INFO, "Saving graph to file: " + filename)
+    if not filename.endswith(".gml"):
+        write_graph_arrays(graph, filename)
+        return
+
+    graph = graph.copy()
+    for _, _, edge_data in graph.edges(data=True):
+        if "timetable" in edge_data:
+            edge_data["timetable"] = edge_data["timetable"].to_dict()
     nx.write_gml(graph, filename)
 
 
@@ -326,12 +587,25 @@ def get_graphs(
         city, start_time_object, end_time_object, base_path=path_to_gtfs
     )
 
-    walk_graph = create_walk_edges(
-        bus_graph, iso_polygons_gdf, matching_name=matching_column
-    )
+    logging.log(logging.INFO, "Creating walk legs...")
+    walk_legs = create_walk_leg_index(iso_polygons_gdf, matching_name=matching_column)
+
+    return bus_graph, walk_legs
 
-    return bus_graph, walk_graph
 
+def load_graph_from_file(filename, mmap_mode="r"):
+    """Load a graph written by save_graph_to_file."""
+    if not filename.endswith(".gml"):
+        return graph_from_arrays(read_graph_arrays(filename, mmap_mode=mmap_mode))
 
-def load_graph_from_file(filename):
-    return nx.read_gml(filename)
+    graph = nx.read_gml(filename)
+    for _, _, edge_data in graph.edges(data=True):
+        if "timetable" in edge_data:
+            edge_data["timetable"] = EdgeTimetable.from_dict(edge_data["timetable"])
+        elif "times" in edge_data:
+            # Graph files written before the compiled timetables
+            times = edge_data.pop("times")
+            if isinstance(times, dict):
+                times = [times]
+            edge_data["timetable"] = EdgeTimetable.from_entries(times)
+    return graph
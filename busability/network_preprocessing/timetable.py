@@ -0,0 +1,171 @@
+from datetime import datetime
+
+import numpy as np
+
+
+class EdgeTimetable:
+    """
+    Compiled timetable of a bus edge.
+
+    Departures and arrivals are stored as seconds since midnight of the service
+    day in NumPy arrays sorted by departure, together with the trip id of every
+    entry. Times past 24:00 are kept as they are, e.g. 25:10:00 is 90600.
+    """
+
+    __slots__ = (
+        "departures",
+        "arrivals",
+        "trip_ids",
+        "_earliest_indices",
+        "_trip_indices",
+    )
+
+    def __init__(self, departures, arrivals, trip_ids):
+        departures = np.asarray(departures, dtype=np.int32)
+        order = np.argsort(departures, kind="stable")
+        self.departures = departures[order]
+        self.arrivals = np.asarray(arrivals, dtype=np.int32)[order]
+        trip_ids = np.asarray(trip_ids)
+        if trip_ids.dtype == object:
+            # Store string ids as a fixed-width array instead of Python objects
+            trip_ids = np.array(trip_ids.tolist())
+        self.trip_ids = trip_ids[order]
+        self._earliest_indices = None
+        self._trip_indices = None
+
+    @classmethod
+    def from_sorted(cls, departures, arrivals, trip_ids) -> "EdgeTimetable":
+        """Wrap arrays that are already sorted by departure without copying them."""
+        timetable = cls.__new__(cls)
+        timetable.departures = departures
+        timetable.arrivals = arrivals
+        timetable.trip_ids = trip_ids
+        timetable._earliest_indices = None
+        timetable._trip_indices = None
+        return timetable
+
+    def __len__(self):
+        return len(self.departures)
+
+    def __eq__(self, other):
+        if not isinstance(other, EdgeTimetable):
+            return NotImplemented
+        return (
+            np.array_equal(self.departures, other.departures)
+            and np.array_equal(self.arrivals, other.arrivals)
+            and np.array_equal(self.trip_ids, other.trip_ids)
+        )
+
+    def __repr__(self):
+        return f"EdgeTimetable({len(self)} departures)"
+
+    def next_departure(self, time_seconds) -> int:
+        """
+        Return the index of the first departure at or after time_seconds or -1
+        if there is no such departure.
+        """
+        index = int(np.searchsorted(self.departures, time_seconds, side="left"))
+        return index if index < len(self) else -1
+
+    def earliest_arrival(self, time_seconds) -> int:
+        """
+        Return the index of the earliest arrival among the departures at or
+        after time_seconds, or -1 if there is no such departure.
+
+        This differs from next_departure when a later trip overtakes an
+        earlier one on the edge.
+        """
+        index = int(np.searchsorted(self.departures, time_seconds, side="left"))
+        if index >= len(self):
+            return -1
+        return int(self.earliest_indices()[index])
+
+    def earliest_indices(self):
+        """
+        Get the index of the earliest arrival among the departures from every
+        index on, computed once per timetable.
+        """
+        if self._earliest_indices is None:
+            arrivals = self.arrivals
+            suffix_minimum = np.minimum.accumulate(arrivals[::-1])[::-1]
+            # The earliest arrival from an index on is at the first index from
+            # there on that arrives at the minimum of its own suffix
+            indices = np.where(
+                arrivals == suffix_minimum, np.arange(len(self)), len(self)
+            )
+            self._earliest_indices = np.minimum.accumulate(indices[::-1])[::-1]
+        return self._earliest_indices
+
+    def window(self, start_seconds, end_seconds) -> "EdgeTimetable":
+        """
+        Return the entries departing at or after start_seconds and arriving
+        by end_seconds.
+
+        The departures are found by binary search. If all of them arrive in
+        time, the result shares the arrays of this timetable instead of
+        copying them.
+        """
+        start = int(np.searchsorted(self.departures, start_seconds, side="left"))
+        end = int(np.searchsorted(self.departures, end_seconds, side="right"))
+        on_time = self.arrivals[start:end] <= end_seconds
+        if on_time.all():
+            return EdgeTimetable.from_sorted(
+                self.departures[start:end],
+                self.arrivals[start:end],
+                self.trip_ids[start:end],
+            )
+        return EdgeTimetable.from_sorted(
+            self.departures[start:end][on_time],
+            self.arrivals[start:end][on_time],
+            self.trip_ids[start:end][on_time],
+        )
+
+    def trip_index(self, trip_id) -> int:
+        """
+        Return the index of the first departure of trip_id or -1.
+
+        The first index of every trip is looked up in a dict that is built
+        once per timetable.
+        """
+        if self._trip_indices is None:
+            trip_ids, first_indices = np.unique(self.trip_ids, return_index=True)
+            self._trip_indices = dict(zip(trip_ids.tolist(), first_indices.tolist()))
+        return self._trip_indices.get(trip_id, -1)
+
+    def to_dict(self) -> dict:
+        """Convert the timetable to plain lists, e.g. for writing GML."""
+        return {
+            "departures": self.departures.tolist(),
+            "arrivals": self.arrivals.tolist(),
+            "trip_ids": self.trip_ids.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "EdgeTimetable":
+        """Create a timetable from the lists written by to_dict."""
+        # GML stores a list with a single element as a scalar
+        return cls(
+            np.atleast_1d(data["departures"]),
+            np.atleast_1d(data["arrivals"]),
+            np.atleast_1d(data["trip_ids"]),
+        )
+
+    @classmethod
+    def from_entries(cls, times: list) -> "EdgeTimetable":
+        """Create a timetable from the per-edge "times" list of older graph files."""
+        departures = [
+            datetime.strptime(entry["departure_time"], "%Y-%m-%d %H:%M:%S")
+            for entry in times
+        ]
+        arrivals = [
+            datetime.strptime(entry["arrival_time"], "%Y-%m-%d %H:%M:%S")
+            for entry in times
+        ]
+        # Times after midnight were written with the date of the following day
+        midnight = datetime.combine(min(departures).date(), datetime.min.time())
+
+        return cls(
+            [(value - midnight).total_seconds() for value in departures],
+            [(value - midnight).total_seconds() for value in arrivals],
+            [entry["trip_id"] for entry in times],
+        )
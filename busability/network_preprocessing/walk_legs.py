@@ -0,0 +1,139 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+FORMAT_VERSION = 1
+
+
+class WalkLegIndex:
+    """
+    Walk legs from every bus stop to its walk isochrone nodes.
+
+    The legs are a sparse matrix in CSR layout with the bus stops as rows, the
+    isochrone node names ("<stop>_<minutes>") as columns and the walk minutes
+    as values: the legs of row i are indices and minutes between indptr[i]
+    and indptr[i + 1], sorted by minutes. This replaces the walk graph, which
+    copied the whole bus graph only to add one star of edges per stop.
+    """
+
+    def __init__(self, stops, nodes, indptr, indices, minutes):
+        self.stops = stops
+        self.columns = nodes
+        self.indptr = indptr
+        self.indices = indices
+        self.minutes = minutes
+        self.stop_index = {stop: row for row, stop in enumerate(stops.tolist())}
+        # Minutes keyed by row, so the legs of many rows are found with one search
+        rows = np.repeat(np.arange(len(stops), dtype=np.int64), np.diff(indptr))
+        self.keys = (rows << 32) + minutes
+
+    def __contains__(self, stop):
+        return stop in self.stop_index
+
+    def __len__(self):
+        return len(self.stops)
+
+    @property
+    def nodes(self) -> list:
+        """All isochrone node names, grouped by stop."""
+        return self.columns[self.indices].tolist()
+
+    def reachable_nodes(self, stop, remaining_minutes):
+        """Get the isochrone nodes of a stop within the remaining minutes."""
+        if stop not in self.stop_index:
+            return np.array([], dtype=str)
+        row = self.stop_index[stop]
+        start, end = self.indptr[row], self.indptr[row + 1]
+        count = np.searchsorted(
+            self.minutes[start:end], remaining_minutes, side="right"
+        )
+        return self.columns[self.indices[start : start + count]]
+
+    def column_positions(self, node_names):
+        """Get the column of every node name, or -1 if it is not a column."""
+        return pd.Index(self.columns).get_indexer(np.asarray(node_names, dtype=str))
+
+    def reachable_columns(self, rows, remaining_minutes):
+        """
+        Get the columns of the isochrone nodes reachable from many stops.
+
+        rows and remaining_minutes are arrays with the row of every stop and
+        its remaining minutes. All rows are thresholded with one binary search
+        and the columns are gathered without a Python loop.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        # Walk minutes are integers, so a leg fits if it is at most the floor
+        limits = np.floor(np.maximum(remaining_minutes, -1)).astype(np.int64)
+        starts = self.indptr[rows]
+        counts = (
+            np.searchsorted(self.keys, (rows << 32) + limits, side="right") - starts
+        )
+        positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(
+            counts.sum()
+        )
+        return self.indices[positions]
+
+
+def create_walk_leg_index(isochrones_gdf, matching_name) -> WalkLegIndex:
+    """Create the walk legs of every stop from the walk isochrones."""
+    stops = isochrones_gdf[matching_name].astype(str)
+    value = isochrones_gdf["value"] / 60
+    legs = pd.DataFrame(
+        {
+            "stop": stops,
+            "node": stops + "_" + value.astype(str),
+            "minutes": value.astype(int),
+        }
+    ).drop_duplicates("node")
+    legs = legs.sort_values(["stop", "minutes"], kind="stable")
+
+    stop_names, starts = np.unique(legs["stop"].to_numpy(dtype=str), return_index=True)
+
+    return WalkLegIndex(
+        stop_names,
+        legs["node"].to_numpy(dtype=str),
+        np.append(starts, len(legs)).astype(np.int64),
+        np.arange(len(legs), dtype=np.int32),
+        legs["minutes"].to_numpy(dtype=np.int32),
+    )
+
+
+def save_walk_leg_index(walk_legs, directory):
+    """Write the walk legs as a directory of NumPy arrays."""
+    os.makedirs(directory, exist_ok=True)
+    for name in ["stops", "columns", "indptr", "indices", "minutes"]:
+        np.save(
+            os.path.join(directory, f"{name}.npy"),
+            getattr(walk_legs, name),
+            allow_pickle=False,
+        )
+    with open(os.path.join(directory, "walk_legs.json"), "w") as f:
+        json.dump({"version": FORMAT_VERSION}, f)
+
+
+def load_walk_leg_index(directory, mmap_mode="r") -> WalkLegIndex:
+    """Load the walk legs written by save_walk_leg_index, memory-mapped by default."""
+    with open(os.path.join(directory, "walk_legs.json")) as f:
+        meta = json.load(f)
+    if meta["version"] != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported walk legs format version {meta['version']} in '{directory}'."
+        )
+
+    arrays = {
+        name: np.load(
+            os.path.join(directory, f"{name}.npy"),
+            mmap_mode=mmap_mode,
+            allow_pickle=False,
+        )
+        for name in ["stops", "columns", "indptr", "indices", "minutes"]
+    }
+    return WalkLegIndex(
+        arrays["stops"],
+        arrays["columns"],
+        arrays["indptr"],
+        arrays["indices"],
+        arrays["minutes"],
+    )
@@ -0,0 +1,78 @@
+import heapq
+
+import numpy as np
+
+
+def batch_earliest_arrivals(connections, start_stops, start_seconds, end_seconds):
+    """
+    Get the earliest arrivals of many origins with one scan of the connections.
+
+    Origin i starts at stop start_stops[i] at start_seconds[i] and is bit i of
+    the Python int labels, so one label carries any number of origins. The
+    connections are scanned once in order of departure. Arrivals wait in a
+    queue until the scan reaches their time, so the label of a stop only holds
+    the origins that arrived before the departure that reads it. A connection
+    forwards the origins at its stop that have not yet reached its target.
+
+    Returns a list of (stop index, arrival seconds, origin bits) with the
+    origins that first reached the stop at that time, in order of arrival.
+    """
+    reached = [0] * len(connections.stops)
+    queue = [
+        (start, origin, stop, 1 << origin)
+        for origin, (stop, start) in enumerate(zip(start_stops, start_seconds))
+        if start <= end_seconds
+    ]
+    heapq.heapify(queue)
+    pushed = len(start_stops)
+    first_arrivals = []
+
+    def settle_arrivals(latest):
+        nonlocal pushed
+        while queue and queue[0][0] <= latest:
+            arrival, _, stop, origins = heapq.heappop(queue)
+            new_origins = origins & ~reached[stop]
+            if not new_origins:
+                continue
+            reached[stop] |= new_origins
+            first_arrivals.append((stop, arrival, new_origins))
+            if not has_transfers[stop]:
+                continue
+            targets, seconds = connections.transfers(stop)
+            for target, target_arrival in zip(
+                targets.tolist(), (arrival + seconds).tolist()
+            ):
+                if target_arrival <= end_seconds:
+                    pushed += 1
+                    heapq.heappush(queue, (target_arrival, pushed, target, new_origins))
+
+    has_transfers = connections.has_transfers.tolist()
+    departures = connections.connections["departure"]
+    if queue:
+        first = int(np.searchsorted(departures, queue[0][0]))
+        from_stops = connections.connections["from_stop"][first:].tolist()
+        to_stops = connections.connections["to_stop"][first:].tolist()
+        arrivals = connections.connections["arrival"][first:].tolist()
+        for from_stop, to_stop, departure, arrival in zip(
+            from_stops, to_stops, departures[first:].tolist(), arrivals
+        ):
+            if departure > end_seconds:
+                break
+            if queue and queue[0][0] <= departure:
+                settle_arrivals(departure)
+            origins = reached[from_stop] & ~reached[to_stop]
+            if origins and arrival <= end_seconds:
+                pushed += 1
+                heapq.heappush(queue, (arrival, pushed, to_stop, origins))
+    settle_arrivals(end_seconds)
+    return first_arrivals
+
+
+def origin_indices(origins, count):
+    """Get the indices of the set bits of an int with count bits."""
+    return np.flatnonzero(
+        np.unpackbits(
+            np.frombuffer(origins.to_bytes((count + 7) // 8, "little"), np.uint8),
+            bitorder="little",
+        )
+    )
@@ -0,0 +1,103 @@
+import numpy as np
+
+WORD_DTYPE = np.dtype("<u8")
+
+
+class NodeBitset:
+    """
+    A set of node indices stored as bits in 64 bit words.
+
+    Bit i is set if node i is in the set. The nodes are the columns of the
+    walk legs, so a bitset is turned into a row mask of the isochrone frame
+    with row_mask and a batch of bitsets is stored as one array of words with
+    save_bitsets.
+    """
+
+    def __init__(self, words, size):
+        self.words = words
+        self.size = size
+
+    @classmethod
+    def from_indices(cls, indices, size):
+        """Create the bitset of the given node indices."""
+        mask = np.zeros(word_count(size) * 64, dtype=bool)
+        mask[np.asarray(indices, dtype=np.int64)] = True
+        return cls(np.packbits(mask, bitorder="little").view(WORD_DTYPE), size)
+
+    @classmethod
+    def empty(cls, size):
+        return cls(np.zeros(word_count(size), dtype=WORD_DTYPE), size)
+
+    def __len__(self):
+        return int(np.unpackbits(self.words.view(np.uint8)).sum())
+
+    def __contains__(self, index):
+        return bool((int(self.words[index >> 6]) >> (index & 63)) & 1)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, NodeBitset)
+            and self.size == other.size
+            and np.array_equal(self.words, other.words)
+        )
+
+    def __or__(self, other):
+        return NodeBitset(self.words | other.words, self.size)
+
+    def __ior__(self, other):
+        self.words = self.words | other.words
+        return self
+
+    def __and__(self, other):
+        return NodeBitset(self.words & other.words, self.size)
+
+    def mask(self):
+        """Get the bitset as a bool array with one entry per node."""
+        return np.unpackbits(self.words.view(np.uint8), bitorder="little")[
+            : self.size
+        ].astype(bool)
+
+    def indices(self):
+        """Get the sorted indices of the nodes in the set."""
+        return np.flatnonzero(self.mask())
+
+    def row_mask(self, row_nodes):
+        """
+        Get a mask of the rows of a frame whose node is in the set.
+
+        row_nodes holds the node index of every row, or -1 for rows without a
+        node, see WalkLegIndex.column_positions.
+        """
+        row_nodes = np.asarray(row_nodes, dtype=np.int64)
+        row_mask = np.zeros(len(row_nodes), dtype=bool)
+        found = row_nodes >= 0
+        row_mask[found] = self.mask()[row_nodes[found]]
+        return row_mask
+
+
+def word_count(size):
+    return (size + 63) // 64
+
+
+def save_bitsets(path, bitsets, size, count=None):
+    """
+    Store a batch of bitsets as one array with a row of words per bitset.
+
+    With count, bitsets may be an iterator of count bitsets, which are written
+    to the memory-mapped file as they arrive instead of being held in memory.
+    """
+    if count is None:
+        bitsets = list(bitsets)
+        count = len(bitsets)
+    words = np.lib.format.open_memmap(
+        path, mode="w+", dtype=WORD_DTYPE, shape=(count, word_count(size))
+    )
+    for row, bitset in enumerate(bitsets):
+        words[row] = bitset.words
+    words.flush()
+
+
+def load_bitsets(path, size, mmap_mode="r"):
+    """Load the bitsets written by save_bitsets, memory-mapped by default."""
+    words = np.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+    return [NodeBitset(row, size) for row in words]
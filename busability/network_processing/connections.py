@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+
+CONNECTION_DTYPE = np.dtype(
+    [
+        ("from_stop", np.int32),
+        ("to_stop", np.int32),
+        ("departure", np.int32),
+        ("arrival", np.int32),
+        ("trip", np.int32),
+    ]
+)
+
+
+class Connections:
+    """
+    The elementary connections and transfers of a bus graph as NumPy arrays.
+
+    Stops are numbered by their position in stops. Every connection is one
+    departure on a bus edge, sorted by departure and then arrival. Trips are
+    numbered per run, see graph_connections. The transfers of every stop are
+    stored CSR-style: the transfers of stop i are transfer_targets and
+    transfer_seconds between transfer_offsets[i] and transfer_offsets[i + 1].
+    """
+
+    def __init__(
+        self, stops, connections, transfer_offsets, transfer_targets, transfer_seconds
+    ):
+        self.stops = stops
+        self.stop_index = {stop: index for index, stop in enumerate(stops)}
+        self.connections = connections
+        self.transfer_offsets = transfer_offsets
+        self.transfer_targets = transfer_targets
+        self.transfer_seconds = transfer_seconds
+        self.has_transfers = np.diff(transfer_offsets) > 0
+
+    def __len__(self):
+        return len(self.connections)
+
+    @property
+    def trip_count(self) -> int:
+        return int(self.connections["trip"].max()) + 1 if len(self) else 0
+
+    def transfers(self, stop):
+        """Return the target stops and transfer times of the transfers from a stop."""
+        start, end = self.transfer_offsets[stop], self.transfer_offsets[stop + 1]
+        return self.transfer_targets[start:end], self.transfer_seconds[start:end]
+
+    def relax_transfers(self, arrivals, stops, end_seconds):
+        """
+        Improve the arrivals by walking over transfers from the given stops.
+
+        Transfers may be chained, like transfer edges in the bus graph. Arrivals
+        after end_seconds are not kept. Returns the stops that were improved.
+        """
+        improved = set()
+        stops = np.asarray(list(stops), dtype=np.int64)
+        pending = stops[self.has_transfers[stops]].tolist()
+        while pending:
+            stop = pending.pop()
+            targets, seconds = self.transfers(stop)
+            for target, arrival in zip(
+                targets.tolist(), (arrivals[stop] + seconds).tolist()
+            ):
+                if arrival < arrivals[target] and arrival <= end_seconds:
+                    arrivals[target] = arrival
+                    improved.add(target)
+                    pending.append(target)
+        return improved
+
+
+def graph_connections(graph) -> Connections:
+    """
+    Extract the connections and transfers of a bus graph.
+
+    A trip_id may be reused for several runs in one feed, so the departures of
+    a trip are ordered by time and a new run starts whenever a departure does
+    not continue from the stop and time where the previous one arrived. Like in
+    time_dependent_reachable_nodes_via_bus_network, an edge that is a transfer
+    is only used as a transfer.
+    """
+    stops = list(graph.nodes)
+    stop_index = {stop: index for index, stop in enumerate(stops)}
+
+    from_stops, to_stops, departures, arrivals, trip_ids = [], [], [], [], []
+    transfers = []
+    for source, target, data in graph.edges(data=True):
+        if "is_transfer" in data:
+            transfers.append(
+                (stop_index[source], stop_index[target], int(data["weight"]) * 60)
+            )
+            continue
+        timetable = data.get("timetable")
+        if timetable is None or not len(timetable):
+            continue
+        from_stops.append(np.full(len(timetable), stop_index[source], dtype=np.int32))
+        to_stops.append(np.full(len(timetable), stop_index[target], dtype=np.int32))
+        departures.append(timetable.departures)
+        arrivals.append(timetable.arrivals)
+        trip_ids.append(np.asarray(timetable.trip_ids).astype(str))
+
+    connections = np.zeros(sum(len(values) for values in departures), CONNECTION_DTYPE)
+    if len(connections):
+        connections["from_stop"] = np.concatenate(from_stops)
+        connections["to_stop"] = np.concatenate(to_stops)
+        connections["departure"] = np.concatenate(departures)
+        connections["arrival"] = np.concatenate(arrivals)
+        trip_codes = pd.factorize(np.concatenate(trip_ids))[0]
+
+        # Split every trip into runs of connections that continue each other
+        order = np.lexsort((connections["departure"], trip_codes))
+        ordered = connections[order]
+        new_run = np.ones(len(ordered), dtype=bool)
+        new_run[1:] = (
+            (trip_codes[order][1:] != trip_codes[order][:-1])
+            | (ordered["from_stop"][1:] != ordered["to_stop"][:-1])
+            | (ordered["departure"][1:] < ordered["arrival"][:-1])
+        )
+        connections["trip"][order] = np.cumsum(new_run) - 1
+
+        connections = connections[
+            np.lexsort((connections["arrival"], connections["departure"]))
+        ]
+
+    transfers = np.array(sorted(transfers), dtype=np.int32).reshape(-1, 3)
+    transfer_offsets = np.searchsorted(
+        transfers[:, 0], np.arange(len(stops) + 1)
+    ).astype(np.int64)
+
+    return Connections(
+        stops, connections, transfer_offsets, transfers[:, 1], transfers[:, 2]
+    )
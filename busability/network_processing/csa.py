@@ -0,0 +1,96 @@
+import math
+from datetime import datetime, time, timedelta
+
+import numpy as np
+
+from busability.network_preprocessing.network_creator import get_time_window
+from busability.network_processing.connections import graph_connections
+
+UNREACHED = np.iinfo(np.int64).max
+
+
+class CsaTimetable:
+    """
+    The connections and transfers of a bus graph for Connection Scan queries.
+
+    The columns of the departure-sorted connection array are also kept as
+    Python lists, because the scan reads them one connection at a time.
+    """
+
+    def __init__(self, connections):
+        self.connections = connections
+        self.from_stops = connections.connections["from_stop"].tolist()
+        self.to_stops = connections.connections["to_stop"].tolist()
+        self.departures = connections.connections["departure"].tolist()
+        self.arrivals = connections.connections["arrival"].tolist()
+        self.trips = connections.connections["trip"].tolist()
+        self.has_transfers = connections.has_transfers.tolist()
+
+    def __contains__(self, stop):
+        return stop in self.connections.stop_index
+
+
+def create_csa_timetable(graph) -> CsaTimetable:
+    """Create the Connection Scan timetable of a bus graph."""
+    return CsaTimetable(graph_connections(graph))
+
+
+def csa_reachable_nodes(timetable, start_node, start_time, end_time):
+    """
+    Get the earliest arrival time at every stop reachable by end_time.
+
+    The connections departing between start_time and end_time are scanned once
+    in order of departure. A connection can be used if its trip was boarded
+    before or if it departs after the arrival at its stop. Transfers are walked
+    whenever the arrival at a stop improves.
+
+    Returns the same dict of stops and datetimes as
+    time_dependent_reachable_nodes_via_bus_network in normal mode.
+    """
+    midnight = datetime.combine(start_time.date(), time())
+    start_seconds = (start_time - midnight).total_seconds()
+    end_seconds = get_time_window(start_time, end_time)[1]
+    if start_seconds > end_seconds:
+        return {}
+    if start_node not in timetable:
+        return {start_node: start_time}
+
+    connections = timetable.connections
+    start = connections.stop_index[start_node]
+    arrivals = [UNREACHED] * len(connections.stops)
+    arrivals[start] = math.ceil(start_seconds)
+    connections.relax_transfers(arrivals, [start], end_seconds)
+    trip_reached = [False] * connections.trip_count
+
+    from_stops = timetable.from_stops
+    to_stops = timetable.to_stops
+    departures = timetable.departures
+    connection_arrivals = timetable.arrivals
+    trips = timetable.trips
+    has_transfers = timetable.has_transfers
+
+    first = int(np.searchsorted(connections.connections["departure"], arrivals[start]))
+    for index in range(first, len(departures)):
+        departure = departures[index]
+        if departure > end_seconds:
+            break
+        trip = trips[index]
+        if not trip_reached[trip]:
+            if arrivals[from_stops[index]] > departure:
+                continue
+            trip_reached[trip] = True
+
+        arrival = connection_arrivals[index]
+        to_stop = to_stops[index]
+        if arrival <= end_seconds and arrival < arrivals[to_stop]:
+            arrivals[to_stop] = arrival
+            if has_transfers[to_stop]:
+                connections.relax_transfers(arrivals, [to_stop], end_seconds)
+
+    # Fractional start seconds are kept for the start stop, like the Dijkstra search
+    return {
+        connections.stops[stop]: midnight
+        + timedelta(seconds=start_seconds if stop == start else arrival)
+        for stop, arrival in enumerate(arrivals)
+        if arrival <= end_seconds
+    }
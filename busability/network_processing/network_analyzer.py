@@ -1,10 +1,30 @@
-import copy
-from datetime import timedelta, datetime
+import heapq
+from collections import OrderedDict
+from datetime import timedelta, datetime, time
 
 import networkx as nx
 import geopandas as gpd
-
-from busability.utils import get_config_value
+import numpy as np
+
+from busability.network_preprocessing.network_creator import get_time_window
+from busability.network_preprocessing.walk_legs import WalkLegIndex
+from busability.network_processing.batch import (
+    batch_earliest_arrivals,
+    origin_indices,
+)
+from busability.network_processing.bitset import NodeBitset
+from busability.network_processing.connections import graph_connections
+from busability.network_processing.csa import (
+    CsaTimetable,
+    create_csa_timetable,
+    csa_reachable_nodes,
+)
+from busability.network_processing.profile import csa_profile, profile_reachable_nodes
+from busability.network_processing.raptor import (
+    RaptorTimetable,
+    create_raptor_timetable,
+    raptor_reachable_nodes,
+)
 
 
 def shortest_paths_to_nodes(graph, start, nodes):
@@ -21,310 +41,457 @@ def get_bus_station_from_isochrone(node):
     return (bus_station_node, int(float(distance)))
 
 
+ENGINES = ["dijkstra", "raptor", "csa"]
+
+
+def get_bus_network(bus_graph, engine="dijkstra", max_transfers=None):
+    """
+    Prepare the bus graph for the routing engine used by
+    reachable_nodes_via_bus_network.
+
+    The Dijkstra search works on the graph itself and supports all modes. The
+    RAPTOR and Connection Scan engines work on arrays of connections and only
+    support the normal mode.
+    """
+    if engine == "dijkstra":
+        return bus_graph
+    if engine == "raptor":
+        return create_raptor_timetable(bus_graph, max_transfers=max_transfers)
+    if engine == "csa":
+        return create_csa_timetable(bus_graph)
+    raise ValueError(f"Invalid engine '{engine}'. Please choose one of {ENGINES}.")
+
+
+class ReachabilityCache:
+    """
+    Bounded LRU cache of bus reachability results across queries.
+
+    The isochrones of a stop start bus searches from the same stop that only
+    differ in the arrival time. In normal mode the search boards the first
+    departures at or after the arrival time, so all arrivals before the same
+    next departure from the stop reach the same nodes at the same times: the
+    earliest of them dominates the later ones. Such arrivals share a bucket,
+    the index of the next departure among all departures from the stop. Stops
+    with transfers and the rush hour modes, where the travel time depends on
+    the arrival time, are only reused for the same arrival time.
+
+    Results are kept for one bus network and dropped when another one is
+    queried.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bus_network = None
+        self.stop_departures = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        """Drop all results and reset the counters."""
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.bus_network = None
+        self.stop_departures = {}
+
+    def departures(self, node):
+        """
+        Get the sorted departures from a stop and whether it has transfers, or
+        None if the stop is not in the bus network.
+        """
+        if node in self.stop_departures:
+            return self.stop_departures[node]
+        bus_network = self.bus_network
+        if isinstance(bus_network, (RaptorTimetable, CsaTimetable)):
+            connections = bus_network.connections
+            if node not in connections.stop_index:
+                return None
+            stop = connections.stop_index[node]
+            from_stops = connections.connections["from_stop"]
+            departures = (
+                np.unique(connections.connections["departure"][from_stops == stop]),
+                bool(connections.has_transfers[stop]),
+            )
+        elif node in bus_network:
+            edges = bus_network[node].values()
+            departures = (
+                np.unique(
+                    np.concatenate(
+                        [
+                            edge_data["timetable"].departures
+                            for edge_data in edges
+                            if "is_transfer" not in edge_data
+                            and "timetable" in edge_data
+                        ]
+                        + [np.array([], dtype=np.int32)]
+                    )
+                ),
+                any("is_transfer" in edge_data for edge_data in edges),
+            )
+        else:
+            return None
+        self.stop_departures[node] = departures
+        return departures
+
+    def key(self, bus_network, node, current_time, end_time, mode, config):
+        """Get the key of a query, see the class docstring for the buckets."""
+        if bus_network is not self.bus_network:
+            self.clear()
+            self.bus_network = bus_network
+        midnight = datetime.combine(current_time.date(), time())
+        start_seconds = (current_time - midnight).total_seconds()
+        end_seconds = get_time_window(current_time, end_time)[1]
+        bucket = start_seconds
+        departures = self.departures(node)
+        if (
+            mode == "normal"
+            and start_seconds <= end_seconds
+            and departures is not None
+            and not departures[1]
+        ):
+            bucket = int(np.searchsorted(departures[0], start_seconds, side="left"))
+        return node, midnight, bucket, end_seconds, mode, config
+
+    def get(self, key):
+        """Get a cached result and mark it as recently used, or None."""
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        """Store a result and evict the least recently used ones above the bound."""
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
 def reachable_nodes_via_bus_network(
-    bus_graph, node, remaining_weight, current_time, end_time, mode
+    bus_graph,
+    node,
+    remaining_weight,
+    current_time,
+    end_time,
+    mode,
+    config=None,
+    cache=None,
 ):
-    """Get all reachable nodes via the bus network remaining weight."""
+    """
+    Get all reachable nodes via the bus network remaining weight.
+
+    With a cache, results are reused for queries from the same stop whose
+    arrival time is dominated by an earlier one, see ReachabilityCache. The
+    cache does not notice changes to a bus network, so only pass one for a
+    network that is not modified anymore.
+    """
+    if cache is None:
+        return search_bus_network(bus_graph, node, current_time, end_time, mode, config)
+
+    key = cache.key(bus_graph, node, current_time, end_time, mode, config)
+    result = cache.get(key)
+    if result is None:
+        result = search_bus_network(
+            bus_graph, node, current_time, end_time, mode, config
+        )
+        cache.put(key, result)
+    # Only the start stop keeps the own arrival time of the query
+    result = dict(result)
+    if node in result:
+        result[node] = current_time
+    return result
+
+
+def search_bus_network(bus_graph, node, current_time, end_time, mode, config=None):
+    """Search the bus network with the engine it was prepared for."""
+    if isinstance(bus_graph, RaptorTimetable):
+        if mode != "normal":
+            raise ValueError("The RAPTOR engine only supports the 'normal' mode.")
+        return raptor_reachable_nodes(bus_graph, node, current_time, end_time)
+
+    if isinstance(bus_graph, CsaTimetable):
+        if mode != "normal":
+            raise ValueError(
+                "The Connection Scan engine only supports the 'normal' mode."
+            )
+        return csa_reachable_nodes(bus_graph, node, current_time, end_time)
+
     return time_dependent_reachable_nodes_via_bus_network(
-        node, bus_graph, current_time, end_time, mode
+        node, bus_graph, current_time, end_time, mode, config=config
     )
 
 
+def get_lane_duration(edge_data, mode, config):
+    """Get the travel time in minutes on an edge from its lane lengths."""
+    len_two_lanes = float(edge_data.get("len_two_lanes", 0))
+    len_more_than_two_lanes = float(edge_data.get("len_more_than_two_lanes", 0))
+
+    if mode == "rush_hour":
+        # Calculate duration safely, including only non-zero values
+        total_length = 0
+        if len_two_lanes > 0:
+            total_length += len_two_lanes
+        if len_more_than_two_lanes > 0:
+            total_length += len_more_than_two_lanes
+
+        return (total_length / (config.rush_hour_speed / 3.6)) / 60
+
+    # Avoid division by zero by checking if values are non-zero
+    duration = 0
+    if len_two_lanes > 0:
+        duration += len_two_lanes / (config.rush_hour_speed / 3.6)
+    if len_more_than_two_lanes > 0:
+        duration += len_more_than_two_lanes / (config.bus_speed / 3.6)
+    return duration / 60  # Convert seconds to minutes
+
+
+def precompute_lane_durations(graph, config):
+    """
+    Store the travel time in minutes of every bus edge for the rush hour modes.
+
+    The durations are stored as edge attribute lane_durations, so the search
+    neither parses lane lengths nor reads the speeds from the config per edge.
+    """
+    for _, _, edge_data in graph.edges(data=True):
+        if "is_transfer" in edge_data or "timetable" not in edge_data:
+            continue
+        edge_data["lane_durations"] = {
+            mode: get_lane_duration(edge_data, mode, config)
+            for mode in ["rush_hour", "rush_hour_priority_lane"]
+        }
+
+
+MODES = ["normal", "rush_hour", "rush_hour_priority_lane"]
+
+LOAD_TIME = 0.5
+
+
+def get_edge_arrival(edge_data, current_time, trip_id, mode, end_seconds, config):
+    """
+    Get the arrival time and trip when leaving over an edge at current_time.
+
+    Times are in seconds since midnight of the service day. Returns None if
+    the edge cannot be used or arrives after end_seconds.
+    """
+    if "is_transfer" in edge_data.keys():
+        arrival_time = current_time + int(edge_data["weight"]) * 60
+        return (arrival_time, None) if arrival_time <= end_seconds else None
+
+    timetable = edge_data["timetable"]
+
+    if mode == "normal":
+        # Take the departure after the current time that arrives first
+        index = timetable.earliest_arrival(current_time)
+        if index < 0 or timetable.arrivals[index] > end_seconds:
+            return None
+        return int(timetable.arrivals[index]), timetable.trip_ids[index]
+
+    # Stay on the current trip, otherwise take the next departure
+    departure_index = timetable.next_departure(current_time)
+    trip_index = -1 if trip_id is None else timetable.trip_index(trip_id)
+
+    if "lane_durations" in edge_data:
+        duration = edge_data["lane_durations"][mode]
+    else:
+        duration = get_lane_duration(edge_data, mode, config)
+    if trip_index >= 0 and (departure_index < 0 or trip_index <= departure_index):
+        index = trip_index
+        duration += LOAD_TIME
+    elif departure_index >= 0:
+        index = departure_index
+    else:
+        return None
+
+    arrival_time = current_time + duration * 60
+    if arrival_time > end_seconds:
+        return None
+    return arrival_time, timetable.trip_ids[index]
+
+
 def time_dependent_reachable_nodes_via_bus_network(
-    start_node, graph, start_time, end_time, mode="normal"
+    start_node, graph, start_time, end_time, mode="normal", stats=None, config=None
 ):
-    visited = set()
+    """
+    Get the earliest arrival time at every node reachable by end_time.
+
+    Labels are settled in the order of their arrival time with a priority
+    queue, so every node gets its earliest arrival independent of the order of
+    its neighbours. In the rush hour modes the travel time of an edge depends
+    on whether the trip is continued, so there is one label per node and trip.
+
+    If a stats dict is given, the number of labels pushed to and settled from
+    the queue is stored in it. config holds the bus speeds for edges without
+    precomputed lane durations, see precompute_lane_durations, and is required
+    in the rush hour modes.
+    """
+    if mode not in MODES:
+        raise ValueError(
+            "Invalid mode. Please choose either 'normal', 'rush_hour' or 'rush_hour_priority_lane' mode."
+        )
+    if config is None and mode != "normal":
+        raise ValueError(f"The '{mode}' mode requires an AnalysisConfig.")
+
+    # Work in seconds since midnight of the start day, like the edge timetables
+    midnight = datetime.combine(start_time.date(), time())
+    start_seconds = (start_time - midnight).total_seconds()
+    end_seconds = get_time_window(start_time, end_time)[1]
+
     reachable = {}
+    settled = set()
+    queue = (
+        [(start_seconds, 0, start_node, None)] if start_seconds <= end_seconds else []
+    )
+    pushed = len(queue)
 
-    def dfs(node, current_time, trip_id=None):
-        if current_time.time() > end_time.time():
-            return
-
-        # Mark the current node as reachable at the current time
-        reachable[node] = current_time
-        visited.add(node)
-
-        load_time = 0.5
-
-        if mode == "normal":
-            try:
-                for neighbor in graph[node]:
-                    if neighbor in visited:
-                        continue
-                    edge_data = graph.get_edge_data(node, neighbor)
-
-                    if "is_transfer" in edge_data.keys():
-                        # Handle transfer edges, only proceed if neighbor hasn't been visited in the current path
-                        if neighbor not in visited:
-                            dfs(
-                                neighbor,
-                                current_time
-                                + timedelta(minutes=int(edge_data["weight"])),
-                            )
-                    else:
-                        # Handle time-dependent edges
-                        for time_entry in edge_data["times"]:
-                            if isinstance(time_entry["arrival_time"], str):
-                                time_entry["arrival_time"] = datetime.strptime(
-                                    time_entry["arrival_time"], "%Y-%m-%d %H:%M:%S"
-                                )
-                            if isinstance(time_entry["departure_time"], str):
-                                time_entry["departure_time"] = datetime.strptime(
-                                    time_entry["departure_time"], "%Y-%m-%d %H:%M:%S"
-                                )
-
-                        next_time_info = None
-
-                        # Find the next valid departure time after the current time
-                        for time_info in edge_data["times"]:
-                            if (
-                                time_info["departure_time"].time()
-                                >= current_time.time()
-                            ):
-                                next_time_info = time_info
-                                if (
-                                    next_time_info["arrival_time"].time()
-                                    <= end_time.time()
-                                ):
-                                    dfs(neighbor, next_time_info["arrival_time"])
-                                    break
-
-            except Exception as err:
-                raise err
-
-        elif mode == "rush_hour":
-            try:
-                for neighbor in graph[node]:
-                    if neighbor in visited:
-                        continue
-                    edge_data = graph.get_edge_data(node, neighbor)
-
-                    if "is_transfer" in edge_data.keys():
-                        # Handle transfer edges, only proceed if neighbor hasn't been visited in the current path
-                        if neighbor not in visited:
-                            dfs(
-                                neighbor,
-                                current_time
-                                + timedelta(minutes=int(edge_data["weight"])),
-                            )
-                    else:
-                        # Handle time-dependent edges
-                        for time_entry in edge_data["times"]:
-                            if isinstance(time_entry["arrival_time"], str):
-                                time_entry["arrival_time"] = datetime.strptime(
-                                    time_entry["arrival_time"], "%Y-%m-%d %H:%M:%S"
-                                )
-                            if isinstance(time_entry["departure_time"], str):
-                                time_entry["departure_time"] = datetime.strptime(
-                                    time_entry["departure_time"], "%Y-%m-%d %H:%M:%S"
-                                )
-
-                        next_time_info = None
-                        next_trip_id = None
-
-                        # Find the next valid departure time after the current time
-                        for time_info in edge_data["times"]:
-                            time_info_copy = copy.deepcopy(time_info)
-
-                            len_two_lanes = float(edge_data.get("len_two_lanes", 0))
-                            len_more_than_two_lanes = float(
-                                edge_data.get("len_more_than_two_lanes", 0)
-                            )
-
-                            if (
-                                time_info_copy.get("trip_id") == trip_id
-                                or len(visited) == 1
-                            ):
-                                # Calculate duration safely, including only non-zero values
-                                total_length = 0
-                                if len_two_lanes > 0:
-                                    total_length += len_two_lanes
-                                if len_more_than_two_lanes > 0:
-                                    total_length += len_more_than_two_lanes
-
-                                duration = (
-                                    total_length
-                                    / (get_config_value("rush_hour_speed") / 3.6)
-                                ) / 60  # Convert seconds to minutes
-
-                                duration += load_time
-                                time_info_copy["arrival_time"] = (
-                                    current_time + timedelta(minutes=duration)
-                                )
-                                next_time_info = time_info_copy
-                                next_trip_id = time_info_copy.get("trip_id")
-                                break
-
-                            if (
-                                time_info_copy["departure_time"].time()
-                                >= current_time.time()
-                            ):
-                                total_length = 0
-                                if len_two_lanes > 0:
-                                    total_length += len_two_lanes
-                                if len_more_than_two_lanes > 0:
-                                    total_length += len_more_than_two_lanes
-
-                                duration = (
-                                    total_length
-                                    / (get_config_value("rush_hour_speed") / 3.6)
-                                ) / 60  # Convert seconds to minutes
-
-                                time_info_copy["arrival_time"] = (
-                                    current_time + timedelta(minutes=duration)
-                                )
-                                next_time_info = time_info_copy
-                                next_trip_id = time_info_copy.get("trip_id")
-                                break
-
-                        # If a valid next time was found, and it's within the allowed time window
-                        if (
-                            next_time_info
-                            and next_time_info["arrival_time"].time() <= end_time.time()
-                        ):
-                            dfs(
-                                neighbor,
-                                next_time_info["arrival_time"],
-                                trip_id=next_trip_id,
-                            )
-            except Exception as err:
-                raise err
-
-        elif mode == "rush_hour_priority_lane":
-            bus_speed = get_config_value("bus_speed")
-
-            try:
-                for neighbor in graph[node]:
-                    if neighbor in visited:
-                        continue
-                    edge_data = graph.get_edge_data(node, neighbor)
-
-                    if "is_transfer" in edge_data.keys():
-                        # Handle transfer edges, only proceed if neighbor hasn't been visited in the current path
-                        if neighbor not in visited:
-                            dfs(
-                                neighbor,
-                                current_time
-                                + timedelta(minutes=int(edge_data["weight"])),
-                            )
-                    else:
-                        # Handle time-dependent edges
-                        for time_entry in edge_data["times"]:
-                            if isinstance(time_entry["arrival_time"], str):
-                                time_entry["arrival_time"] = datetime.strptime(
-                                    time_entry["arrival_time"], "%Y-%m-%d %H:%M:%S"
-                                )
-                            if isinstance(time_entry["departure_time"], str):
-                                time_entry["departure_time"] = datetime.strptime(
-                                    time_entry["departure_time"], "%Y-%m-%d %H:%M:%S"
-                                )
-
-                        next_time_info = None
-                        next_trip_id = None
-
-                        # Find the next valid departure time after the current time
-                        for time_info in edge_data["times"]:
-                            time_info_copy = copy.deepcopy(time_info)
-
-                            len_two_lanes = float(edge_data.get("len_two_lanes", 0))
-                            len_more_than_two_lanes = float(
-                                edge_data.get("len_more_than_two_lanes", 0)
-                            )
-
-                            if (
-                                time_info_copy.get("trip_id") == trip_id
-                                or len(visited) == 1
-                            ):
-                                # Avoid division by zero by checking if values are non-zero
-                                duration = 0
-                                if len_two_lanes > 0:
-                                    duration += len_two_lanes / (
-                                        get_config_value("rush_hour_speed") / 3.6
-                                    )
-                                if len_more_than_two_lanes > 0:
-                                    duration += len_more_than_two_lanes / (
-                                        bus_speed / 3.6
-                                    )
-                                duration /= 60
-
-                                duration += load_time
-
-                                time_info_copy["arrival_time"] = (
-                                    current_time + timedelta(minutes=duration)
-                                )
-                                next_time_info = time_info_copy
-                                next_trip_id = time_info_copy.get("trip_id")
-                                break
-
-                            if (
-                                time_info_copy["departure_time"].time()
-                                >= current_time.time()
-                            ):
-                                duration = 0
-                                if len_two_lanes > 0:
-                                    duration += len_two_lanes / (
-                                        get_config_value("rush_hour_speed") / 3.6
-                                    )
-                                if len_more_than_two_lanes > 0:
-                                    duration += len_more_than_two_lanes / (
-                                        bus_speed / 3.6
-                                    )
-                                duration /= 60
-
-                                time_info_copy["arrival_time"] = (
-                                    current_time + timedelta(minutes=duration)
-                                )
-                                next_time_info = time_info_copy
-                                next_trip_id = time_info_copy.get("trip_id")
-                                break
-
-                        # If a valid next time was found, and it's within the allowed time window
-                        if (
-                            next_time_info
-                            and next_time_info["arrival_time"].time() <= end_time.time()
-                        ):
-                            dfs(
-                                neighbor,
-                                next_time_info["arrival_time"],
-                                trip_id=next_trip_id,
-                            )
-
-            except Exception as err:
-                raise err
+    while queue:
+        current_time, _, node, trip_id = heapq.heappop(queue)
+        label = node if mode == "normal" else (node, trip_id)
+        if label in settled:
+            continue
+        settled.add(label)
+        reachable.setdefault(node, current_time)
 
-        else:
-            raise ValueError(
-                "Invalid mode. Please choose either 'normal', 'rush_hour' or 'rush_hour_priority_lane' mode."
+        for neighbor, edge_data in graph[node].items():
+            arrival = get_edge_arrival(
+                edge_data, current_time, trip_id, mode, end_seconds, config
             )
+            if arrival is None:
+                continue
+            arrival_time, next_trip_id = arrival
+            if mode == "normal":
+                if neighbor in settled:
+                    continue
+                next_trip_id = None
+            elif (neighbor, next_trip_id) in settled:
+                continue
+            pushed += 1
+            heapq.heappush(queue, (arrival_time, pushed, neighbor, next_trip_id))
+
+    if stats is not None:
+        stats["labels_pushed"] = pushed
+        stats["labels_settled"] = len(settled)
 
-    # Start the DFS with the visited and reachable sets as shared variables
-    dfs(start_node, start_time)
-    return reachable
+    return {
+        node: midnight + timedelta(seconds=seconds)
+        for node, seconds in reachable.items()
+    }
 
 
-def reachable_nodes_to_pois(bus_graph, nodes_dict, end_time):
-    """Get all reachable nodes from the bus network to the POIs within the remaining weight."""
-    all_nodes = set()
-    for node, current_time in nodes_dict.items():
-        if node not in bus_graph:
+def multi_source_walk_egress(walk_graph, remaining_times) -> set:
+    """
+    Get the nodes of a walk graph reachable from any source in its remaining time.
+
+    remaining_times maps every source node to its remaining minutes. Each
+    source starts with the negative of its remaining time and all of them are
+    expanded in one Dijkstra pass up to 0, so every node is settled once
+    instead of once per source.
+    """
+    settled = set()
+    queue = [
+        (-remaining_time, index, node)
+        for index, (node, remaining_time) in enumerate(remaining_times.items())
+    ]
+    heapq.heapify(queue)
+    pushed = len(queue)
+
+    while queue:
+        distance, _, node = heapq.heappop(queue)
+        if node in settled:
             continue
+        settled.add(node)
+        for neighbor, edge_data in walk_graph[node].items():
+            neighbor_distance = distance + edge_data.get("weight", 1)
+            if neighbor_distance <= 0 and neighbor not in settled:
+                pushed += 1
+                heapq.heappush(queue, (neighbor_distance, pushed, neighbor))
+    return settled
+
+
+def reachable_nodes_to_pois(walk_graph, nodes_dict, end_time):
+    """
+    Get all reachable nodes from the bus network to the POIs within the remaining weight.
+
+    walk_graph is either a WalkLegIndex or a networkx graph with weighted walk
+    edges, which is searched from all reached stops at once.
+    """
+    remaining_times = {
+        node: (end_time - current_time).total_seconds() / 60
+        for node, current_time in nodes_dict.items()
+    }
 
-        placeholder_date = datetime(2000, 1, 1)
-        end_time_placeholder = datetime.combine(placeholder_date, end_time.time())
-        current_time_placeholder = datetime.combine(
-            placeholder_date, current_time.time()
+    if not isinstance(walk_graph, WalkLegIndex):
+        return multi_source_walk_egress(
+            walk_graph,
+            {
+                node: remaining_time
+                for node, remaining_time in remaining_times.items()
+                if node in walk_graph
+            },
         )
 
-        remaining_time = (
-            end_time_placeholder - current_time_placeholder
-        ).total_seconds() / 60
-        paths = nx.single_source_dijkstra(
-            bus_graph, node, weight="weight", cutoff=remaining_time
-        )
-        all_nodes.update(paths[0].keys())
+    all_nodes = set(remaining_times)
+    bitset = reachable_poi_bitset(walk_graph, nodes_dict, end_time)
+    all_nodes.update(walk_graph.columns[bitset.indices()].tolist())
     return all_nodes
 
 
+def reachable_poi_bitset(walk_legs, nodes_dict, end_time) -> NodeBitset:
+    """
+    Get the isochrone nodes reachable from the reached bus stops as a bitset
+    over the columns of the walk legs.
+    """
+    # Threshold all reached stops against their rows of the egress matrix at once
+    stops = [node for node in nodes_dict if node in walk_legs]
+    columns = walk_legs.reachable_columns(
+        [walk_legs.stop_index[node] for node in stops],
+        np.array(
+            [(end_time - nodes_dict[node]).total_seconds() / 60 for node in stops],
+            dtype=np.float64,
+        ),
+    )
+    return NodeBitset.from_indices(columns, len(walk_legs.columns))
+
+
+def get_reachable_stops(
+    bus_stop_graph,
+    start_node,
+    start_time,
+    weight_threshold,
+    mode,
+    config=None,
+    cache=None,
+):
+    """
+    Get the earliest arrival at every bus stop reachable from an isochrone
+    node, or None if the walk to its bus stop exceeds the threshold.
+    """
+    bus_node, path_length = get_bus_station_from_isochrone(start_node)
+
+    if path_length > weight_threshold:
+        return None
+
+    current_time = start_time + timedelta(minutes=path_length)
+    remaining_time = weight_threshold - path_length
+
+    return reachable_nodes_via_bus_network(
+        bus_stop_graph,
+        bus_node,
+        remaining_time,
+        current_time,
+        start_time + timedelta(minutes=weight_threshold),
+        mode=mode,
+        config=config,
+        cache=cache,
+    )
+
+
 def get_multimodal_poi_directness(
     to_bus_stop_graph,
     bus_stop_graph,
@@ -334,22 +501,18 @@ def get_multimodal_poi_directness(
     start_time,
     weight_threshold,
     mode,
+    config=None,
 ):
     reachable_nodes = set()
 
-    bus_node, path_length = get_bus_station_from_isochrone(start_node)
-
     end_time = start_time + timedelta(minutes=weight_threshold)
 
-    if path_length > weight_threshold:
+    reachable_nodes_dict = get_reachable_stops(
+        bus_stop_graph, start_node, start_time, weight_threshold, mode, config
+    )
+    if reachable_nodes_dict is None:
         return set()
 
-    current_time = start_time + timedelta(minutes=path_length)
-    remaining_time = weight_threshold - path_length
-
-    reachable_nodes_dict = reachable_nodes_via_bus_network(
-        bus_stop_graph, bus_node, remaining_time, current_time, end_time, mode=mode
-    )
     reachable_nodes.update(reachable_nodes_dict.keys())
     all_reachable_nodes = reachable_nodes_to_pois(
         from_bus_stop_graph, reachable_nodes_dict, end_time
@@ -360,6 +523,177 @@ def get_multimodal_poi_directness(
     return reachable_nodes
 
 
+def get_multimodal_poi_directness_bitset(
+    walk_legs,
+    bus_stop_graph,
+    start_node,
+    start_time,
+    weight_threshold,
+    mode,
+    config=None,
+    cache=None,
+) -> NodeBitset:
+    """
+    Get the isochrone nodes reachable from a start node as a bitset over the
+    columns of the walk legs.
+
+    Holds the isochrone nodes of get_multimodal_poi_directness, without the
+    bus stops, which have no isochrone polygon of their own. A
+    ReachabilityCache in cache is shared by the bus searches of all calls.
+    """
+    reachable_nodes_dict = get_reachable_stops(
+        bus_stop_graph, start_node, start_time, weight_threshold, mode, config, cache
+    )
+    if reachable_nodes_dict is None:
+        return NodeBitset.empty(len(walk_legs.columns))
+    return reachable_poi_bitset(
+        walk_legs,
+        reachable_nodes_dict,
+        start_time + timedelta(minutes=weight_threshold),
+    )
+
+
+def get_bus_connections(bus_network):
+    """Get the connections of a bus network prepared by get_bus_network."""
+    if isinstance(bus_network, (RaptorTimetable, CsaTimetable)):
+        return bus_network.connections
+    return graph_connections(bus_network)
+
+
+def get_multimodal_poi_directness_batch(
+    walk_legs,
+    connections,
+    start_nodes,
+    start_time,
+    weight_threshold,
+    batch_size=256,
+) -> list:
+    """
+    Get the isochrone nodes reachable from many start nodes in normal mode.
+
+    Returns one bitset per start node, equal to
+    get_multimodal_poi_directness_bitset. The start nodes are routed in
+    batches of batch_size origins with one scan of the connections per batch,
+    see batch_earliest_arrivals, and connections comes from
+    get_bus_connections.
+    """
+    midnight = datetime.combine(start_time.date(), time())
+    end_time = start_time + timedelta(minutes=weight_threshold)
+    start_seconds = (start_time - midnight).total_seconds()
+    end_seconds = get_time_window(start_time, end_time)[1]
+    egress_seconds = (end_time - midnight).total_seconds()
+
+    bitsets = []
+    for batch_start in range(0, len(start_nodes), batch_size):
+        batch = [
+            get_bus_station_from_isochrone(start_node)
+            for start_node in start_nodes[batch_start : batch_start + batch_size]
+        ]
+        origins = [
+            origin
+            for origin, (_, path_length) in enumerate(batch)
+            if path_length <= weight_threshold
+        ]
+        routed = np.array(
+            [
+                origin
+                for origin in origins
+                if batch[origin][0] in connections.stop_index
+            ],
+            dtype=np.int64,
+        )
+
+        # The stop, arrival and origins of every first arrival at a stop
+        first_arrivals = [
+            (
+                connections.stops[stop],
+                arrival,
+                routed[origin_indices(bits, len(routed))],
+            )
+            for stop, arrival, bits in batch_earliest_arrivals(
+                connections,
+                [connections.stop_index[batch[origin][0]] for origin in routed],
+                [start_seconds + batch[origin][1] * 60 for origin in routed],
+                end_seconds,
+            )
+        ]
+        # Start nodes at stops without bus service only reach their own stop
+        first_arrivals.extend(
+            (batch[origin][0], start_seconds + batch[origin][1] * 60, [origin])
+            for origin in origins
+            if batch[origin][0] not in connections.stop_index
+        )
+
+        origin_columns = [[] for _ in batch]
+        for stop, arrival, stop_origins in first_arrivals:
+            if stop not in walk_legs:
+                continue
+            columns = walk_legs.reachable_columns(
+                [walk_legs.stop_index[stop]], [(egress_seconds - arrival) / 60]
+            )
+            for origin in stop_origins:
+                origin_columns[origin].append(columns)
+
+        bitsets.extend(
+            NodeBitset.from_indices(
+                np.concatenate(columns) if columns else [], len(walk_legs.columns)
+            )
+            for columns in origin_columns
+        )
+    return bitsets
+
+
+def get_stop_profile(bus_timetable, bus_node, departure_times, weight_threshold):
+    """Get the arrival profile of a bus stop that covers all departure times."""
+    if not isinstance(bus_timetable, CsaTimetable):
+        raise ValueError("Profile queries require the Connection Scan engine.")
+    return csa_profile(
+        bus_timetable,
+        bus_node,
+        min(departure_times),
+        max(departure_times) + timedelta(minutes=weight_threshold),
+        max_duration=weight_threshold,
+    )
+
+
+def get_multimodal_poi_directness_profile(
+    bus_timetable,
+    from_bus_stop_graph,
+    start_node,
+    departure_times,
+    weight_threshold,
+    profile=None,
+):
+    """
+    Get the reachable nodes of a start node for every departure time.
+
+    The result for each departure time equals get_multimodal_poi_directness in
+    normal mode, but the bus network is scanned once for all departure times.
+    The profile of the bus stop of the start node can be passed in to share it
+    between the isochrones of the same stop.
+    """
+    bus_node, path_length = get_bus_station_from_isochrone(start_node)
+
+    if path_length > weight_threshold:
+        return {departure_time: set() for departure_time in departure_times}
+
+    if profile is None:
+        profile = get_stop_profile(
+            bus_timetable, bus_node, departure_times, weight_threshold
+        )
+
+    reachable_nodes = {}
+    for departure_time in departure_times:
+        end_time = departure_time + timedelta(minutes=weight_threshold)
+        reachable_nodes_dict = profile_reachable_nodes(
+            profile, departure_time + timedelta(minutes=path_length), end_time
+        )
+        reachable_nodes[departure_time] = set(
+            reachable_nodes_dict
+        ) | reachable_nodes_to_pois(from_bus_stop_graph, reachable_nodes_dict, end_time)
+    return reachable_nodes
+
+
 def get_nodes_of_intersected_isochrones(isochrones_gdf, hexagon_gdf, matching_column):
     """Get the nodes of the intersected isochrones"""
     intersections = gpd.sjoin(
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+
+def get_row_blocks(geometries, row_stops, block_size=16):
+    """
+    Group the rows of the isochrones into blocks of block_size neighbouring
+    stops and get the block of every row.
+
+    The stops are ordered along a Hilbert curve through the centroids of their
+    isochrones, so stops that are close, and so mostly reached together, share
+    a block.
+    """
+    # Without a CRS, as only the order of the centroids matters
+    distances = gpd.GeoSeries(np.asarray(geometries)).centroid.hilbert_distance()
+    stop_distances = pd.Series(np.asarray(distances)).groupby(row_stops).min()
+    stop_blocks = np.empty(len(stop_distances), dtype=np.int64)
+    stop_blocks[np.argsort(stop_distances.to_numpy(), kind="stable")] = (
+        np.arange(len(stop_distances)) // block_size
+    )
+    return stop_blocks[np.searchsorted(stop_distances.index.to_numpy(), row_stops)]
+
+
+def get_outermost_rows(rows, row_stops, row_values):
+    """
+    Get the rows of the outermost reached band of every stop and the number of
+    other rows that were dropped.
+
+    The bands of the walk isochrones of a stop are nested, so the union of the
+    reached bands of a stop is its largest reached band, which is the stop's
+    outermost band when all of its bands are reached, and the other bands only
+    add vertices to the union.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    # Rows by stop and then by band, largest first
+    rows = rows[np.lexsort((-np.asarray(row_values)[rows], row_stops[rows]))]
+    outermost = np.ones(len(rows), dtype=bool)
+    outermost[1:] = row_stops[rows[1:]] != row_stops[rows[:-1]]
+    return np.sort(rows[outermost]), int(len(rows) - outermost.sum())
+
+
+def split_rows(rows, row_labels):
+    """Split sorted rows into arrays of the rows that share a label."""
+    labels = row_labels[rows]
+    order = np.argsort(labels, kind="stable")
+    return np.split(rows[order], np.flatnonzero(np.diff(labels[order])) + 1)
+
+
+class PolygonUnionCache:
+    """
+    Union of the isochrones of many rows, assembled from cached partial unions.
+
+    The rows are grouped by stop and the stops by block, see get_row_blocks.
+    The union of the reached rows of a stop and the union of the reached rows
+    of a block are cached, keyed by their rows, so neighbouring start nodes,
+    which reach mostly the same isochrones, reuse the unions of all blocks
+    they reach in the same way and only union the few partial unions. The
+    cache is a bounded LRU of at most max_bytes of coordinates.
+
+    With the band of every row in row_values, only the outermost reached band
+    of every stop is unioned, see get_outermost_rows, and pruned counts the
+    dropped rows.
+    """
+
+    def __init__(
+        self,
+        get_geometries,
+        row_stops,
+        row_blocks,
+        max_bytes=256 * 2**20,
+        row_values=None,
+    ):
+        self.get_geometries = get_geometries
+        self.row_stops = np.asarray(row_stops)
+        self.row_blocks = np.asarray(row_blocks)
+        self.row_values = row_values
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.pruned = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def union(self, rows):
+        """Get the union of the geometries of rows, an array of row indices."""
+        rows = np.sort(np.asarray(rows, dtype=np.int64))
+        if self.row_values is not None:
+            rows, pruned = get_outermost_rows(rows, self.row_stops, self.row_values)
+            self.pruned += pruned
+        return shapely.union_all(
+            [
+                self.block_union(block_rows)
+                for block_rows in split_rows(rows, self.row_blocks)
+            ]
+        )
+
+    def block_union(self, rows):
+        return self.cached_union(
+            ("block", rows.tobytes()),
+            lambda: shapely.union_all(
+                [
+                    self.stop_union(stop_rows)
+                    for stop_rows in split_rows(rows, self.row_stops)
+                ]
+            ),
+        )
+
+    def stop_union(self, rows):
+        return self.cached_union(
+            ("stop", rows.tobytes()),
+            lambda: shapely.union_all(self.get_geometries(rows)),
+        )
+
+    def cached_union(self, key, compute):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.misses += 1
+        union = compute()
+        self.entries[key] = union
+        self.size += geometry_size(union)
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= geometry_size(evicted)
+        return union
+
+
+def geometry_size(geometry):
+    """Estimate the memory of a geometry from its number of coordinates."""
+    return 16 * int(shapely.get_num_coordinates(geometry)) + 64
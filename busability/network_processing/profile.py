@@ -0,0 +1,204 @@
+import heapq
+import math
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time, timedelta
+
+import numpy as np
+
+from busability.network_preprocessing.network_creator import get_time_window
+
+
+class ArrivalProfile:
+    """
+    Earliest arrivals at every stop for all departures from one start stop.
+
+    For every stop reached by bus, pairs holds the Pareto set of departure
+    times at the start stop and arrival times at the stop, both ascending: a
+    later departure only stays in the set if it arrives later. offsets holds
+    the stops reachable by walking over transfers from the start stop and the
+    walking time in seconds. Times are seconds since midnight of the start
+    date.
+    """
+
+    def __init__(self, start_node, midnight, start_seconds, offsets, pairs):
+        self.start_node = start_node
+        self.midnight = midnight
+        self.start_seconds = start_seconds
+        self.offsets = offsets
+        self.pairs = pairs
+
+        # All pairs in one array sorted by stop and departure, so the pair of
+        # every stop for a departure is found with a single binary search
+        self.stops = list(pairs)
+        counts = [len(departures) for departures, _ in pairs.values()]
+        self.bounds = np.cumsum(counts, dtype=np.int64)
+        ranks = np.repeat(np.arange(len(counts), dtype=np.int64), counts)
+        self.keys = (ranks << 32) + np.array(
+            [value for departures, _ in pairs.values() for value in departures],
+            dtype=np.int64,
+        )
+        self.arrivals = np.array(
+            [value for _, arrivals in pairs.values() for value in arrivals],
+            dtype=np.int64,
+        )
+
+    def earliest_arrivals(self, departure_seconds, end_seconds) -> dict:
+        """
+        Get the earliest arrival at every stop reachable by end_seconds when
+        departing at departure_seconds.
+        """
+        if departure_seconds < self.start_seconds:
+            raise ValueError("The departure lies before the start of the profile.")
+
+        departure = math.ceil(departure_seconds)
+        arrivals = {
+            stop: departure + offset
+            for stop, offset in self.offsets.items()
+            if departure + offset <= end_seconds
+        }
+
+        ranks = np.arange(len(self.stops), dtype=np.int64)
+        indices = np.searchsorted(self.keys, (ranks << 32) + departure)
+        found = np.flatnonzero(indices < self.bounds)
+        stop_arrivals = self.arrivals[indices[found]]
+        reached = stop_arrivals <= end_seconds
+        for rank, arrival in zip(
+            found[reached].tolist(), stop_arrivals[reached].tolist()
+        ):
+            stop = self.stops[rank]
+            if arrival < arrivals.get(stop, math.inf):
+                arrivals[stop] = arrival
+        return arrivals
+
+
+def insert_pair(pairs, stop, departure, arrival) -> bool:
+    """Insert a pair into the Pareto set of a stop unless it is dominated."""
+    departures, arrivals = pairs.setdefault(stop, ([], []))
+    index = bisect_right(arrivals, arrival)
+    if index > 0 and departures[index - 1] >= departure:
+        return False
+    start = bisect_left(arrivals, arrival)
+    end = bisect_right(departures, departure, lo=start)
+    departures[start:end] = [departure]
+    arrivals[start:end] = [arrival]
+    return True
+
+
+def csa_profile(
+    timetable, start_node, start_time, end_time, max_duration=None
+) -> ArrivalProfile:
+    """
+    Compute the arrival profile of a start stop with one Connection Scan.
+
+    Covers all departures from start_time on that arrive by end_time and, if
+    max_duration is given in minutes, take at most max_duration. The
+    connections are scanned once in order of departure. For every trip the
+    latest departure from the start stop that reaches it is kept, and every
+    arrival of the trip is inserted with that departure into the Pareto set of
+    its stop. The reachable stops for any departure minute in the range are
+    then found with profile_reachable_nodes without another scan.
+    """
+    midnight = datetime.combine(start_time.date(), time())
+    start_seconds = (start_time - midnight).total_seconds()
+    end_seconds = get_time_window(start_time, end_time)[1]
+    max_seconds = math.inf if max_duration is None else max_duration * 60
+    connections = timetable.connections
+    if start_node not in timetable:
+        return ArrivalProfile(start_node, midnight, start_seconds, {}, {})
+
+    # Walking times over transfers from the start stop
+    start = connections.stop_index[start_node]
+    offsets = {start: 0}
+    queue = [(0, start)]
+    while queue:
+        offset, stop = heapq.heappop(queue)
+        if offset > offsets[stop]:
+            continue
+        targets, seconds = connections.transfers(stop)
+        for target, target_offset in zip(targets.tolist(), (offset + seconds).tolist()):
+            if target_offset < offsets.get(target, math.inf):
+                offsets[target] = target_offset
+                heapq.heappush(queue, (target_offset, target))
+
+    pairs = {}
+    trip_departures = {}
+    earliest = math.ceil(start_seconds)
+    from_stops = timetable.from_stops
+    to_stops = timetable.to_stops
+    departures = timetable.departures
+    arrivals = timetable.arrivals
+    trips = timetable.trips
+    has_transfers = timetable.has_transfers
+
+    first = int(np.searchsorted(connections.connections["departure"], earliest))
+    for index in range(first, len(departures)):
+        departure = departures[index]
+        if departure > end_seconds:
+            break
+
+        # Latest departure from the start stop that reaches this connection
+        from_stop = from_stops[index]
+        latest = trip_departures.get(trips[index], -1)
+        offset = offsets.get(from_stop)
+        if offset is not None and latest < departure - offset >= earliest:
+            latest = departure - offset
+        from_pairs = pairs.get(from_stop)
+        if from_pairs is not None:
+            position = bisect_right(from_pairs[1], departure)
+            if position > 0 and from_pairs[0][position - 1] > latest:
+                latest = from_pairs[0][position - 1]
+        if latest < 0:
+            continue
+        trip_departures[trips[index]] = latest
+
+        arrival = arrivals[index]
+        latest_arrival = min(end_seconds, latest + max_seconds)
+        if arrival > latest_arrival:
+            continue
+        pending = [(to_stops[index], arrival)]
+        while pending:
+            stop, stop_arrival = pending.pop()
+            if not insert_pair(pairs, stop, latest, stop_arrival):
+                continue
+            if not has_transfers[stop]:
+                continue
+            targets, seconds = connections.transfers(stop)
+            pending.extend(
+                (target, target_arrival)
+                for target, target_arrival in zip(
+                    targets.tolist(), (stop_arrival + seconds).tolist()
+                )
+                if target_arrival <= latest_arrival
+            )
+
+    return ArrivalProfile(
+        start_node,
+        midnight,
+        start_seconds,
+        {connections.stops[stop]: offset for stop, offset in offsets.items()},
+        {connections.stops[stop]: pair for stop, pair in pairs.items()},
+    )
+
+
+def profile_reachable_nodes(profile, departure_time, end_time):
+    """
+    Get the earliest arrival time at every stop reachable by end_time when
+    departing at departure_time.
+
+    Returns the same dict of stops and datetimes as csa_reachable_nodes. The
+    profile must cover the departure and end time.
+    """
+    departure_seconds = (departure_time - profile.midnight).total_seconds()
+    end_seconds = get_time_window(departure_time, end_time)[1]
+    if departure_seconds > end_seconds:
+        return {}
+    if not profile.offsets:
+        return {profile.start_node: departure_time}
+
+    arrivals = profile.earliest_arrivals(departure_seconds, end_seconds)
+    # Fractional start seconds are kept for the start stop, like the Dijkstra search
+    arrivals[profile.start_node] = departure_seconds
+    return {
+        stop: profile.midnight + timedelta(seconds=arrival)
+        for stop, arrival in arrivals.items()
+    }
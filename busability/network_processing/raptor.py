@@ -0,0 +1,107 @@
+import math
+from datetime import datetime, time, timedelta
+
+import numpy as np
+
+from busability.network_preprocessing.network_creator import get_time_window
+from busability.network_processing.connections import graph_connections
+
+UNREACHED = np.iinfo(np.int64).max
+
+
+class RaptorTimetable:
+    """
+    The trips and transfers of a bus graph for RAPTOR queries.
+
+    The connections of every trip are stored consecutively in the order in
+    which the trip runs, so a round of the search scans all trips with a few
+    array operations. max_transfers limits the number of changes between
+    trips, None means no limit. Walking over transfers from transfers.txt does
+    not count as a change.
+    """
+
+    def __init__(self, connections, max_transfers=None):
+        self.connections = connections
+        self.max_transfers = max_transfers
+
+        trips = np.sort(connections.connections, order=["trip", "departure"])
+        self.from_stops = trips["from_stop"].astype(np.int64)
+        self.to_stops = trips["to_stop"].astype(np.int64)
+        self.departures = trips["departure"].astype(np.int64)
+        self.arrivals = trips["arrival"].astype(np.int64)
+        # Index of the first connection of the trip of every connection
+        new_trip = np.ones(len(trips), dtype=bool)
+        new_trip[1:] = trips["trip"][1:] != trips["trip"][:-1]
+        self.trip_starts = np.flatnonzero(new_trip)[np.cumsum(new_trip) - 1]
+
+    def __contains__(self, stop):
+        return stop in self.connections.stop_index
+
+    def scan_trips(self, labels):
+        """
+        Get the arrival of every connection that can be reached by boarding
+        its trip at this or an earlier stop with the given earliest times.
+
+        Connections that cannot be reached get UNREACHED.
+        """
+        boardable = labels[self.from_stops] <= self.departures
+        boarded = np.cumsum(boardable)
+        # Number of boardable stops of the trip up to and including this one
+        boarded -= (boarded - boardable)[self.trip_starts]
+        return np.where(boarded > 0, self.arrivals, UNREACHED)
+
+
+def create_raptor_timetable(graph, max_transfers=None) -> RaptorTimetable:
+    """Create the RAPTOR timetable of a bus graph."""
+    return RaptorTimetable(graph_connections(graph), max_transfers=max_transfers)
+
+
+def raptor_reachable_nodes(timetable, start_node, start_time, end_time):
+    """
+    Get the earliest arrival time at every stop reachable by end_time.
+
+    Round k of the RAPTOR search finds the stops reachable with k trips from
+    the arrivals of round k - 1, followed by the transfers from the improved
+    stops. Every trip is its own route here: a round scans all trips at once
+    with array operations, which is faster in NumPy than looking up the
+    earliest trip of every route that serves an improved stop.
+
+    Returns the same dict of stops and datetimes as
+    time_dependent_reachable_nodes_via_bus_network in normal mode.
+    """
+    midnight = datetime.combine(start_time.date(), time())
+    start_seconds = (start_time - midnight).total_seconds()
+    end_seconds = get_time_window(start_time, end_time)[1]
+    if start_seconds > end_seconds:
+        return {}
+    if start_node not in timetable:
+        return {start_node: start_time}
+
+    connections = timetable.connections
+    start = connections.stop_index[start_node]
+    labels = np.full(len(connections.stops), UNREACHED, dtype=np.int64)
+    labels[start] = math.ceil(start_seconds)
+    connections.relax_transfers(labels, [start], end_seconds)
+
+    rounds = 0
+    improved = True
+    while improved and (
+        timetable.max_transfers is None or rounds <= timetable.max_transfers
+    ):
+        rounds += 1
+        arrivals = timetable.scan_trips(labels)
+        reached = arrivals <= end_seconds
+        round_labels = labels.copy()
+        np.minimum.at(round_labels, timetable.to_stops[reached], arrivals[reached])
+
+        improved_stops = np.flatnonzero(round_labels < labels).tolist()
+        connections.relax_transfers(round_labels, improved_stops, end_seconds)
+        improved = bool(improved_stops)
+        labels = round_labels
+
+    # Fractional start seconds are kept for the start stop, like the Dijkstra search
+    return {
+        connections.stops[stop]: midnight
+        + timedelta(seconds=start_seconds if stop == start else int(labels[stop]))
+        for stop in np.flatnonzero(labels <= end_seconds).tolist()
+    }
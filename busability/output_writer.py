@@ -0,0 +1,70 @@
+import os
+
+import pandas as pd
+import geopandas as gpd
+
+# Vector formats of the outputs by file suffix. GeoPackage is binary and fast
+# to append to and read back, GeoJSON is kept for compatibility. FlatGeobuf is
+# left out as it orders the features by its spatial index, not by start node
+OUTPUT_DRIVERS = {"gpkg": "GPKG", "geojson": "GeoJSON"}
+
+
+def get_output_file(path, output_format):
+    """Get the file of an output written in output_format, e.g. gpkg."""
+    if output_format not in OUTPUT_DRIVERS:
+        raise ValueError(
+            f"Unknown output format {output_format}, use one of {list(OUTPUT_DRIVERS)}"
+        )
+    return f"{path}.{output_format}"
+
+
+class GeoDataFrameWriter:
+    """
+    Append GeoDataFrames to a vector file as they arrive.
+
+    The frames are buffered until batch_rows rows are collected and every
+    batch is appended in one write, which is one transaction for GeoPackage,
+    so only one batch is held in memory and the output grows during the run
+    instead of being concatenated and written at the end. The file is only
+    created with the first batch. Use as a context manager to write the last
+    batch.
+    """
+
+    def __init__(self, path, batch_rows=10_000):
+        self.path = path
+        self.driver = OUTPUT_DRIVERS[os.path.splitext(path)[1][1:]]
+        self.batch_rows = batch_rows
+        self.buffer = []
+        self.buffered_rows = 0
+        self.rows_written = 0
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def write(self, gdf):
+        if gdf is None or not len(gdf):
+            return
+        self.buffer.append(gdf)
+        self.buffered_rows += len(gdf)
+        if self.buffered_rows >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        batch = gpd.GeoDataFrame(pd.concat(self.buffer, ignore_index=True))
+        batch.to_file(
+            self.path,
+            driver=self.driver,
+            mode="a" if self.rows_written else "w",
+            # Keep polygons as they are instead of making the layer all multipolygons
+            promote_to_multi=False,
+        )
+        self.rows_written += len(batch)
+        self.buffer = []
+        self.buffered_rows = 0
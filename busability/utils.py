@@ -1,4 +1,5 @@
 import os
+from dataclasses import dataclass, fields
 
 import yaml
 
@@ -38,3 +39,26 @@ def load_config_from_file(path: str) -> dict:
 def get_config_value(key: str, path: str = "../config/config.yml") -> str | int | dict:
     config = load_config_from_file(path)
     return config[key]
+
+
+@dataclass(frozen=True)
+class AnalysisConfig:
+    """Settings of the reachability analysis, read once instead of per lookup."""
+
+    mode: str = "normal"
+    rush_hour_speed: float = 14
+    bus_speed: float = 60
+
+    @classmethod
+    def from_file(cls, path: str = "../config/config.yml") -> "AnalysisConfig":
+        """Load the settings from a config file, missing keys keep their default."""
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Config file {path} does not exist")
+        config = load_config_from_file(path)
+        return cls(
+            **{
+                field.name: config[field.name]
+                for field in fields(cls)
+                if field.name in config
+            }
+        )
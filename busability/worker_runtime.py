@@ -0,0 +1,78 @@
+import math
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import shapely
+
+
+class SharedArrays:
+    """
+    NumPy arrays published once by the main process for pool workers.
+
+    The arrays are written to a temporary directory and every worker attaches
+    to them as read-only memory maps, so all workers share the pages of one
+    copy with any start method and memory stays flat as the number of workers
+    grows. Only the directory is pickled to the workers. Use as a context
+    manager to remove the files when the pool is done.
+    """
+
+    def __init__(self, arrays, directory=None):
+        self.directory = tempfile.mkdtemp(prefix="busability-", dir=directory)
+        self.names = list(arrays)
+        for name, array in arrays.items():
+            np.save(
+                os.path.join(self.directory, f"{name}.npy"),
+                np.asarray(array),
+                allow_pickle=False,
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def attach(self) -> dict:
+        """Get all arrays as read-only memory maps."""
+        return {
+            name: np.load(
+                os.path.join(self.directory, f"{name}.npy"),
+                mmap_mode="r",
+                allow_pickle=False,
+            )
+            for name in self.names
+        }
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def geometry_arrays(geometries, prefix="geometry"):
+    """
+    Get geometries as flat arrays: their WKB concatenated in one byte array and
+    the offset of every geometry in it.
+    """
+    wkb = shapely.to_wkb(np.asarray(geometries))
+    offsets = np.zeros(len(wkb) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in wkb], out=offsets[1:])
+    return {
+        f"{prefix}_wkb": np.frombuffer(b"".join(wkb), dtype=np.uint8),
+        f"{prefix}_offsets": offsets,
+    }
+
+
+def geometries_from_arrays(wkb, offsets, rows):
+    """Get the geometries of the given rows from the arrays of geometry_arrays."""
+    return shapely.from_wkb(
+        [wkb[offsets[row] : offsets[row + 1]].tobytes() for row in rows]
+    )
+
+
+def worker_chunksize(task_count, processes, chunks_per_worker=4):
+    """
+    Get the chunk size for Pool.imap that gives every worker a few chunks, so
+    tasks are sent in few messages but the load is still balanced at the end.
+    """
+    return max(1, math.ceil(task_count / (max(processes, 1) * chunks_per_worker)))
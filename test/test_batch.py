@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+import geopandas as gpd
+import numpy as np
+from shapely import Point
+
+from busability.network_preprocessing.network_creator import create_network_from_gtfs
+from busability.network_preprocessing.walk_legs import create_walk_leg_index
+from busability.network_processing.batch import (
+    batch_earliest_arrivals,
+    origin_indices,
+)
+from busability.network_processing.connections import graph_connections
+from busability.network_processing.network_analyzer import (
+    get_bus_connections,
+    get_bus_network,
+    get_multimodal_poi_directness_batch,
+    get_multimodal_poi_directness_bitset,
+)
+
+
+def test_batch_matches_single_start_nodes(start_time):
+    graph = create_network_from_gtfs("london", base_path="")
+    stops = sorted(graph.nodes) + ["unserved"]
+    isochrones = gpd.GeoDataFrame(
+        {
+            "stop_id": [stop for stop in stops for _ in range(4)],
+            "value": [60, 300, 600, 2400] * len(stops),
+        },
+        geometry=[Point(0, 0)] * (4 * len(stops)),
+    )
+    walk_legs = create_walk_leg_index(isochrones, "stop_id")
+    start_nodes = [node for node in walk_legs.nodes if not node.startswith("unserved")]
+
+    for offset, minutes in [(0, 10), (0, 30), (15, 45)]:
+        query_start = start_time + timedelta(minutes=offset, seconds=0.5)
+        expected = [
+            get_multimodal_poi_directness_bitset(
+                walk_legs, graph, start_node, query_start, minutes, "normal"
+            )
+            for start_node in start_nodes
+        ]
+        for bus_network in [graph, get_bus_network(graph, engine="csa")]:
+            assert (
+                get_multimodal_poi_directness_batch(
+                    walk_legs,
+                    get_bus_connections(bus_network),
+                    start_nodes,
+                    query_start,
+                    minutes,
+                    batch_size=7,
+                )
+                == expected
+            )
+
+    # A start node at a stop without bus service only reaches its own isochrones
+    (bitset,) = get_multimodal_poi_directness_batch(
+        walk_legs, graph_connections(graph), ["unserved_1.0"], start_time, 6
+    )
+    assert walk_legs.columns[bitset.indices()].tolist() == [
+        "unserved_1.0",
+        "unserved_5.0",
+    ]
+
+
+def test_batch_earliest_arrivals_settles_in_time_order(start_time):
+    graph = create_network_from_gtfs("london", base_path="")
+    connections = graph_connections(graph)
+    start = connections.stop_index["4"]
+
+    first_arrivals = batch_earliest_arrivals(
+        connections, [start, start], [28800, 36000], 30600
+    )
+
+    arrival_times = [arrival for _, arrival, _ in first_arrivals]
+    assert arrival_times == sorted(arrival_times)
+    assert first_arrivals[0] == (start, 28800, 0b01)
+    assert all(origins == 0b01 for _, _, origins in first_arrivals)
+    assert origin_indices(0b101, 3).tolist() == [0, 2]
+    assert np.array_equal(origin_indices(1 << 70, 71), [70])
@@ -0,0 +1,48 @@
+import numpy as np
+
+from busability.network_processing.bitset import (
+    NodeBitset,
+    load_bitsets,
+    save_bitsets,
+)
+
+
+def test_node_bitset_operations():
+    first = NodeBitset.from_indices([0, 5, 64, 129], 130)
+    second = NodeBitset.from_indices([5, 63, 129], 130)
+
+    assert len(first) == 4
+    assert 64 in first and 63 not in first
+    assert (first | second).indices().tolist() == [0, 5, 63, 64, 129]
+    assert (first & second).indices().tolist() == [5, 129]
+    assert len(NodeBitset.empty(130)) == 0
+    assert first.mask().shape == (130,)
+
+
+def test_node_bitset_row_mask():
+    bitset = NodeBitset.from_indices([1, 3], 4)
+
+    row_mask = bitset.row_mask([3, -1, 0, 1, 1])
+
+    assert row_mask.tolist() == [True, False, False, True, True]
+
+
+def test_save_bitsets(tmp_path):
+    bitsets = [NodeBitset.from_indices(indices, 100) for indices in [[], [1, 99], [64]]]
+    path = str(tmp_path / "reachable_nodes.npy")
+
+    save_bitsets(path, bitsets, 100)
+    loaded = load_bitsets(path, 100)
+
+    assert loaded == bitsets
+    assert isinstance(loaded[0].words, np.memmap)
+    assert loaded[1].words.nbytes == 16
+
+
+def test_save_bitsets_from_iterator(tmp_path):
+    bitsets = [NodeBitset.from_indices(indices, 100) for indices in [[2], [70]]]
+    path = str(tmp_path / "reachable_nodes.npy")
+
+    save_bitsets(path, iter(bitsets), 100, count=2)
+
+    assert load_bitsets(path, 100) == bitsets
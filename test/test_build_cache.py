@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from busability.build_cache import (
+    build_cache_key,
+    clear_builds,
+    evict_builds,
+    get_cached_build,
+    list_builds,
+    store_build,
+)
+
+
+def write_file(path, content):
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def test_build_cache_key(tmp_path):
+    feed = tmp_path / "gtfs"
+    feed.mkdir()
+    write_file(feed / "stops.txt", "stop_id\n1\n")
+    config = {"date": "08:00:00", "minute_threshold": 30}
+
+    key = build_cache_key([str(feed)], config)
+
+    assert key == build_cache_key([str(feed)], dict(config))
+    assert key != build_cache_key([str(feed)], {**config, "minute_threshold": 20})
+    write_file(feed / "stops.txt", "stop_id\n2\n")
+    assert key != build_cache_key([str(feed)], config)
+
+
+def test_store_and_get_cached_build(tmp_path):
+    cache_path = str(tmp_path / "cache")
+    assert get_cached_build(cache_path, "abc") is None
+
+    build_path = store_build(
+        cache_path,
+        "abc",
+        lambda directory: write_file(os.path.join(directory, "graph.txt"), "x"),
+        metadata={"city": "London"},
+    )
+
+    assert get_cached_build(cache_path, "abc") == build_path
+    assert os.path.isfile(os.path.join(build_path, "graph.txt"))
+    builds = list_builds(cache_path)
+    assert [build["key"] for build in builds] == ["abc"]
+    assert builds[0]["city"] == "London"
+
+
+def test_failed_build_is_not_stored(tmp_path):
+    cache_path = str(tmp_path / "cache")
+
+    def build(directory):
+        write_file(os.path.join(directory, "graph.txt"), "x")
+        raise RuntimeError("build failed")
+
+    with pytest.raises(RuntimeError, match="build failed"):
+        store_build(cache_path, "abc", build)
+
+    assert get_cached_build(cache_path, "abc") is None
+    assert os.listdir(cache_path) == []
+
+
+def test_evict_and_clear_builds(tmp_path):
+    cache_path = str(tmp_path / "cache")
+    for index, key in enumerate(["a", "b", "c"]):
+        build_path = store_build(cache_path, key, lambda directory: None)
+        os.utime(build_path, (index, index))
+    get_cached_build(cache_path, "a")
+
+    evict_builds(cache_path, max_entries=2)
+
+    assert [build["key"] for build in list_builds(cache_path)] == ["a", "c"]
+    clear_builds(cache_path)
+    assert list_builds(cache_path) == []
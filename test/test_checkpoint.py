@@ -0,0 +1,78 @@
+import os
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+from busability.checkpoint import (
+    get_pending_shards,
+    get_shard_attempts,
+    imap_shards,
+    is_shard_done,
+    record_shard_attempt,
+    shard_directory,
+    shard_ranges,
+    write_shard,
+)
+
+
+def test_shard_ranges():
+    assert shard_ranges(10, 4) == [(0, 4), (4, 8), (8, 10)]
+    assert shard_ranges(0, 4) == []
+
+
+def test_write_shard_commits_only_finished_shards(tmp_path):
+    def write(directory):
+        with open(os.path.join(directory, "results.txt"), "w") as f:
+            f.write("done")
+
+    def fail(directory):
+        write(directory)
+        raise KeyboardInterrupt
+
+    write_shard(tmp_path, 0, write)
+    with pytest.raises(KeyboardInterrupt):
+        write_shard(tmp_path, 1, fail)
+
+    assert is_shard_done(tmp_path, 0)
+    assert not is_shard_done(tmp_path, 1)
+    # The interrupted shard leaves no temporary files behind
+    assert os.listdir(tmp_path) == [os.path.basename(shard_directory(tmp_path, 0))]
+
+    shards = shard_ranges(5, 2)
+    assert get_pending_shards(tmp_path, shards) == [(1, (2, 4)), (2, (4, 5))]
+
+
+def test_imap_shards():
+    shard_tasks = [(1, [2, 3]), (4, [5]), (6, [])]
+
+    with ThreadPool(2) as pool:
+        results = [
+            (index, list(shard_results))
+            for index, shard_results in imap_shards(
+                pool, lambda task: task * 10, shard_tasks
+            )
+        ]
+        # Results a caller leaves unconsumed do not move into the next shard
+        first_results = [
+            (index, next(shard_results))
+            for index, shard_results in imap_shards(
+                pool, lambda task: task * 10, shard_tasks[:2]
+            )
+        ]
+
+    assert results == [(1, [20, 30]), (4, [50]), (6, [])]
+    assert first_results == [(1, 20), (4, 50)]
+
+
+def test_record_shard_attempt(tmp_path):
+    assert get_shard_attempts(tmp_path, 0) == 0
+    record_shard_attempt(tmp_path, 0)
+    record_shard_attempt(tmp_path, 0)
+
+    assert get_shard_attempts(tmp_path, 0) == 2
+    assert get_shard_attempts(tmp_path, 1) == 0
+    # The attempts do not mark a shard as done
+    assert get_pending_shards(tmp_path, shard_ranges(2, 1)) == [
+        (0, (0, 1)),
+        (1, (1, 2)),
+    ]
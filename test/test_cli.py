@@ -0,0 +1,36 @@
+import subprocess
+import sys
+import types
+
+import pytest
+
+from busability import cli
+
+
+def test_cli_imports_no_stage():
+    modules = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, busability.cli; print(' '.join(sys.modules))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+
+    for module in [*cli.STAGES.values(), "geopandas", "networkx"]:
+        assert module not in modules
+
+
+def test_cli_runs_stage_with_config(monkeypatch):
+    calls = []
+    stage = types.ModuleType("busability.get_poi_ratio")
+    stage.main = calls.append
+    monkeypatch.setitem(sys.modules, "busability.get_poi_ratio", stage)
+
+    cli.main(["poi-ratio", "--config", "london.yml"])
+    with pytest.raises(SystemExit):
+        cli.main(["poi-ratio"])
+
+    assert calls == ["london.yml"]
@@ -0,0 +1,66 @@
+from datetime import timedelta
+
+import networkx as nx
+import pytest
+
+from busability.network_preprocessing.network_creator import create_network_from_gtfs
+from busability.network_preprocessing.timetable import EdgeTimetable
+from busability.network_processing.csa import create_csa_timetable, csa_reachable_nodes
+from busability.network_processing.network_analyzer import (
+    get_bus_network,
+    reachable_nodes_via_bus_network,
+    time_dependent_reachable_nodes_via_bus_network,
+)
+
+
+def test_csa_matches_dijkstra(start_time):
+    graph = create_network_from_gtfs("london", base_path="")
+    timetable = create_csa_timetable(graph)
+
+    for start_node in graph.nodes:
+        for offset, minutes in [(0, 10), (0, 30), (5, 20), (15, 45)]:
+            query_start = start_time + timedelta(minutes=offset)
+            query_end = query_start + timedelta(minutes=minutes)
+            assert csa_reachable_nodes(
+                timetable, start_node, query_start, query_end
+            ) == time_dependent_reachable_nodes_via_bus_network(
+                start_node, graph, query_start, query_end
+            )
+
+
+def test_csa_stays_on_trip(start_time):
+    graph = nx.DiGraph()
+    # The trip waits at "B" longer than the arrival there
+    graph.add_edge("A", "B", timetable=EdgeTimetable([28800], [28900], ["x"]))
+    graph.add_edge("B", "C", timetable=EdgeTimetable([28900], [29000], ["x"]))
+    graph.add_edge("C", "D", weight=1, is_transfer=True)
+    connections = create_csa_timetable(graph)
+
+    result = csa_reachable_nodes(
+        connections, "A", start_time, start_time + timedelta(minutes=4)
+    )
+
+    assert result == {
+        "A": start_time,
+        "B": start_time + timedelta(seconds=100),
+        "C": start_time + timedelta(seconds=200),
+    }
+    assert "D" in csa_reachable_nodes(
+        connections, "A", start_time, start_time + timedelta(minutes=5)
+    )
+
+
+def test_csa_engine_only_supports_normal_mode(start_time):
+    graph = create_network_from_gtfs("london", base_path="")
+    bus_network = get_bus_network(graph, engine="csa")
+    end_time = start_time + timedelta(minutes=30)
+
+    assert reachable_nodes_via_bus_network(
+        bus_network, "4", 30, start_time, end_time, mode="normal"
+    ) == time_dependent_reachable_nodes_via_bus_network(
+        "4", graph, start_time, end_time
+    )
+    with pytest.raises(ValueError):
+        reachable_nodes_via_bus_network(
+            bus_network, "4", 30, start_time, end_time, mode="rush_hour"
+        )
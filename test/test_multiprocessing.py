@@ -1,137 +1,111 @@
-import pytest
-import time
+from datetime import timedelta
+
 import geopandas as gpd
-import pandas as pd
-from multiprocessing import Pool, cpu_count
-from datetime import datetime, timedelta
-from busability.network_processing.network_analyzer import (
-    get_config_value,
-    get_multimodal_poi_directness,
-)
+import numpy as np
+import pytest
+import yaml
+from shapely import Point
+
+import busability.get_reachable_nodes_isochrones as isochrones_script
 from busability.network_preprocessing.network_creator import (
-    get_union_reachable_polygons,
     create_network_from_gtfs,
+    save_graph_to_file,
+)
+from busability.network_preprocessing.walk_legs import (
+    create_walk_leg_index,
+    save_walk_leg_index,
 )
-from busability.get_reachable_nodes_isochrones import process_start_node
-
-
-# Load GeoDataFrames and set configurations
-@pytest.fixture(scope="module")
-def setup_data():
-    drive_iso_gdf = gpd.read_file(get_config_value("drive_iso_gdf_path"))
-    pois_gdf = gpd.read_file(get_config_value("pois_gdf_path"))
-    iso_polygons_gdf = gpd.read_file(get_config_value("iso_polygons_gdf_path"))
-    hexagons_centroids_gdf = gpd.read_file(
-        get_config_value("hexagon_centroid_gdf_path")
-    )
-
-    crs = get_config_value("crs")
-    drive_iso_gdf = drive_iso_gdf.to_crs(crs)
-    pois_gdf = pois_gdf.to_crs(crs)
-    iso_polygons_gdf = iso_polygons_gdf.to_crs(crs)
-    hexagons_centroids_gdf = hexagons_centroids_gdf.to_crs(crs)
 
-    start_time_string = get_config_value("date")
-    minute_threshold = get_config_value("minute_threshold")
-    start_time_object = datetime.combine(
-        datetime.today(), datetime.strptime(start_time_string, "%H:%M:%S").time()
-    )
 
-    start_time = datetime.combine(datetime.today(), time(8, 0))
-    end_time = start_time + timedelta(minutes=20)
+@pytest.fixture
+def config_path(tmp_path, start_time):
+    """Write the inputs and config of an analysis of the test GTFS feed."""
     bus_graph = create_network_from_gtfs(
         "london",
         base_path="",
         start_time=start_time,
-        end_time=end_time,
+        end_time=start_time + timedelta(minutes=30),
     )
-    walk_graph = bus_graph
-    target_nodes = [node for node in bus_graph.nodes]
-    start_nodes = [item for item in walk_graph.nodes if item not in target_nodes]
-
-    return {
-        "drive_iso_gdf": drive_iso_gdf,
-        "pois_gdf": pois_gdf,
-        "iso_polygons_gdf": iso_polygons_gdf,
-        "hexagons_centroids_gdf": hexagons_centroids_gdf,
-        "start_time_object": start_time_object,
-        "minute_threshold": minute_threshold,
-        "walk_graph": walk_graph,
-        "bus_graph": bus_graph,
-        "target_nodes": target_nodes,
-        "start_nodes": start_nodes,
-        "mode": get_config_value("mode"),
-        "matching_column": get_config_value("matching_column"),
-    }
-
-
-# Single-threaded test
-def test_single_threaded_execution(setup_data):
-    result_gdf_list = []
-
-    start_time = time.time()
-    for start_node in setup_data["start_nodes"]:
-        all_reachable_nodes = get_multimodal_poi_directness(
-            setup_data["walk_graph"],
-            setup_data["bus_graph"],
-            setup_data["walk_graph"],
-            start_node,
-            setup_data["target_nodes"],
-            start_time=setup_data["start_time_object"],
-            weight_threshold=setup_data["minute_threshold"],
-            mode=setup_data["mode"],
-        )
-
-        union_gdf = get_union_reachable_polygons(
-            setup_data["iso_polygons_gdf"],
-            matching_column=setup_data["matching_column"],
-            polygon_names=all_reachable_nodes,
-            crs=setup_data["drive_iso_gdf"].crs,
-            start_node=start_node,
-        )
-        result_gdf_list.append(union_gdf)
-
-    end_time = time.time()
-    print(f"Single-threaded execution time: {end_time - start_time:.2f} seconds")
-
-    assert len(result_gdf_list) > 0, (
-        "No results were generated in single-threaded execution"
+    stops = sorted(bus_graph.nodes)
+    isochrones = gpd.GeoDataFrame(
+        {
+            "stop_id": [stop for stop in stops for _ in range(3)],
+            "value": [300, 600, 900] * len(stops),
+        },
+        geometry=[
+            Point(position, position % 2).buffer(radius)
+            for position in range(len(stops))
+            for radius in [0.3, 0.6, 0.9]
+        ],
+        crs=4326,
     )
-    return result_gdf_list
-
-
-# Multiprocessing test
-def test_multiprocessing_execution(setup_data):
-    start_time = time.time()
-
-    with Pool(processes=cpu_count() - 1) as pool:
-        result_gdf_list = list(pool.imap(process_start_node, setup_data["start_nodes"]))
-
-    end_time = time.time()
-    print(f"Multiprocessing execution time: {end_time - start_time:.2f} seconds")
-
-    assert len(result_gdf_list) > 0, (
-        "No results were generated in multiprocessing execution"
+    isochrones.to_file(tmp_path / "isochrones.gpkg", driver="GPKG")
+    save_graph_to_file(bus_graph, str(tmp_path / "Test_bus_graph"))
+    save_walk_leg_index(
+        create_walk_leg_index(isochrones, "stop_id"), str(tmp_path / "Test_walk_legs")
     )
-    return result_gdf_list
 
-
-# Compare single-threaded and multiprocessing results
-def test_compare_results(setup_data):
-    # Get results from single-threaded execution
-    single_thread_result_gdf_list = test_single_threaded_execution(setup_data)
-
-    # Get results from multiprocessing execution
-    multiprocessing_result_gdf_list = test_multiprocessing_execution(setup_data)
-
-    single_thread_result_gdf = gpd.GeoDataFrame(
-        pd.concat(single_thread_result_gdf_list, ignore_index=True)
-    )
-    multiprocessing_result_gdf = gpd.GeoDataFrame(
-        pd.concat(multiprocessing_result_gdf_list, ignore_index=True)
-    )
-
-    # Check if the GeoDataFrames are identical
-    assert single_thread_result_gdf.equals(multiprocessing_result_gdf), (
-        "Results differ between single-threaded and multiprocessing executions"
+    config = {
+        "city_name": "Test",
+        "iso_polygons_gdf_path": str(tmp_path / "isochrones.gpkg"),
+        "crs": 4326,
+        "matching_column": "stop_id",
+        "output_path": f"{tmp_path}/",
+        "date": start_time.strftime("%H:%M:%S"),
+        "minute_threshold": 20,
+        "rush_hour_speed": 14,
+        "bus_speed": 60,
+        "mode": "normal",
+        "engine": "dijkstra",
+        "max_transfers": None,
+        "batch_size": None,
+        "checkpoint_path": str(tmp_path / "checkpoints"),
+        "shard_size": 4,
+        "output_format": "gpkg",
+        "union_block_size": 2,
+        "union_cache_mb": 1,
+    }
+    with open(tmp_path / "config.yml", "w") as f:
+        yaml.safe_dump(config, f)
+    return str(tmp_path / "config.yml")
+
+
+@pytest.mark.parametrize("batch_size", [None, 3])
+def test_multiprocessing_matches_single_process(config_path, batch_size, monkeypatch):
+    with open(config_path) as f:
+        config = yaml.safe_load(f)
+    config["batch_size"] = batch_size
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f)
+
+    # Single process: run the worker functions in the test process
+    settings = isochrones_script.load_settings(config_path)
+    shared_arrays, walk_legs = isochrones_script.publish_inputs(settings)
+    with shared_arrays:
+        isochrones_script.init_worker(config_path, shared_arrays)
+        if batch_size:
+            results = isochrones_script.process_batch(walk_legs.nodes)
+        else:
+            results = [
+                isochrones_script.process_start_node(start_node)
+                for start_node in walk_legs.nodes
+            ]
+
+    # Multiprocessing: run the stage with a pool of workers
+    monkeypatch.setattr(isochrones_script, "cpu_count", lambda: 3)
+    isochrones_script.main(config_path)
+
+    output = f"{config['output_path']}Test"
+    words = np.load(f"{output}_reachable_nodes.npy")
+    assert words.tolist() == [bitset.words.tolist() for _, _, bitset in results]
+
+    union_gdf = gpd.read_file(f"{output}_union_polygon.gpkg")
+    single_process_gdfs = [gdf for gdf, _, _ in results if gdf is not None]
+    assert len(single_process_gdfs) > 0
+    assert union_gdf["stop_id"].tolist() == [
+        gdf["stop_id"].iloc[0] for gdf in single_process_gdfs
+    ]
+    assert all(
+        geometry.equals(gdf.geometry.iloc[0])
+        for geometry, gdf in zip(union_gdf.geometry, single_process_gdfs)
     )
@@ -1,6 +1,10 @@
 from datetime import timedelta
 from unittest.mock import patch
 
+import geopandas as gpd
+import networkx as nx
+from shapely import Point
+
 from busability.network_processing.network_analyzer import (
     get_multimodal_poi_directness,
     shortest_paths_to_nodes,
@@ -8,8 +12,20 @@ from busability.network_processing.network_analyzer import (
     get_centroids,
     time_dependent_reachable_nodes_via_bus_network,
     get_bus_station_from_isochrone,
+    reachable_nodes_to_pois,
+    precompute_lane_durations,
+    get_lane_duration,
+    reachable_nodes_via_bus_network,
+    ReachabilityCache,
+    get_multimodal_poi_directness_bitset,
+)
+from busability.network_preprocessing.network_creator import (
+    create_network_from_gtfs,
+    slice_timetable_graph,
 )
-from busability.network_preprocessing.network_creator import create_network_from_gtfs
+from busability.network_preprocessing.timetable import EdgeTimetable
+from busability.utils import AnalysisConfig
+from busability.network_preprocessing.walk_legs import create_walk_leg_index
 
 
 def test_shortest_paths_to_nodes(walk_to_busstop_network):
@@ -47,6 +63,33 @@ def test_gtfs_network_analysis(walk_to_busstop_network, walk_from_bus_stop, star
     assert result == {"15", "16", "13", "7", "12", "4", "8", "6", "10"}
 
 
+@patch(
+    "busability.network_processing.network_analyzer.get_bus_station_from_isochrone",
+    return_value=("4", 1),
+)
+def test_gtfs_network_analysis_with_sliced_full_day_graph(
+    walk_to_busstop_network, walk_from_bus_stop, start_time
+):
+    weight_threshold = 10
+    bus_network = slice_timetable_graph(
+        create_network_from_gtfs("london", base_path=""),
+        start_time,
+        start_time + timedelta(minutes=weight_threshold),
+    )
+
+    result = get_multimodal_poi_directness(
+        walk_to_busstop_network,
+        bus_network,
+        walk_from_bus_stop,
+        "1",
+        ["4", "5"],
+        weight_threshold=weight_threshold,
+        start_time=start_time,
+        mode="normal",
+    )
+    assert result == {"15", "16", "13", "7", "12", "4", "8", "6", "10"}
+
+
 def test_get_nodes_of_intersected_isochrones(bus_isochrones_gdf, hexagons_gdf):
     matching_column = "NUEVO_CODIGO"
     result = get_nodes_of_intersected_isochrones(
@@ -72,7 +115,12 @@ def test_time_dependent_reachable_nodes_via_bus_network_rush_hour(start_time):
         end_time=start_time + timedelta(minutes=weight_threshold),
     )
     result = time_dependent_reachable_nodes_via_bus_network(
-        start_node, bus_network, start_time, end_time, mode="rush_hour"
+        start_node,
+        bus_network,
+        start_time,
+        end_time,
+        mode="rush_hour",
+        config=AnalysisConfig(),
     )
     assert result.keys() == {"4", "6", "9", "10", "8"}
     result_normal = time_dependent_reachable_nodes_via_bus_network(
@@ -94,10 +142,20 @@ def test_time_dependent_reachable_nodes_via_bus_network_rush_hour_priority_lane(
         end_time=start_time + timedelta(minutes=weight_threshold),
     )
     result = time_dependent_reachable_nodes_via_bus_network(
-        start_node, bus_network, start_time, end_time, mode="rush_hour_priority_lane"
+        start_node,
+        bus_network,
+        start_time,
+        end_time,
+        mode="rush_hour_priority_lane",
+        config=AnalysisConfig(),
     )
     result_rush_hour = time_dependent_reachable_nodes_via_bus_network(
-        start_node, bus_network, start_time, end_time, mode="rush_hour"
+        start_node,
+        bus_network,
+        start_time,
+        end_time,
+        mode="rush_hour",
+        config=AnalysisConfig(),
     )
     assert result.keys() == {"4", "6", "7", "9", "10", "8"}
     result_normal = time_dependent_reachable_nodes_via_bus_network(
@@ -107,7 +165,185 @@ def test_time_dependent_reachable_nodes_via_bus_network_rush_hour_priority_lane(
     assert result.keys() != result_rush_hour.keys()
 
 
+def test_time_dependent_reachable_nodes_via_bus_network_earliest_arrival(start_time):
+    graph = nx.DiGraph()
+    # The direct edge to "B" comes first, but the detour via "C" arrives earlier
+    graph.add_edge("A", "B", timetable=EdgeTimetable([28800], [30000], ["slow"]))
+    graph.add_edge("A", "C", timetable=EdgeTimetable([28860], [29100], ["fast"]))
+    graph.add_edge("C", "B", timetable=EdgeTimetable([29160], [29400], ["fast"]))
+    # A later trip that overtakes an earlier one on the same edge
+    graph.add_edge(
+        "B", "D", timetable=EdgeTimetable([29400, 29460], [30600, 29700], [1, 2])
+    )
+    stats = {}
+
+    result = time_dependent_reachable_nodes_via_bus_network(
+        "A", graph, start_time, start_time + timedelta(minutes=30), stats=stats
+    )
+
+    assert result["B"] == start_time + timedelta(seconds=600)
+    assert result["D"] == start_time + timedelta(seconds=900)
+    assert stats["labels_settled"] == 4
+    assert stats["labels_pushed"] >= stats["labels_settled"]
+
+
+def test_reachable_nodes_via_bus_network_reuses_dominating_arrival(start_time):
+    graph = nx.DiGraph()
+    graph.add_edge(
+        "A", "B", timetable=EdgeTimetable([29100, 29400], [29400, 29700], [1, 2])
+    )
+    graph.add_edge("B", "C", timetable=EdgeTimetable([29400], [29700], [1]))
+    graph.add_edge("C", "D", is_transfer=True, weight=1)
+    end_time = start_time + timedelta(minutes=30)
+    cache = ReachabilityCache(max_entries=2)
+
+    # Arrivals at 08:01 and 08:05 both board the departure at 08:05
+    for minutes in [1, 5, 6, 11]:
+        current_time = start_time + timedelta(minutes=minutes)
+        result = reachable_nodes_via_bus_network(
+            graph, "A", 30 - minutes, current_time, end_time, "normal", cache=cache
+        )
+        assert result == time_dependent_reachable_nodes_via_bus_network(
+            "A", graph, current_time, end_time
+        )
+
+    assert (cache.hits, cache.misses) == (1, 3)
+    # The least recently used result of the arrival at 08:01 was evicted
+    assert len(cache) == 2
+    assert ("A", start_time.replace(hour=0), 0) not in [
+        key[:3] for key in cache.entries
+    ]
+
+    # The stop after "C" is reached over a transfer, so only the same arrival is reused
+    for minutes in [20, 21, 20]:
+        reachable_nodes_via_bus_network(
+            graph,
+            "C",
+            10,
+            start_time + timedelta(minutes=minutes),
+            end_time,
+            "normal",
+            cache=cache,
+        )
+    assert (cache.hits, cache.misses) == (2, 5)
+
+
+def test_time_dependent_reachable_nodes_via_bus_network_long_route(start_time):
+    graph = nx.DiGraph()
+    for stop in range(5000):
+        graph.add_edge(
+            stop,
+            stop + 1,
+            timetable=EdgeTimetable([28800 + stop], [28801 + stop], ["trip"]),
+        )
+
+    result = time_dependent_reachable_nodes_via_bus_network(
+        0, graph, start_time, start_time + timedelta(minutes=90)
+    )
+
+    assert result[5000] == start_time + timedelta(seconds=5000)
+
+
+def test_time_dependent_reachable_nodes_with_precomputed_lane_durations(start_time):
+    end_time = start_time + timedelta(minutes=20)
+    bus_network = create_network_from_gtfs(
+        "london", base_path="", start_time=start_time, end_time=end_time
+    )
+    config = AnalysisConfig(rush_hour_speed=14, bus_speed=60)
+    expected = {
+        mode: time_dependent_reachable_nodes_via_bus_network(
+            "4", bus_network, start_time, end_time, mode=mode, config=config
+        )
+        for mode in ["rush_hour", "rush_hour_priority_lane"]
+    }
+
+    precompute_lane_durations(bus_network, config)
+
+    assert bus_network["4"]["6"]["lane_durations"]["rush_hour"] == get_lane_duration(
+        bus_network["4"]["6"], "rush_hour", config
+    )
+    # The search must not read the config file once the durations are stored
+    with patch("busability.utils.load_config_from_file", side_effect=AssertionError):
+        for mode, result in expected.items():
+            assert (
+                time_dependent_reachable_nodes_via_bus_network(
+                    "4", bus_network, start_time, end_time, mode=mode, config=config
+                )
+                == result
+            )
+
+
+def test_reachable_nodes_to_pois_matches_single_source_searches(start_time):
+    walk_graph = nx.gnm_random_graph(200, 600, seed=1)
+    for index, (source, target) in enumerate(walk_graph.edges):
+        walk_graph[source][target]["weight"] = index % 7 + 1
+    end_time = start_time + timedelta(minutes=30)
+    nodes_dict = {
+        node: start_time + timedelta(minutes=node % 25) for node in range(0, 200, 9)
+    }
+    nodes_dict[500] = start_time
+
+    expected = set()
+    for node, current_time in nodes_dict.items():
+        if node in walk_graph:
+            expected.update(
+                nx.single_source_dijkstra(
+                    walk_graph,
+                    node,
+                    weight="weight",
+                    cutoff=(end_time - current_time).total_seconds() / 60,
+                )[0]
+            )
+
+    assert reachable_nodes_to_pois(walk_graph, nodes_dict, end_time) == expected
+
+
 def test_get_bus_station_from_isochrone():
     isochrone_node = "test_1.0"
     result = get_bus_station_from_isochrone(isochrone_node)
     assert result == ("test", 1)
+
+
+def test_reachable_nodes_to_pois_with_walk_legs(walk_from_bus_stop, start_time):
+    isochrones = gpd.GeoDataFrame(
+        {"stop_id": ["7", "7", "4", "6"], "value": [120, 300, 60, 180]},
+        geometry=[Point(0, 0)] * 4,
+    )
+    walk_legs = create_walk_leg_index(isochrones, "stop_id")
+    nodes_dict = {
+        "7": start_time + timedelta(minutes=5),
+        "4": start_time + timedelta(minutes=9),
+        "6": start_time + timedelta(minutes=8),
+    }
+    result = reachable_nodes_to_pois(
+        walk_legs, nodes_dict, start_time + timedelta(minutes=10)
+    )
+    assert result == {"7", "7_2.0", "7_5.0", "4", "4_1.0", "6"}
+
+
+def test_get_multimodal_poi_directness_bitset(start_time):
+    graph = nx.DiGraph()
+    graph.add_edge("4", "6", timetable=EdgeTimetable([28920], [29100], [1]))
+    graph.add_edge("6", "7", timetable=EdgeTimetable([29100], [29340], [1]))
+    isochrones = gpd.GeoDataFrame(
+        {"stop_id": ["4", "6", "7", "7"], "value": [60, 180, 120, 300]},
+        geometry=[Point(0, 0)] * 4,
+    )
+    walk_legs = create_walk_leg_index(isochrones, "stop_id")
+
+    for start_node in walk_legs.nodes:
+        bitset = get_multimodal_poi_directness_bitset(
+            walk_legs, graph, start_node, start_time, 10, "normal"
+        )
+        nodes = get_multimodal_poi_directness(
+            walk_legs, graph, walk_legs, start_node, [], start_time, 10, "normal"
+        )
+        assert set(walk_legs.columns[bitset.indices()]) == {
+            node for node in nodes if "_" in node
+        }
+
+    bitset = get_multimodal_poi_directness_bitset(
+        walk_legs, graph, "4_1.0", start_time, 12, "normal"
+    )
+    row_nodes = walk_legs.column_positions(["7_2.0", "7_5.0", "8_1.0", "4_1.0"])
+    assert bitset.row_mask(row_nodes).tolist() == [True, False, False, True]
@@ -1,17 +1,41 @@
-from datetime import timedelta
+import shutil
+import time
+import zipfile
+from datetime import datetime, timedelta
 
+import geopandas as gpd
 import networkx as nx
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import Point
 
 from busability.network_preprocessing.network_creator import (
     calculate_distance,
     get_union_reachable_polygons,
     get_drive_isochrone,
+    get_outermost_isochrones,
     get_poi_inside_isochrone,
     create_network_from_gtfs,
     get_graphs,
     save_graph_to_file,
+    add_trip_edges,
+    gtfs_time_to_seconds,
+    get_time_window,
+    create_gtfs_graph,
+    read_stop_times,
+    create_network_from_gtfs_feed,
+    open_gtfs_file,
+    slice_timetable_graph,
 )
 from busability.network_preprocessing.network_creator import load_graph_from_file
+from busability.network_preprocessing.graph_store import read_graph_arrays
+from busability.network_preprocessing.timetable import EdgeTimetable
+from busability.network_preprocessing.walk_legs import (
+    create_walk_leg_index,
+    load_walk_leg_index,
+    save_walk_leg_index,
+)
 
 
 def test_calculate_distance(point1, point2):
@@ -31,6 +55,19 @@ def test_get_union_reachable_polygons(bus_isochrones_gdf):
     assert union_gdf.iloc[0]["APROXIMACION"] == "CALLE 24"
 
 
+def test_get_outermost_isochrones():
+    gdf = gpd.GeoDataFrame(
+        {"stop_id": ["1", "1", "2", "1"], "value": [600, 300, 300, 900]},
+        geometry=[Point(0, 0).buffer(radius) for radius in [2, 1, 1, 3]],
+    )
+
+    outermost_gdf, pruned = get_outermost_isochrones(gdf, "stop_id")
+
+    assert pruned == 2
+    assert outermost_gdf.index.tolist() == [2, 3]
+    assert outermost_gdf.union_all().equals(gdf.union_all())
+
+
 def test_get_drive_isochrone(drive_isos_gdf):
     drive_iso = get_drive_isochrone(drive_isos_gdf, "EL PORTILLO_2.0", "APROXIMACION")
     assert drive_iso is not None
@@ -69,7 +106,7 @@ def test_create_network_from_gtfs(start_time):
 def test_get_graphs(start_time, bus_isochrones_gdf):
     matching_column = "stop_id"
     end_time = start_time + timedelta(minutes=30)
-    bus_graph, walk_graph = get_graphs(
+    bus_graph, walk_legs = get_graphs(
         "london",
         start_time,
         end_time,
@@ -78,9 +115,38 @@ def test_get_graphs(start_time, bus_isochrones_gdf):
         path_to_gtfs="",
     )
     assert bus_graph is not None
-    assert walk_graph is not None
-    assert len(bus_graph.nodes) < len(walk_graph.nodes)
-    assert len(bus_graph.edges) < len(walk_graph.edges)
+    assert walk_legs is not None
+    assert sorted(walk_legs.nodes) == ["10_15.0", "9_15.0"]
+    assert all(stop in bus_graph for stop in walk_legs.stop_index)
+    assert walk_legs.reachable_nodes("9", 15).tolist() == ["9_15.0"]
+    assert walk_legs.reachable_nodes("9", 14).tolist() == []
+
+
+def test_save_walk_leg_index(tmp_path):
+    isochrones = gpd.GeoDataFrame(
+        {"stop_id": ["7", "7", "4", "6", "6"], "value": [300, 120, 60, 180, 180]},
+        geometry=[Point(0, 0)] * 5,
+    )
+    walk_legs = create_walk_leg_index(isochrones, "stop_id")
+    path = str(tmp_path / "walk_legs")
+
+    save_walk_leg_index(walk_legs, path)
+    walk_legs_loaded = load_walk_leg_index(path)
+
+    assert isinstance(walk_legs_loaded.indices, np.memmap)
+    assert (
+        walk_legs_loaded.nodes
+        == walk_legs.nodes
+        == ["4_1.0", "6_3.0", "7_2.0", "7_5.0"]
+    )
+    rows = [walk_legs_loaded.stop_index[stop] for stop in ["7", "4", "6", "7"]]
+    columns = walk_legs_loaded.reachable_columns(rows, np.array([4.5, 0.9, 3.0, -5.0]))
+    assert walk_legs_loaded.columns[columns].tolist() == ["7_2.0", "6_3.0"]
+    for stop, minutes in [("7", 4.5), ("7", 5), ("4", 0.9), ("6", 3)]:
+        assert (
+            walk_legs_loaded.reachable_nodes(stop, minutes).tolist()
+            == walk_legs.reachable_nodes(stop, minutes).tolist()
+        )
 
 
 def test_save_graph_to_file():
@@ -98,3 +164,334 @@ def test_save_graph_to_file():
 
     assert len(G.nodes) == len(G_loaded.nodes)
     assert len(G.edges) == len(G_loaded.edges)
+
+
+def _legacy_trip_edges(stop_times):
+    """Row-by-row edge construction used before add_trip_edges, kept as reference."""
+    G = nx.DiGraph()
+    for _, stop_time in stop_times.iterrows():
+        next_stop_time = stop_times[
+            (stop_times["trip_id"] == stop_time["trip_id"])
+            & (stop_times["stop_sequence"] == stop_time["stop_sequence"] + 1)
+        ]
+        if next_stop_time.empty:
+            continue
+        next_stop_time = next_stop_time.iloc[0]
+        today = datetime.combine(datetime.today(), datetime.min.time())
+        departure = today + timedelta(seconds=int(stop_time["departure_time"]))
+        arrival = today + timedelta(seconds=int(next_stop_time["arrival_time"]))
+        entry = {
+            "departure_time": departure.strftime("%Y-%m-%d %H:%M:%S"),
+            "arrival_time": arrival.strftime("%Y-%m-%d %H:%M:%S"),
+            "travel_time_minutes": (arrival - departure).total_seconds() / 60,
+            "trip_id": stop_time["trip_id"],
+        }
+        from_stop, to_stop = str(stop_time["stop_id"]), str(next_stop_time["stop_id"])
+        if G.has_edge(from_stop, to_stop):
+            G[from_stop][to_stop]["times"].append(entry)
+        else:
+            G.add_edge(from_stop, to_stop, times=[entry])
+    for _, _, edge_data in G.edges(data=True):
+        edge_data["timetable"] = EdgeTimetable.from_entries(edge_data.pop("times"))
+    return G
+
+
+def _window_stop_times(start, end):
+    stop_times = pd.read_csv("data/london/gtfs/stop_times.txt")
+    for column in ["arrival_time", "departure_time"]:
+        stop_times[column] = gtfs_time_to_seconds(stop_times[column])
+    start, end = get_time_window(start, end)
+    return stop_times[
+        (stop_times["departure_time"] >= start) & (stop_times["arrival_time"] <= end)
+    ]
+
+
+def test_add_trip_edges_matches_legacy_construction():
+    stop_times = _window_stop_times("08:00:00", "08:20:00")
+    # Repeat the feed with distinct trip ids to get a measurable workload
+    stop_times = pd.concat(
+        [
+            stop_times.assign(trip_id=stop_times["trip_id"] + copy * 10000)
+            for copy in range(50)
+        ],
+        ignore_index=True,
+    )
+
+    legacy_start = time.perf_counter()
+    legacy_graph = _legacy_trip_edges(stop_times)
+    legacy_duration = time.perf_counter() - legacy_start
+
+    vectorized_start = time.perf_counter()
+    graph = nx.DiGraph()
+    add_trip_edges(graph, stop_times)
+    vectorized_duration = time.perf_counter() - vectorized_start
+
+    assert list(graph.edges(data=True)) == list(legacy_graph.edges(data=True))
+    assert vectorized_duration < legacy_duration
+
+
+@pytest.mark.parametrize("order", ["reversed", "shuffled"])
+def test_add_trip_edges_unsorted_stop_times(order):
+    stop_times = _window_stop_times("08:00:00", "08:20:00")
+    if order == "reversed":
+        stop_times = stop_times.iloc[::-1]
+    else:
+        stop_times = stop_times.sample(frac=1, random_state=0)
+
+    graph = nx.DiGraph()
+    add_trip_edges(graph, stop_times)
+
+    legacy_graph = _legacy_trip_edges(stop_times)
+    assert len(legacy_graph.edges) > 0
+    assert list(graph.edges(data=True)) == list(legacy_graph.edges(data=True))
+
+
+def test_add_trip_edges_splits_reused_trip_ids():
+    stop_times = _window_stop_times("08:00:00", "08:30:00")
+    graph = nx.DiGraph()
+    add_trip_edges(graph, stop_times)
+
+    timetable = graph["7"]["9"]["timetable"]
+    assert timetable.departures.tolist() == [29520, 30120]
+    assert (timetable.arrivals - timetable.departures).tolist() == [60, 60]
+
+
+def test_gtfs_time_to_seconds():
+    times = pd.Series(["08:03:00", "25:10:00", " 7:05:30", "", None, "8:61:00"])
+    result = gtfs_time_to_seconds(times)
+    assert result.iloc[:3].tolist() == [28980, 90600, 25530]
+    assert result.iloc[3:].isna().all()
+
+
+def test_gtfs_time_to_seconds_empty():
+    result = gtfs_time_to_seconds(pd.Series([], dtype=object))
+    assert result.dtype == "Int32"
+    assert result.empty
+
+
+def test_create_network_from_gtfs_without_stop_times(start_time, tmp_path):
+    shutil.copytree("data/london/gtfs", tmp_path / "gtfs")
+    end_time = start_time + timedelta(minutes=30)
+    # No stop time in the window
+    graph = create_network_from_gtfs_feed(
+        str(tmp_path / "gtfs"), "03:00:00", "03:10:00"
+    )
+    assert len(graph.nodes) > 0
+    assert not any("timetable" in data for _, _, data in graph.edges(data=True))
+
+    # A header-only stop_times.txt
+    with open(tmp_path / "gtfs" / "stop_times.txt") as f:
+        header = f.readline()
+    with open(tmp_path / "gtfs" / "stop_times.txt", "w") as f:
+        f.write(header)
+    graph = create_network_from_gtfs_feed(str(tmp_path / "gtfs"), start_time, end_time)
+    assert len(graph.nodes) > 0
+    assert not any("timetable" in data for _, _, data in graph.edges(data=True))
+
+
+def test_get_time_window_past_midnight():
+    start = datetime.combine(
+        datetime.today(), datetime.strptime("23:50", "%H:%M").time()
+    )
+    assert get_time_window(start, start + timedelta(minutes=30)) == (85800, 87600)
+    assert get_time_window("24:50:00", "25:20:00") == (89400, 91200)
+
+
+def test_create_gtfs_graph_keeps_service_after_midnight():
+    stops = pd.DataFrame(
+        {
+            "stop_id": [1, 2],
+            "stop_name": ["A", "B"],
+            "stop_lat": [0.0, 0.0],
+            "stop_lon": [0.0, 1.0],
+        }
+    )
+    stop_times = pd.DataFrame(
+        {
+            "trip_id": [1, 1],
+            "arrival_time": ["23:55:00", "24:05:00"],
+            "departure_time": ["23:55:00", "24:05:00"],
+            "stop_id": [1, 2],
+            "stop_sequence": [1, 2],
+        }
+    )
+    start = datetime.combine(
+        datetime.today(), datetime.strptime("23:50", "%H:%M").time()
+    )
+    graph = create_gtfs_graph(
+        stops,
+        stop_times,
+        pd.DataFrame(),
+        pd.DataFrame(),
+        start,
+        start + timedelta(minutes=30),
+    )
+    timetable = graph["1"]["2"]["timetable"]
+    assert timetable.departures.tolist() == [86100]
+    assert timetable.arrivals.tolist() == [86700]
+
+
+def test_slice_timetable_graph_matches_windowed_build(start_time):
+    full_day_graph = create_network_from_gtfs("london", base_path="")
+
+    for minutes in [10, 30]:
+        end_time = start_time + timedelta(minutes=minutes)
+        windowed_graph = create_network_from_gtfs(
+            "london", base_path="", start_time=start_time, end_time=end_time
+        )
+        sliced_graph = slice_timetable_graph(full_day_graph, start_time, end_time)
+
+        assert dict(sliced_graph.nodes(data=True)) == dict(
+            windowed_graph.nodes(data=True)
+        )
+        assert {
+            (source, target): data
+            for source, target, data in sliced_graph.edges(data=True)
+        } == {
+            (source, target): data
+            for source, target, data in windowed_graph.edges(data=True)
+        }
+
+
+def test_edge_timetable_window():
+    timetable = EdgeTimetable([100, 200, 300, 400], [150, 500, 350, 450], [1, 2, 3, 4])
+
+    window = timetable.window(200, 400)
+
+    assert window.departures.tolist() == [300]
+    assert window.trip_ids.tolist() == [3]
+    assert np.shares_memory(timetable.window(100, 500).departures, timetable.departures)
+    assert len(timetable.window(500, 600)) == 0
+
+
+def test_edge_timetable_earliest_arrival():
+    # The trip departing at 200 is overtaken by the one departing at 300
+    timetable = EdgeTimetable([100, 200, 300, 400], [150, 500, 350, 350], [1, 2, 3, 4])
+
+    times = [0, 101, 201, 301, 401]
+    assert [timetable.earliest_arrival(time) for time in times] == [0, 2, 2, 3, -1]
+    assert timetable.next_departure(101) == 1
+
+
+def test_edge_timetable_trip_index():
+    timetable = EdgeTimetable([100, 200, 300, 400], [150, 250, 350, 450], list("abab"))
+
+    assert timetable.trip_index("b") == 1
+    assert timetable.trip_index(timetable.trip_ids[2]) == 0
+    assert timetable.trip_index("c") == -1
+
+
+def test_save_graph_with_timetable_to_file(start_time, tmp_path):
+    graph = create_network_from_gtfs(
+        "london",
+        base_path="",
+        start_time=start_time,
+        end_time=start_time + timedelta(minutes=30),
+    )
+    path = str(tmp_path / "bus_graph.gml")
+
+    save_graph_to_file(graph, path)
+    graph_loaded = load_graph_from_file(path)
+
+    assert list(graph_loaded.edges) == list(graph.edges)
+    for from_stop, to_stop, edge_data in graph.edges(data=True):
+        if "timetable" in edge_data:
+            assert (
+                graph_loaded[from_stop][to_stop]["timetable"] == edge_data["timetable"]
+            )
+
+
+def test_save_graph_to_binary_file(start_time, tmp_path):
+    graph = create_network_from_gtfs(
+        "london",
+        base_path="",
+        start_time=start_time,
+        end_time=start_time + timedelta(minutes=30),
+    )
+    path = str(tmp_path / "bus_graph")
+
+    save_graph_to_file(graph, path)
+    graph_loaded = load_graph_from_file(path)
+
+    assert list(graph_loaded.nodes(data=True)) == list(graph.nodes(data=True))
+    assert list(graph_loaded.edges) == list(graph.edges)
+    for from_stop, to_stop, edge_data in graph.edges(data=True):
+        loaded_data = graph_loaded[from_stop][to_stop]
+        assert loaded_data.get("timetable") == edge_data.get("timetable")
+        assert loaded_data.get("is_transfer") == edge_data.get("is_transfer")
+        assert float(loaded_data.get("len_two_lanes", 0)) == float(
+            edge_data.get("len_two_lanes", 0)
+        )
+
+    arrays = read_graph_arrays(path)
+    assert isinstance(arrays["timetable_departures"], np.memmap)
+    assert not graph_loaded["4"]["6"]["timetable"].departures.flags.owndata
+
+
+def test_read_stop_times_filters_window_per_chunk():
+    path = "data/london/gtfs/stop_times.txt"
+    stop_times = read_stop_times(path, "08:00:00", "08:20:00", chunksize=4)
+
+    assert stop_times.equals(read_stop_times(path, "08:00:00", "08:20:00"))
+    assert stop_times["stop_sequence"].dtype == "int32"
+    assert stop_times["departure_time"].dtype == "Int32"
+    # Only the stops inside the window are kept
+    trip = stop_times[stop_times["trip_id"] == "2002"]
+    assert trip["departure_time"].tolist() == [30000]
+    assert stop_times["departure_time"].between(28800, 30000).all()
+
+
+def test_create_network_from_gtfs_keeps_leading_zeros(start_time, tmp_path):
+    shutil.copytree("data/london/gtfs", tmp_path / "gtfs")
+    for name, columns in [
+        ("stops.txt", ["stop_id"]),
+        ("stop_times.txt", ["stop_id"]),
+        ("transfers.txt", ["from_stop_id", "to_stop_id"]),
+        ("lanes.txt", ["start_id", "end_id"]),
+    ]:
+        table = pd.read_csv(tmp_path / "gtfs" / name, dtype=str)
+        for column in columns:
+            table[column] = "00" + table[column]
+        table.to_csv(tmp_path / "gtfs" / name, index=False)
+
+    graph = create_network_from_gtfs_feed(
+        str(tmp_path / "gtfs"), start_time, start_time + timedelta(minutes=30)
+    )
+
+    assert "004" in graph.nodes
+    assert graph["008"]["006"]["is_transfer"]
+    assert graph["006"]["009"]["len_two_lanes"] == "100"
+
+
+def test_create_network_from_gtfs_zip(start_time, tmp_path):
+    end_time = start_time + timedelta(minutes=30)
+    graph_from_zip = create_network_from_gtfs_feed(
+        "data/london/gtfs.zip", start_time, end_time
+    )
+    with zipfile.ZipFile("data/london/gtfs.zip") as archive:
+        archive.extractall(tmp_path)
+    graph_from_directory = create_network_from_gtfs_feed(
+        str(tmp_path / "gtfs"), start_time, end_time
+    )
+
+    assert len(graph_from_zip.edges) > 0
+    assert list(graph_from_zip.nodes(data=True)) == list(
+        graph_from_directory.nodes(data=True)
+    )
+    assert list(graph_from_zip.edges) == list(graph_from_directory.edges)
+    for from_stop, to_stop, edge_data in graph_from_zip.edges(data=True):
+        assert edge_data.get("timetable") == graph_from_directory[from_stop][
+            to_stop
+        ].get("timetable")
+    # The archive has no lanes.txt
+    assert all(
+        "len_two_lanes" not in edge_data
+        for _, _, edge_data in graph_from_zip.edges(data=True)
+    )
+
+
+def test_open_gtfs_file_missing_file():
+    with open_gtfs_file("data/london/gtfs.zip", "lanes.txt") as file:
+        assert file is None
+    with open_gtfs_file("data/london/gtfs.zip", "stops.txt") as file:
+        assert file.readline().startswith(b"stop_id")
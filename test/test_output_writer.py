@@ -0,0 +1,41 @@
+import geopandas as gpd
+import pytest
+from shapely import Point
+
+from busability.output_writer import GeoDataFrameWriter, get_output_file
+
+
+@pytest.mark.parametrize("output_format", ["gpkg", "geojson"])
+def test_geodataframe_writer(tmp_path, output_format):
+    path = get_output_file(str(tmp_path / "output"), output_format)
+    gdfs = [
+        gpd.GeoDataFrame(
+            {"stop_id": [f"{index}_5.0"]},
+            geometry=[Point(index, 0).buffer(1)],
+            crs=4326,
+        )
+        for index in range(5)
+    ]
+
+    with GeoDataFrameWriter(path, batch_rows=2) as writer:
+        for gdf in [*gdfs[:3], None, *gdfs[3:]]:
+            writer.write(gdf)
+        # Full batches are written while the frames arrive
+        assert writer.rows_written == 4
+
+    written = gpd.read_file(path)
+    assert written["stop_id"].tolist() == [f"{index}_5.0" for index in range(5)]
+    assert (written.geom_type == "Polygon").all()
+
+    # A new writer replaces the output of an earlier run
+    with GeoDataFrameWriter(path) as writer:
+        writer.write(gdfs[0])
+    assert len(gpd.read_file(path)) == 1
+
+
+def test_get_output_file():
+    assert get_output_file("results/Lima_union_polygon", "gpkg") == (
+        "results/Lima_union_polygon.gpkg"
+    )
+    with pytest.raises(ValueError):
+        get_output_file("results/Lima_union_polygon", "shp")
@@ -0,0 +1,119 @@
+import gc
+
+import geopandas as gpd
+import pandas as pd
+import pytest
+import yaml
+from shapely import Point
+
+import busability.get_poi_ratio as get_poi_ratio
+
+from busability.checkpoint import is_shard_done, shard_directory, write_shard
+from busability.get_poi_ratio import POI_RATIO_COLUMNS, write_poi_ratio_shard
+
+
+@pytest.fixture
+def hexagons():
+    return gpd.GeoDataFrame(
+        {"uuid": ["a", "b"]}, geometry=[Point(0, 0), Point(1, 1)], crs=4326
+    )
+
+
+def test_write_poi_ratio_shard(tmp_path, hexagons):
+    bus_gdf = gpd.GeoDataFrame(geometry=[Point(0, 0).buffer(1)], crs=4326)
+
+    write_shard(
+        tmp_path,
+        0,
+        lambda directory: write_poi_ratio_shard(
+            directory, [(0, 0.5, 1, 2, bus_gdf), (1, 0, 0, 0, None)], hexagons
+        ),
+    )
+
+    poi_ratios = pd.read_csv(
+        shard_directory(tmp_path, 0) + "/poi_ratio.csv", index_col=0
+    )
+    assert poi_ratios["poi_ratio"].tolist() == [0.5, 0]
+
+
+def test_write_poi_ratio_shard_keeps_failed_shard_pending(tmp_path, hexagons):
+    with pytest.raises(RuntimeError, match=r"\[1\]"):
+        write_shard(
+            tmp_path,
+            0,
+            lambda directory: write_poi_ratio_shard(
+                directory,
+                [(0, 0.5, 1, 2, None), (1, None, None, None, None)],
+                hexagons,
+            ),
+        )
+
+    assert not is_shard_done(tmp_path, 0)
+
+
+def test_write_poi_ratio_shard_keeps_failed_rows_as_nan(tmp_path, hexagons):
+    write_shard(
+        tmp_path,
+        0,
+        lambda directory: write_poi_ratio_shard(
+            directory,
+            [(0, 0.5, 1, 2, None), (1, None, None, None, None)],
+            hexagons,
+            keep_failed_rows=True,
+        ),
+    )
+
+    poi_ratios = pd.read_csv(
+        shard_directory(tmp_path, 0) + "/poi_ratio.csv", index_col=0
+    )
+    assert poi_ratios.loc[0, "poi_ratio"] == 0.5
+    assert poi_ratios.loc[1].isna().all()
+
+
+def fail_second_row(row):
+    if row.name == 1:
+        return row.name, None, None, None, None
+    return row.name, 0.5, 1, 2, None
+
+
+def test_main_completes_when_a_row_always_fails(tmp_path, hexagons, monkeypatch):
+    config = {
+        name: str(tmp_path / f"{name}.gpkg") for name in get_poi_ratio.INPUT_PATHS
+    }
+    config.update(
+        {
+            "city_name": "Test",
+            "crs": 4326,
+            "matching_column": "uuid",
+            "output_path": f"{tmp_path}/",
+            "checkpoint_path": str(tmp_path / "checkpoints"),
+            "shard_size": 1,
+            "output_format": "gpkg",
+        }
+    )
+    for name in get_poi_ratio.INPUT_PATHS:
+        hexagons.to_file(config[name], driver="GPKG")
+    config_path = str(tmp_path / "config.yml")
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f)
+
+    def load_inputs(config_path):
+        get_poi_ratio.worker_state.update(
+            {"hexagons_centroids_gdf": hexagons.copy(), "matching_column": "uuid"}
+        )
+
+    monkeypatch.setattr(get_poi_ratio, "worker_state", {})
+    monkeypatch.setattr(get_poi_ratio, "load_inputs", load_inputs)
+    monkeypatch.setattr(get_poi_ratio, "process_row", fail_second_row)
+    monkeypatch.setattr(get_poi_ratio, "cpu_count", lambda: 2)
+
+    for _ in range(get_poi_ratio.MAX_SHARD_ATTEMPTS - 1):
+        with pytest.raises(RuntimeError, match=r"Shards \[1\] are pending"):
+            get_poi_ratio.main(config_path)
+        get_poi_ratio.worker_state.clear()
+    get_poi_ratio.main(config_path)
+    assert gc.get_freeze_count() == 0
+
+    output = gpd.read_file(tmp_path / "Test_poi_ratio_for_reachable_nodes.gpkg")
+    assert output.loc[0, "poi_ratio"] == 0.5
+    assert output[POI_RATIO_COLUMNS].iloc[1].isna().all()
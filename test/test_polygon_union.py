@@ -0,0 +1,88 @@
+import numpy as np
+import shapely
+
+from busability.network_processing.polygon_union import (
+    PolygonUnionCache,
+    get_outermost_rows,
+    get_row_blocks,
+)
+
+
+def get_isochrones():
+    # Three bands for each of six stops along a line
+    geometries = np.array(
+        [
+            shapely.Point(stop, 0).buffer(radius)
+            for stop in range(6)
+            for radius in [0.2, 0.4, 0.6]
+        ]
+    )
+    return geometries, np.repeat(np.arange(6), 3)
+
+
+def test_get_row_blocks():
+    geometries, row_stops = get_isochrones()
+
+    row_blocks = get_row_blocks(geometries, row_stops, block_size=2)
+
+    # All bands of a stop share a block and every block has two stops
+    assert all(len(set(row_blocks[row_stops == stop])) == 1 for stop in range(6))
+    assert np.bincount(row_blocks).tolist() == [6, 6, 6]
+
+
+def test_polygon_union_cache():
+    geometries, row_stops = get_isochrones()
+    cache = PolygonUnionCache(
+        lambda rows: geometries[rows],
+        row_stops,
+        get_row_blocks(geometries, row_stops, block_size=2),
+    )
+
+    for rows in [[0, 1, 5, 8, 17], [5, 8, 1, 0, 17], [2, 5, 8, 14]]:
+        union = cache.union(np.array(rows))
+        assert union.equals(shapely.union_all(geometries[rows]))
+
+    # The second union reuses all partial unions of the first
+    assert cache.hits >= 5
+    assert len(cache) == cache.misses
+
+
+def test_polygon_union_cache_evicts_least_recently_used():
+    geometries, row_stops = get_isochrones()
+    cache = PolygonUnionCache(
+        lambda rows: geometries[rows], row_stops, row_stops, max_bytes=1
+    )
+
+    cache.union(np.array([0, 1]))
+    cache.union(np.array([3]))
+
+    assert len(cache) == 1
+    # Only the last union, of the block of stop 1, fits into the budget
+    assert list(cache.entries) == [("block", np.array([3]).tobytes())]
+
+
+def test_get_outermost_rows():
+    geometries, row_stops = get_isochrones()
+    row_values = np.tile([300, 600, 900], 6)
+
+    rows, pruned = get_outermost_rows(
+        np.array([0, 1, 2, 4, 9, 13]), row_stops, row_values
+    )
+
+    assert rows.tolist() == [2, 4, 9, 13]
+    assert pruned == 2
+
+
+def test_polygon_union_cache_prunes_nested_bands():
+    geometries, row_stops = get_isochrones()
+    cache = PolygonUnionCache(
+        lambda rows: geometries[rows],
+        row_stops,
+        row_stops,
+        row_values=np.tile([300, 600, 900], 6),
+    )
+
+    union = cache.union(np.arange(9))
+
+    assert union.equals(shapely.union_all(geometries[:9]))
+    assert cache.pruned == 6
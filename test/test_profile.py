@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+import geopandas as gpd
+import pytest
+from shapely import Point
+
+from busability.network_preprocessing.network_creator import create_network_from_gtfs
+from busability.network_preprocessing.walk_legs import create_walk_leg_index
+from busability.network_processing.csa import create_csa_timetable, csa_reachable_nodes
+from busability.network_processing.network_analyzer import (
+    get_bus_network,
+    get_multimodal_poi_directness,
+    get_multimodal_poi_directness_profile,
+)
+from busability.network_processing.profile import (
+    csa_profile,
+    insert_pair,
+    profile_reachable_nodes,
+)
+
+
+def test_profile_matches_single_queries(start_time):
+    graph = create_network_from_gtfs("london", base_path="")
+    timetable = create_csa_timetable(graph)
+
+    for start_node in graph.nodes:
+        profile = csa_profile(
+            timetable, start_node, start_time, start_time + timedelta(minutes=60)
+        )
+        for minute in range(0, 31):
+            departure_time = start_time + timedelta(minutes=minute)
+            end_time = departure_time + timedelta(minutes=30)
+            assert profile_reachable_nodes(
+                profile, departure_time, end_time
+            ) == csa_reachable_nodes(timetable, start_node, departure_time, end_time)
+
+
+def test_insert_pair_keeps_pareto_set():
+    pairs = {}
+    assert insert_pair(pairs, 0, 100, 200)
+    assert insert_pair(pairs, 0, 160, 250)
+    assert not insert_pair(pairs, 0, 90, 220)
+    # Departs later and arrives earlier than both pairs
+    assert insert_pair(pairs, 0, 170, 190)
+
+    assert pairs[0] == ([170], [190])
+
+
+def test_multimodal_poi_directness_profile(start_time):
+    graph = create_network_from_gtfs("london", base_path="")
+    isochrones = gpd.GeoDataFrame(
+        {"stop_id": ["4", "4", "7", "9"], "value": [60, 300, 120, 600]},
+        geometry=[Point(0, 0)] * 4,
+    )
+    walk_legs = create_walk_leg_index(isochrones, "stop_id")
+    bus_network = get_bus_network(graph, engine="csa")
+    departure_times = [start_time + timedelta(minutes=minute) for minute in range(30)]
+
+    for start_node in walk_legs.nodes:
+        result = get_multimodal_poi_directness_profile(
+            bus_network, walk_legs, start_node, departure_times, weight_threshold=20
+        )
+        assert result == {
+            departure_time: get_multimodal_poi_directness(
+                walk_legs,
+                graph,
+                walk_legs,
+                start_node,
+                [],
+                start_time=departure_time,
+                weight_threshold=20,
+                mode="normal",
+            )
+            for departure_time in departure_times
+        }
+
+    with pytest.raises(ValueError):
+        get_multimodal_poi_directness_profile(
+            graph, walk_legs, "4_1.0", departure_times, weight_threshold=20
+        )
@@ -0,0 +1,88 @@
+from datetime import timedelta
+
+import networkx as nx
+import pytest
+
+from busability.network_preprocessing.network_creator import create_network_from_gtfs
+from busability.network_preprocessing.timetable import EdgeTimetable
+from busability.network_processing.network_analyzer import (
+    get_bus_network,
+    reachable_nodes_via_bus_network,
+    time_dependent_reachable_nodes_via_bus_network,
+)
+from busability.network_processing.raptor import (
+    create_raptor_timetable,
+    raptor_reachable_nodes,
+)
+
+
+def test_raptor_matches_dijkstra(start_time):
+    graph = create_network_from_gtfs("london", base_path="")
+    timetable = create_raptor_timetable(graph)
+
+    for start_node in graph.nodes:
+        for offset, minutes in [(0, 10), (0, 30), (5, 20), (15, 45)]:
+            query_start = start_time + timedelta(minutes=offset)
+            query_end = query_start + timedelta(minutes=minutes)
+            assert raptor_reachable_nodes(
+                timetable, start_node, query_start, query_end
+            ) == time_dependent_reachable_nodes_via_bus_network(
+                start_node, graph, query_start, query_end
+            )
+
+
+def test_raptor_max_transfers(start_time):
+    graph = nx.DiGraph()
+    graph.add_edge("A", "B", timetable=EdgeTimetable([28800], [29100], [1]))
+    graph.add_edge("B", "C", timetable=EdgeTimetable([29200], [29400], [2]))
+    graph.add_edge("C", "D", weight=2, is_transfer=True)
+    graph.add_edge("D", "E", timetable=EdgeTimetable([29600], [29800], [3]))
+    end_time = start_time + timedelta(minutes=30)
+
+    assert raptor_reachable_nodes(
+        create_raptor_timetable(graph), "A", start_time, end_time
+    ).keys() == {"A", "B", "C", "D", "E"}
+    assert raptor_reachable_nodes(
+        create_raptor_timetable(graph, max_transfers=1), "A", start_time, end_time
+    ).keys() == {"A", "B", "C", "D"}
+    assert raptor_reachable_nodes(
+        create_raptor_timetable(graph, max_transfers=0), "A", start_time, end_time
+    ).keys() == {"A", "B"}
+
+
+def test_raptor_overtaking_trip(start_time):
+    graph = nx.DiGraph()
+    graph.add_edge(
+        "A", "B", timetable=EdgeTimetable([28800, 28860], [29400, 29000], [1, 2])
+    )
+    graph.add_edge(
+        "B", "C", timetable=EdgeTimetable([29000, 29460], [29100, 29500], [2, 1])
+    )
+
+    result = raptor_reachable_nodes(
+        create_raptor_timetable(graph),
+        "A",
+        start_time,
+        start_time + timedelta(minutes=30),
+    )
+
+    assert result["B"] == start_time + timedelta(seconds=200)
+    assert result["C"] == start_time + timedelta(seconds=300)
+
+
+def test_raptor_engine_only_supports_normal_mode(start_time):
+    graph = create_network_from_gtfs("london", base_path="")
+    bus_network = get_bus_network(graph, engine="raptor")
+    end_time = start_time + timedelta(minutes=30)
+
+    assert reachable_nodes_via_bus_network(
+        bus_network, "4", 30, start_time, end_time, mode="normal"
+    ) == time_dependent_reachable_nodes_via_bus_network(
+        "4", graph, start_time, end_time
+    )
+    with pytest.raises(ValueError):
+        reachable_nodes_via_bus_network(
+            bus_network, "4", 30, start_time, end_time, mode="rush_hour"
+        )
+    with pytest.raises(ValueError):
+        get_bus_network(graph, engine="unknown")
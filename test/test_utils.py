@@ -1,7 +1,16 @@
-from busability.utils import load_config_from_file
+import pytest
+
+from busability.utils import AnalysisConfig, load_config_from_file
 
 
 def test_load_config_from_file():
     result = load_config_from_file()
     assert result is not None
     assert isinstance(result, dict)
+
+
+def test_analysis_config_from_file():
+    config = AnalysisConfig.from_file("config.yml")
+    assert config == AnalysisConfig(mode="normal", rush_hour_speed=14, bus_speed=60)
+    with pytest.raises(FileNotFoundError):
+        AnalysisConfig.from_file("missing.yml")
@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+import pytest
+from shapely import Point, Polygon
+
+from busability.network_processing.connections import CONNECTION_DTYPE
+from busability.worker_runtime import (
+    SharedArrays,
+    geometries_from_arrays,
+    geometry_arrays,
+    worker_chunksize,
+)
+
+
+def test_shared_arrays(tmp_path):
+    connections = np.zeros(3, CONNECTION_DTYPE)
+    connections["departure"] = [1, 2, 3]
+    arrays = {"connections": connections, "stops": np.array(["4", "10", "6"])}
+
+    with SharedArrays(arrays, directory=str(tmp_path)) as shared_arrays:
+        attached = shared_arrays.attach()
+        assert isinstance(attached["connections"], np.memmap)
+        assert attached["connections"]["departure"].tolist() == [1, 2, 3]
+        assert attached["stops"].tolist() == ["4", "10", "6"]
+        with pytest.raises(ValueError):
+            attached["stops"][0] = "5"
+    assert not os.path.exists(shared_arrays.directory)
+
+
+def test_geometry_arrays():
+    geometries = [
+        Point(0, 0).buffer(1),
+        Polygon([(0, 0), (1, 0), (1, 1)]),
+        Point(3, 4),
+    ]
+
+    arrays = geometry_arrays(geometries, prefix="iso")
+
+    assert arrays["iso_wkb"].dtype == np.uint8
+    result = geometries_from_arrays(arrays["iso_wkb"], arrays["iso_offsets"], [2, 0])
+    assert result[0].equals(geometries[2])
+    assert result[1].equals(geometries[0])
+
+
+def test_worker_chunksize():
+    assert worker_chunksize(1000, 4) == 63
+    assert worker_chunksize(3, 8) == 1
+    assert worker_chunksize(10, 0) == 3